@@ -0,0 +1,114 @@
+"""
+Simulated API consumers: many WebSocket clients on /api/feed/stream and a
+REST polling mix on /api/feed.
+"""
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+
+import httpx
+import websockets
+
+from harness import Latencies
+
+
+def _parse_datetime(value: str) -> datetime:
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+
+class StreamClients:
+    """
+    Keeps `count` stream connections open and records, for each message
+    received, the time since its `created_at` (its synthetic post time).
+    """
+
+    def __init__(self, ws_url: str, count: int, first_message_id: int):
+        self.ws_url = ws_url
+        self.count = count
+        self.first_message_id = first_message_id
+        self.latencies = Latencies()
+        self.received = 0
+        self.failed = 0
+        self._connections = []
+        self._readers: list[asyncio.Task] = []
+
+    async def connect(self, batch: int = 100):
+        """Opens the connections, `batch` at a time."""
+        for start in range(0, self.count, batch):
+            results = await asyncio.gather(
+                *(
+                    websockets.connect(self.ws_url, subprotocols=["json"], max_queue=None)
+                    for _ in range(min(batch, self.count - start))
+                ),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    self.failed += 1
+                else:
+                    self._connections.append(result)
+        self._readers = [asyncio.create_task(self._read(ws)) for ws in self._connections]
+
+    async def _read(self, ws):
+        try:
+            async for frame in ws:
+                received_at = time.time()
+                message = json.loads(frame)
+                if "type" in message or message.get("id", 0) < self.first_message_id:
+                    continue
+                self.received += 1
+                self.latencies.add(received_at - _parse_datetime(message["created_at"]).timestamp())
+        except websockets.ConnectionClosed:
+            pass
+
+    async def close(self):
+        await asyncio.gather(*(ws.close() for ws in self._connections), return_exceptions=True)
+        for reader in self._readers:
+            reader.cancel()
+        await asyncio.gather(*self._readers, return_exceptions=True)
+
+
+async def rest_load(
+    base_url: str, concurrency: int, duration: float, page_size: int = 50, seed: int = 0
+) -> tuple[Latencies, int, int]:
+    """
+    Polls /api/feed from `concurrency` workers for `duration` seconds: mostly
+    first-page polls revalidated with If-None-Match, sometimes followed by
+    the next page via the cursor.
+
+    Returns the latencies, the number of requests and the number of errors.
+    """
+    latencies = Latencies()
+    counts = {"requests": 0, "errors": 0}
+    deadline = time.perf_counter() + duration
+
+    async def worker(client: httpx.AsyncClient, rng: random.Random):
+        etag = None
+        while time.perf_counter() < deadline:
+            headers = {"If-None-Match": etag} if etag else {}
+            params = {"limit": page_size}
+            started = time.perf_counter()
+            response = await client.get("/api/feed", params=params, headers=headers)
+            latencies.add(time.perf_counter() - started)
+            counts["requests"] += 1
+            if response.status_code not in (200, 304):
+                counts["errors"] += 1
+                continue
+            etag = response.headers.get("ETag", etag)
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor and rng.random() < 0.2:
+                started = time.perf_counter()
+                response = await client.get("/api/feed", params={**params, "cursor": cursor})
+                latencies.add(time.perf_counter() - started)
+                counts["requests"] += 1
+                if response.status_code != 200:
+                    counts["errors"] += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        await asyncio.gather(*(worker(client, random.Random(seed + i)) for i in range(concurrency)))
+    return latencies, counts["requests"], counts["errors"]
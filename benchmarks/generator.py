@@ -0,0 +1,113 @@
+"""
+Synthetic Telegram traffic for the collector.
+
+Builds fake NewMessage events for many fake channels and feeds them to the
+collector's real `handle_new_message` at a fixed rate, so everything from
+the handler on (spool, batching, Postgres writes, NOTIFY) is exercised.
+Requires `services/collector` on sys.path (see `run.py`).
+"""
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from app import storage, telegram_client
+from app.entity_cache import CachedChannel
+
+# Far above real channel IDs, so benchmark rows are easy to tell apart.
+FAKE_CHANNEL_BASE = 9_000_000_000
+_HEX = "0123456789abcdef"
+
+
+def fake_channels(count: int) -> list[CachedChannel]:
+    return [
+        CachedChannel(id=FAKE_CHANNEL_BASE + i, title=f"Bench channel {i}", access_hash=i)
+        for i in range(count)
+    ]
+
+
+def track(channels: list[CachedChannel]):
+    """Makes the handler accept updates from the fake channels."""
+    telegram_client._tracked_channels.update({channel.peer_id: channel for channel in channels})
+
+
+def fake_text(rng: random.Random) -> str:
+    """A call-like message with a ticker and, sometimes, a contract address."""
+    text = f"${rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ')}{rng.randint(1, 50)} looking ready, entry now"
+    if rng.random() < 0.3:
+        text += " 0x" + "".join(rng.choice(_HEX) for _ in range(40))
+    return text
+
+
+def fake_event(channel: CachedChannel, message_id: int, text: str):
+    return SimpleNamespace(
+        chat_id=channel.peer_id,
+        chat=SimpleNamespace(title=channel.title),
+        # Microsecond dates (Telegram's are whole seconds) so clients can
+        # measure end-to-end latency from `created_at`.
+        message=SimpleNamespace(id=message_id, text=text, date=datetime.now(timezone.utc)),
+    )
+
+
+async def generate(
+    channels: list[CachedChannel],
+    rate: float,
+    duration: float,
+    first_message_id: int,
+    seed: int = 0,
+    tick: float = 0.01,
+) -> int:
+    """
+    Sends `rate` messages per second, spread over `channels`, for
+    `duration` seconds. Handlers run concurrently, as Telethon runs them.
+
+    Returns the number of messages sent; their IDs start at `first_message_id`.
+    """
+    rng = random.Random(seed)
+    tasks = set()
+    sent = 0
+    started = time.perf_counter()
+    while (elapsed := time.perf_counter() - started) < duration:
+        due = int(elapsed * rate) + 1
+        for _ in range(due - sent):
+            event = fake_event(rng.choice(channels), first_message_id + sent, fake_text(rng))
+            task = asyncio.create_task(telegram_client.handle_new_message(event))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+        await asyncio.sleep(tick)
+    await asyncio.gather(*tasks)
+    return sent
+
+
+async def count_stored(first_message_id: int) -> int:
+    async with storage.AsyncSession() as session:
+        query = storage.sqlalchemy.select(storage.func.count()).where(
+            storage.messages.c.id >= first_message_id
+        )
+        return (await session.execute(query)).scalar()
+
+
+async def wait_until_stored(first_message_id: int, expected: int, timeout: float) -> tuple[int, float]:
+    """Waits for the sent messages to be committed; returns (stored, seconds waited)."""
+    started = time.perf_counter()
+    stored = 0
+    while time.perf_counter() - started < timeout:
+        stored = await count_stored(first_message_id)
+        if stored >= expected:
+            break
+        await asyncio.sleep(0.1)
+    return stored, time.perf_counter() - started
+
+
+async def cleanup(first_message_id: int):
+    """Deletes the benchmark's rows."""
+    async with storage.AsyncSession() as session:
+        async with session.begin():
+            for table in (storage.message_mentions, storage.messages):
+                column = table.c.message_id if table is storage.message_mentions else table.c.id
+                await session.execute(table.delete().where(column >= first_message_id))
+            await session.execute(
+                storage.channels.delete().where(storage.channels.c.id >= FAKE_CHANNEL_BASE)
+            )
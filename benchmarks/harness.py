@@ -0,0 +1,106 @@
+"""
+Shared pieces of the benchmark suite: latency recording, process memory,
+and saving results and comparing them against a baseline.
+"""
+import json
+import math
+import os
+import platform
+from datetime import datetime, timezone
+
+# Whether a larger value of a result is better; results not listed are
+# reported but not checked for regressions.
+HIGHER_IS_BETTER = {
+    "ingest_msgs_per_sec": True,
+    "e2e_p50_ms": False,
+    "e2e_p99_ms": False,
+    "ws_delivered_ratio": True,
+    "ws_mem_per_conn_kb": False,
+    "rest_rps": True,
+    "rest_p50_ms": False,
+    "rest_p99_ms": False,
+}
+
+
+class Latencies:
+    """Collects latency samples, in seconds."""
+
+    def __init__(self):
+        self.samples: list[float] = []
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def percentile(self, p: float) -> float | None:
+        """Nearest-rank percentile, or None without samples."""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        rank = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+        return ordered[rank]
+
+    def percentile_ms(self, p: float) -> float | None:
+        value = self.percentile(p)
+        return None if value is None else round(value * 1000, 2)
+
+
+def rss_bytes(pid: int) -> int:
+    """Resident memory of a process, from /proc (Linux only)."""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError(f"No VmRSS for process {pid}")
+
+
+def environment() -> dict:
+    """Describes the machine, so results are only compared like for like."""
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def save(path: str, results: dict, params: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"params": params, "results": results, "environment": environment()}, f, indent=2)
+        f.write("\n")
+
+
+def load(path: str) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns a description of every result that is worse than the baseline
+    by more than `tolerance` (a fraction).
+    """
+    regressions = []
+    for name, higher_is_better in HIGHER_IS_BETTER.items():
+        current, previous = results.get(name), baseline.get(name)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{name}: {previous} -> {current} ({change:+.0%})")
+    return regressions
+
+
+def report(results: dict, baseline: dict | None):
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        line = f"  {name:<{width}}  {value}"
+        if baseline and baseline.get(name) is not None:
+            line += f"  (baseline {baseline[name]})"
+        print(line)
@@ -12,6 +12,10 @@ export function useMessageFeed() {
   const ws = useRef<WebSocket | null>(null);
 
   useEffect(() => {
+    let lastSeenId: number | null = null;
+    let reconnectTimer: ReturnType<typeof setTimeout> | null = null;
+    let closedByUnmount = false;
+
     async function fetchInitialMessages() {
       try {
         const response = await fetch(`${API_URL}/api/feed?limit=50`);
@@ -19,7 +23,11 @@ export function useMessageFeed() {
           throw new Error("Failed to fetch initial messages");
         }
         const data: Message[] = await response.json();
+        if (data.length > 0) {
+          lastSeenId = data[0].id;
+        }
         setMessages(data);
+        setError(null);
       } catch (err) {
         setError(err instanceof Error ? err.message : "An unknown error occurred");
       } finally {
@@ -27,32 +35,57 @@ export function useMessageFeed() {
       }
     }
 
-    fetchInitialMessages();
+    function connect() {
+      // On reconnect, ask the server to replay what we missed while offline.
+      const query = lastSeenId !== null ? `?last_seen_id=${lastSeenId}` : "";
+      const wsURL = `${API_URL.replace(/^http/, 'ws')}/api/feed/stream${query}`;
+      ws.current = new WebSocket(wsURL, "json");
 
-    // Setup WebSocket connection
-    const wsURL = `${API_URL.replace(/^http/, 'ws')}/api/feed/stream`;
-    ws.current = new WebSocket(wsURL);
+      ws.current.onopen = () => {
+        console.log("WebSocket connection established");
+      };
 
-    ws.current.onopen = () => {
-      console.log("WebSocket connection established");
-    };
+      ws.current.onmessage = (event) => {
+        const frame = JSON.parse(event.data);
+        if (frame.type === "resync") {
+          // We fell too far behind for a replay: reload the feed.
+          fetchInitialMessages();
+          return;
+        }
+        if (frame.type) {
+          // Control frames such as pings carry no message.
+          return;
+        }
+        const newMessage: Message = frame;
+        lastSeenId = newMessage.id;
+        setMessages((prevMessages) =>
+          prevMessages.some((message) => message.id === newMessage.id)
+            ? prevMessages
+            : [newMessage, ...prevMessages]
+        );
+      };
 
-    ws.current.onmessage = (event) => {
-      const newMessage: Message = JSON.parse(event.data);
-      setMessages((prevMessages) => [newMessage, ...prevMessages]);
-    };
+      ws.current.onerror = (event) => {
+        console.error("WebSocket error:", event);
+        setError("WebSocket connection error.");
+      };
 
-    ws.current.onerror = (event) => {
-      console.error("WebSocket error:", event);
-      setError("WebSocket connection error.");
-    };
+      ws.current.onclose = () => {
+        console.log("WebSocket connection closed");
+        if (!closedByUnmount) {
+          reconnectTimer = setTimeout(connect, 2000);
+        }
+      };
+    }
 
-    ws.current.onclose = () => {
-      console.log("WebSocket connection closed");
-    };
+    fetchInitialMessages().then(connect);
 
     // Cleanup on component unmount
     return () => {
+      closedByUnmount = true;
+      if (reconnectTimer) {
+        clearTimeout(reconnectTimer);
+      }
       if (ws.current?.readyState === WebSocket.OPEN) {
         ws.current?.close();
       }
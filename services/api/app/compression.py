@@ -0,0 +1,67 @@
+"""
+Content negotiation and compression of REST responses.
+
+Feed pages are compressed here, with brotli when the brotli package is
+installed and the client accepts it, else gzip; hot pages keep their
+compressed bodies (see `feed_cache.FeedPage`). Other responses are gzipped
+by Starlette's `GZipMiddleware`, which leaves already encoded responses alone.
+"""
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are sent uncompressed.
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 500))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+# Brotli's higher qualities are far slower for little gain on JSON.
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 5))
+
+# Supported encodings, most preferred first.
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    """
+    Picks the encoding to use for a request's Accept-Encoding header: the
+    supported one with the highest q-value, ties going to brotli. None means
+    no compression.
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # A fixed mtime keeps the output, and so the ETag, stable.
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def encoded_etag(etag: str, encoding: str | None) -> str:
+    """The strong ETag of an encoded representation of a response."""
+    if encoding is None:
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
@@ -0,0 +1,310 @@
+import asyncio
+import json
+import os
+import time
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from . import metrics
+from .frames import JSON, Frame
+
+# Maximum number of frames a client may fall behind before the slow-consumer
+# policy kicks in: "resync" drops the backlog and tells the client to reload,
+# "drop" closes the connection.
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 256))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "resync")
+
+RESYNC_FRAME = Frame(json.dumps({"type": "resync"}))
+
+# Close code for "try again later", sent to evicted clients.
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class DeliveryTracker:
+    """
+    Counts down the clients a broadcast message still has to be written to,
+    and records how long after its NOTIFY was received the last write was.
+    """
+
+    __slots__ = ("received_at", "remaining")
+
+    def __init__(self, received_at: float):
+        self.received_at = received_at
+        self.remaining = 0
+
+    def settle(self):
+        self.remaining -= 1
+        if self.remaining == 0:
+            metrics.E2E_STAGE_SECONDS.labels(stage="notify_to_delivery").observe(
+                time.time() - self.received_at
+            )
+
+
+def _settle(tracker: DeliveryTracker | None):
+    if tracker is not None:
+        tracker.settle()
+
+
+def _as_frame(frame: Frame | str) -> Frame:
+    return frame if isinstance(frame, Frame) else Frame(frame)
+
+
+class ClientConnection:
+    """A connected WebSocket with its own bounded send queue and writer task."""
+
+    def __init__(self, websocket: WebSocket, max_queue_size: int, subprotocol: str = JSON):
+        self.websocket = websocket
+        # The subprotocol frames are encoded in for this client (see `frames.py`).
+        self.subprotocol = subprotocol
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.writer_task: asyncio.Task | None = None
+        # While a reconnecting client is being replayed the messages it missed,
+        # live frames are held here as (message_id, frame) until the replay
+        # has been queued. None once the client is live.
+        self.held: list[tuple[int | None, Frame]] | None = None
+        # Channel IDs the client subscribed to; empty means every channel.
+        self.channels: set[int] = set()
+
+    async def writer(self):
+        """Writes queued frames to the socket until it fails or is cancelled."""
+        try:
+            while True:
+                frame, queued_at, tracker = await self.queue.get()
+                metrics.WS_SEND_LAG_SECONDS.observe(time.perf_counter() - queued_at)
+                data = frame.encode(self.subprotocol)
+                try:
+                    if isinstance(data, str):
+                        await self.websocket.send_text(data)
+                    else:
+                        await self.websocket.send_bytes(data)
+                finally:
+                    _settle(tracker)
+        except (WebSocketDisconnect, RuntimeError, OSError) as e:
+            # The socket is gone; the endpoint notices the finished task.
+            print(f"WebSocket writer stopped: {e!r}")
+        finally:
+            self.discard_backlog()
+
+    def discard_backlog(self):
+        """Drops queued frames, settling the deliveries they belonged to."""
+        while not self.queue.empty():
+            _, _, tracker = self.queue.get_nowait()
+            _settle(tracker)
+
+
+class ConnectionManager:
+    def __init__(
+        self,
+        send_queue_size: int = WS_SEND_QUEUE_SIZE,
+        slow_consumer_policy: str = WS_SLOW_CONSUMER_POLICY,
+    ):
+        self.send_queue_size = send_queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.active_connections: dict[WebSocket, ClientConnection] = {}
+        # Subscriber index: clients without subscriptions get every message,
+        # the others are only reached through the channels they follow.
+        self.firehose: set[ClientConnection] = set()
+        self.subscribers: dict[int, set[ClientConnection]] = {}
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        replaying: bool = False,
+        channels: set[int] | None = None,
+        subprotocol: str = JSON,
+    ) -> ClientConnection:
+        """
+        Accepts a connection and starts its writer task.
+
+        With `replaying`, live broadcasts are held back until `finish_replay`
+        is called, so the replayed backlog always reaches the client first.
+        `channels` subscribes the client to those channel IDs from the start.
+        `subprotocol` is the one negotiated with the client (`frames.negotiate`).
+        """
+        await websocket.accept(subprotocol=subprotocol)
+        client = ClientConnection(websocket, self.send_queue_size, subprotocol)
+        if replaying:
+            client.held = []
+        client.writer_task = asyncio.create_task(client.writer())
+        self.active_connections[websocket] = client
+        self.firehose.add(client)
+        if channels:
+            self.subscribe(websocket, channels)
+        metrics.WS_CONNECTIONS.set(len(self.active_connections))
+        return client
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.active_connections.pop(websocket, None)
+        if client is not None:
+            self.unsubscribe(websocket, set(client.channels), client=client)
+            self.firehose.discard(client)
+            if client.writer_task is not None:
+                client.writer_task.cancel()
+        metrics.WS_CONNECTIONS.set(len(self.active_connections))
+
+    def subscribe(self, websocket: WebSocket, channels: set[int]):
+        """Restricts a client to messages from the given channels (cumulative)."""
+        client = self.active_connections.get(websocket)
+        if client is None or not channels:
+            return
+        self.firehose.discard(client)
+        for channel_id in channels:
+            client.channels.add(channel_id)
+            self.subscribers.setdefault(channel_id, set()).add(client)
+
+    def unsubscribe(
+        self,
+        websocket: WebSocket,
+        channels: set[int],
+        client: ClientConnection | None = None,
+    ):
+        """
+        Removes channel subscriptions. A client left without any goes back
+        to receiving every channel.
+        """
+        client = client or self.active_connections.get(websocket)
+        if client is None:
+            return
+        for channel_id in channels:
+            client.channels.discard(channel_id)
+            subscribers = self.subscribers.get(channel_id)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self.subscribers[channel_id]
+        if not client.channels and websocket in self.active_connections:
+            self.firehose.add(client)
+
+    def send(self, websocket: WebSocket, frame: Frame | str):
+        """Queues a frame for a single client."""
+        client = self.active_connections.get(websocket)
+        if client is not None:
+            self._enqueue(client, _as_frame(frame))
+
+    def finish_replay(self, websocket: WebSocket, replay: list[tuple[int, Frame | str]]):
+        """
+        Queues the replayed `(message_id, frame)` pairs, oldest first, then
+        switches the client to live mode.
+
+        Live frames that arrived during the replay are sent after it, except
+        for messages the replay already contained.
+        """
+        client = self.active_connections.get(websocket)
+        if client is None or client.held is None:
+            return
+        replayed_ids = set()
+        for message_id, frame in replay:
+            replayed_ids.add(message_id)
+            self._enqueue(client, _as_frame(frame))
+        held, client.held = client.held, None
+        for message_id, frame in held:
+            if message_id is None or message_id not in replayed_ids:
+                self._enqueue(client, frame)
+
+    async def broadcast(
+        self,
+        message: Frame | str,
+        message_id: int | None = None,
+        channel_id: int | None = None,
+        received_at: float | None = None,
+    ):
+        """
+        Queues one frame for every interested client. The frame is shared:
+        it is encoded at most once per subprotocol, whatever the number of
+        clients.
+
+        This never waits on a socket: each client's writer task drains its own
+        queue, so a slow client only delays itself. `message_id` identifies the
+        message carried by the frame, for deduplication against replays. With
+        a `channel_id`, only that channel's subscribers and clients without
+        subscriptions receive the frame; otherwise every client does.
+        `received_at` is the wall-clock time the message's NOTIFY arrived; the
+        time until the frame is written to the last client is recorded.
+        """
+        started = time.perf_counter()
+        tracker = DeliveryTracker(received_at) if received_at is not None else None
+        if channel_id is None:
+            targets = list(self.active_connections.values())
+        else:
+            targets = self._interested(channel_id)
+        queued = self._fan_out(targets, _as_frame(message), message_id, tracker)
+        metrics.WS_FANOUT_SECONDS.observe(time.perf_counter() - started)
+        metrics.WS_SEND_QUEUE_DEPTH.set(queued)
+
+    async def broadcast_repost(
+        self,
+        repost: Frame | str,
+        message: Frame | str,
+        message_id: int,
+        channel_id: int,
+        original_channel_id: int | None,
+        received_at: float | None = None,
+    ):
+        """
+        Queues a repost of another channel's message for the clients
+        interested in `channel_id`.
+
+        Clients that were sent the original (those without subscriptions and
+        the subscribers of `original_channel_id`) get the compact `repost`
+        frame; the others get the full `message`.
+        """
+        started = time.perf_counter()
+        tracker = DeliveryTracker(received_at) if received_at is not None else None
+        seen = set(self.firehose)
+        if original_channel_id is not None:
+            seen.update(self.subscribers.get(original_channel_id, ()))
+        targets = self._interested(channel_id)
+        queued = self._fan_out(
+            [client for client in targets if client in seen], _as_frame(repost), message_id, tracker
+        )
+        queued += self._fan_out(
+            [client for client in targets if client not in seen], _as_frame(message), message_id, tracker
+        )
+        metrics.WS_FANOUT_SECONDS.observe(time.perf_counter() - started)
+        metrics.WS_SEND_QUEUE_DEPTH.set(queued)
+
+    def _interested(self, channel_id: int) -> list[ClientConnection]:
+        """Clients that receive messages from a channel."""
+        return [*self.firehose, *self.subscribers.get(channel_id, ())]
+
+    def _fan_out(
+        self,
+        targets: list[ClientConnection],
+        frame: Frame,
+        message_id: int | None,
+        tracker: DeliveryTracker | None,
+    ) -> int:
+        """Queues (or holds) a frame for each target; returns their queued frames."""
+        queued = 0
+        for client in targets:
+            if client.held is not None:
+                client.held.append((message_id, frame))
+            else:
+                self._enqueue(client, frame, tracker)
+                queued += client.queue.qsize()
+        return queued
+
+    def _enqueue(self, client: ClientConnection, frame: Frame, tracker: DeliveryTracker | None = None):
+        try:
+            client.queue.put_nowait((frame, time.perf_counter(), tracker))
+        except asyncio.QueueFull:
+            self._handle_slow_consumer(client)
+        else:
+            if tracker is not None:
+                tracker.remaining += 1
+
+    def _handle_slow_consumer(self, client: ClientConnection):
+        metrics.WS_EVICTIONS.labels(action=self.slow_consumer_policy).inc()
+        if self.slow_consumer_policy == "resync":
+            # Throw away the backlog; the client reloads the feed over REST.
+            client.discard_backlog()
+            client.queue.put_nowait((RESYNC_FRAME, time.perf_counter(), None))
+        else:
+            self.disconnect(client.websocket)
+            asyncio.create_task(self._close(client.websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=WS_CLOSE_TRY_AGAIN_LATER)
+        except Exception as e:
+            print(f"Error closing slow WebSocket client: {e}")
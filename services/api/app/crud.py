@@ -1,20 +1,84 @@
+from datetime import datetime
+
+from sqlalchemy import func, tuple_
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy.future import select
 
 from . import models, schemas
 
-async def get_messages(db: Session, skip: int = 0, limit: int = 50) -> list[models.Message]:
+# Columns needed to render feed entries without loading ORM objects.
+FEED_COLUMNS = (
+    models.Message.id,
+    models.Message.body,
+    models.Message.created_at,
+    models.Message.rendered,
+    models.Message.channel_id,
+    models.Channel.name.label("channel_name"),
+)
+
+async def get_feed_rows(
+    db: Session,
+    skip: int = 0,
+    limit: int = 50,
+    before: tuple[datetime, int] | None = None,
+):
+    """
+    A page of the feed, most recent first, as plain rows of `FEED_COLUMNS`
+    for `rendering.render_row`.
+
+    When `before` is given, only messages strictly older than that
+    `(created_at, id)` position are returned. This keyset mode is served
+    from the composite feed index and costs the same at any depth, unlike
+    `skip`, which is kept for backwards compatibility.
+
+    The plain `created_at` bounds next to the row comparisons are redundant
+    but let Postgres prune partitions, which it can't do from a row
+    comparison.
+
+    Reposts of another channel's call (`duplicate_of`) are left out; their
+    originals stand for them. So are messages deleted on Telegram.
+    """
+    query = (
+        select(*FEED_COLUMNS)
+        .join(models.Channel, models.Channel.id == models.Message.channel_id)
+        .where(models.Message.duplicate_of.is_(None), models.Message.deleted_at.is_(None))
+        .order_by(models.Message.created_at.desc(), models.Message.id.desc())
+    )
+    if before is not None:
+        query = query.where(
+            models.Message.created_at <= before[0],
+            tuple_(models.Message.created_at, models.Message.id) < tuple_(*before),
+        )
+    result = await db.execute(query.offset(skip).limit(limit))
+    return result.all()
+
+async def get_feed_rows_after(
+    db: Session,
+    after: tuple[datetime, int],
+    limit: int = 50,
+    channel_ids: set[int] | None = None,
+):
     """
-    Retrieve a list of messages from the database, most recent first.
+    Rows of `FEED_COLUMNS` strictly newer than an `(created_at, id)`
+    position, oldest first, optionally only from the given channels.
+    Reposts and deleted messages are left out, as in `get_feed_rows`.
     """
+    query = (
+        select(*FEED_COLUMNS)
+        .join(models.Channel, models.Channel.id == models.Message.channel_id)
+        .where(
+            models.Message.duplicate_of.is_(None),
+            models.Message.deleted_at.is_(None),
+            models.Message.created_at >= after[0],
+            tuple_(models.Message.created_at, models.Message.id) > tuple_(*after),
+        )
+    )
+    if channel_ids:
+        query = query.where(models.Message.channel_id.in_(channel_ids))
     result = await db.execute(
-        select(models.Message)
-        .options(joinedload(models.Message.channel))
-        .order_by(models.Message.created_at.desc())
-        .offset(skip)
-        .limit(limit)
+        query.order_by(models.Message.created_at, models.Message.id).limit(limit)
     )
-    return result.scalars().all()
+    return result.all()
 
 async def get_message(db: Session, message_id: int) -> models.Message | None:
     """
@@ -25,4 +89,278 @@ async def get_message(db: Session, message_id: int) -> models.Message | None:
         .options(joinedload(models.Message.channel))
         .where(models.Message.id == message_id)
     )
-    return result.scalars().first() 
\ No newline at end of file
+    return result.scalars().first() 
+
+async def get_messages_by_ids(db: Session, message_ids: list[int]) -> list[models.Message]:
+    """
+    Retrieve several messages by their IDs, oldest first.
+    """
+    result = await db.execute(
+        select(models.Message)
+        .options(joinedload(models.Message.channel))
+        .where(models.Message.id.in_(message_ids))
+        .order_by(models.Message.created_at)
+    )
+    return result.scalars().all()
+
+def build_search_query(
+    query_text: str,
+    limit: int = 50,
+    channel_ids: set[int] | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    by_rank: bool = False,
+    after: tuple | None = None,
+):
+    """
+    Builds the full text search query used by `search_messages`.
+
+    Matches use the same expression as the `idx_messages_body_fts` GIN index.
+    Results are ordered newest first, or by `ts_rank_cd` relevance with
+    `by_rank`. `after` is the keyset position of the previous page's last row:
+    `(created_at, id)`, or `(rank, created_at, id)` when ordering by rank.
+    Reposts and deleted messages are left out, as in `get_feed_rows`.
+    """
+    ts_query = func.websearch_to_tsquery(models.SEARCH_CONFIG, query_text)
+    document = models.body_tsvector(models.Message.body)
+    rank = func.ts_rank_cd(document, ts_query)
+
+    query = (
+        select(models.Message, rank.label("rank"))
+        .options(joinedload(models.Message.channel))
+        .where(
+            document.op("@@")(ts_query),
+            models.Message.duplicate_of.is_(None),
+            models.Message.deleted_at.is_(None),
+        )
+    )
+    if channel_ids:
+        query = query.where(models.Message.channel_id.in_(channel_ids))
+    if since is not None:
+        query = query.where(models.Message.created_at >= since)
+    if until is not None:
+        query = query.where(models.Message.created_at < until)
+
+    if by_rank:
+        order = (rank, models.Message.created_at, models.Message.id)
+    else:
+        order = (models.Message.created_at, models.Message.id)
+    if after is not None:
+        query = query.where(tuple_(*order) < tuple_(*after))
+        if not by_rank:
+            # Lets Postgres prune partitions; see `get_feed_rows`.
+            query = query.where(models.Message.created_at <= after[0])
+    return query.order_by(*(column.desc() for column in order)).limit(limit)
+
+async def search_messages(db: Session, query_text: str, **filters) -> list[tuple[models.Message, float]]:
+    """
+    Full text search over message bodies.
+
+    Returns `(message, rank)` pairs; see `build_search_query` for the filters.
+    """
+    result = await db.execute(build_search_query(query_text, **filters))
+    return result.all()
+
+def normalize_dex_link(link: str) -> str:
+    """A DEX link as the collector stores it; mirrors its `extract.normalize_dex_link`."""
+    link = link.split("?", 1)[0].split("#", 1)[0].rstrip("/.,")
+    host, _, path = link.split("://", 1)[-1].partition("/")
+    return f"{host.lower().removeprefix('www.')}/{path}"
+
+def normalize_token(token: str) -> str:
+    """
+    Normalizes a user-supplied token the way the collector stores mentions:
+    tickers uppercase with a leading "$", EVM addresses lowercase, DEX links
+    (pasted whole or as `host/path`) without scheme, "www." or query string,
+    and Solana addresses unchanged.
+    """
+    token = token.strip()
+    if "/" in token:
+        return normalize_dex_link(token)
+    if token.lower().startswith("0x"):
+        return token.lower()
+    if token.startswith("$") or (len(token) <= 15 and token.isalnum()):
+        return "$" + token.lstrip("$").upper()
+    return token
+
+async def get_messages_by_token(
+    db: Session,
+    token: str,
+    limit: int = 50,
+    before: tuple[datetime, int] | None = None,
+) -> list[models.Message]:
+    """
+    Retrieve messages mentioning a token, most recent first, with the same
+    keyset paging as `get_feed_rows`.
+    """
+    query = (
+        select(models.Message)
+        .join(models.MessageMention, models.MessageMention.message_id == models.Message.id)
+        .options(joinedload(models.Message.channel))
+        .where(models.MessageMention.token == normalize_token(token), models.Message.deleted_at.is_(None))
+        .order_by(models.Message.created_at.desc(), models.Message.id.desc())
+    )
+    if before is not None:
+        query = query.where(
+            models.Message.created_at <= before[0],
+            tuple_(models.Message.created_at, models.Message.id) < tuple_(*before),
+        )
+    result = await db.execute(query.limit(limit))
+    return result.scalars().unique().all()
+
+async def get_trending_tokens(
+    db: Session,
+    since: datetime,
+    limit: int = 20,
+    kind: str | None = None,
+) -> list[dict]:
+    """
+    Retrieve the most mentioned tokens since a point in time, with the number
+    of mentions and of distinct channels mentioning them.
+    """
+    mentions = func.count().label("mentions")
+    query = (
+        select(
+            models.MessageMention.token,
+            models.MessageMention.kind,
+            mentions,
+            func.count(models.MessageMention.channel_id.distinct()).label("channels"),
+        )
+        .where(models.MessageMention.created_at >= since)
+        .group_by(models.MessageMention.token, models.MessageMention.kind)
+        .order_by(mentions.desc(), models.MessageMention.token)
+        .limit(limit)
+    )
+    if kind is not None:
+        query = query.where(models.MessageMention.kind == kind)
+    result = await db.execute(query)
+    return [row._asdict() for row in result.all()]
+
+async def get_channel_activity(
+    db: Session,
+    granularity: str,
+    since: datetime,
+    until: datetime,
+    channel_ids: set[int] | None = None,
+) -> list[dict]:
+    """
+    Retrieve messages per channel per bucket from the rollups, oldest bucket
+    first. Buckets without messages are absent.
+    """
+    activity = models.ChannelActivity
+    query = (
+        select(activity.channel_id, activity.bucket, activity.messages)
+        .where(
+            activity.granularity == granularity,
+            activity.bucket >= since,
+            activity.bucket < until,
+        )
+        .order_by(activity.bucket, activity.channel_id)
+    )
+    if channel_ids:
+        query = query.where(activity.channel_id.in_(channel_ids))
+    result = await db.execute(query)
+    return [row._asdict() for row in result.all()]
+
+async def get_token_stats(
+    db: Session,
+    granularity: str,
+    since: datetime,
+    until: datetime,
+    limit: int = 20,
+    kind: str | None = None,
+) -> list[dict]:
+    """
+    Retrieve the most mentioned tokens between two bucket boundaries from the
+    rollups, like `get_trending_tokens` but without scanning mentions.
+    """
+    activity = models.TokenActivity
+    mentions = func.sum(activity.mentions).label("mentions")
+    query = (
+        select(
+            activity.token,
+            activity.kind,
+            mentions,
+            func.count(activity.channel_id.distinct()).label("channels"),
+        )
+        .where(
+            activity.granularity == granularity,
+            activity.bucket >= since,
+            activity.bucket < until,
+        )
+        .group_by(activity.token, activity.kind)
+        .order_by(mentions.desc(), activity.token)
+        .limit(limit)
+    )
+    if kind is not None:
+        query = query.where(activity.kind == kind)
+    result = await db.execute(query)
+    return [row._asdict() for row in result.all()]
+
+async def get_media(db: Session, message_id: int) -> models.MessageMedia | None:
+    """
+    Retrieve a message's media row. The digests are read fresh, not from the
+    session's identity map, since the collector fills them in.
+    """
+    result = await db.execute(
+        select(models.MessageMedia)
+        .where(models.MessageMedia.message_id == message_id)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+# Columns of a bulk export (see `export.py`).
+EXPORT_COLUMNS = (
+    models.Message.id,
+    models.Message.channel_id,
+    models.Channel.name.label("channel_name"),
+    models.Message.created_at,
+    models.Message.body,
+    models.Message.duplicate_of,
+    models.Message.edited_at,
+    models.Message.deleted_at,
+)
+
+async def stream_messages(
+    db: Session,
+    channel_ids: set[int] | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    token: str | None = None,
+    batch_size: int = 1000,
+):
+    """
+    Yields the messages matching an export's filters in batches of
+    `EXPORT_COLUMNS` rows, oldest first, reposts and deleted messages included.
+
+    Rows come from a server-side cursor, `batch_size` at a time, so only one
+    batch is in memory. Closing the generator closes the cursor.
+    """
+    query = (
+        select(*EXPORT_COLUMNS)
+        .join(models.Channel, models.Channel.id == models.Message.channel_id)
+        .order_by(models.Message.created_at, models.Message.id)
+        .execution_options(yield_per=batch_size)
+    )
+    if channel_ids:
+        query = query.where(models.Message.channel_id.in_(channel_ids))
+    if since is not None:
+        query = query.where(models.Message.created_at >= since)
+    if until is not None:
+        query = query.where(models.Message.created_at < until)
+    if token is not None:
+        mentions = select(models.MessageMention.message_id).where(
+            models.MessageMention.token == normalize_token(token)
+        )
+        if since is not None:
+            mentions = mentions.where(models.MessageMention.created_at >= since)
+        if until is not None:
+            mentions = mentions.where(models.MessageMention.created_at < until)
+        query = query.where(models.Message.id.in_(mentions))
+
+    result = await db.stream(query)
+    try:
+        async for rows in result.partitions():
+            yield rows
+    finally:
+        await result.close()
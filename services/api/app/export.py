@@ -0,0 +1,189 @@
+"""
+Bulk export of stored messages as NDJSON, CSV or Parquet, for backtesting.
+
+Rows are read through a server-side cursor in batches of EXPORT_BATCH_SIZE
+(see `crud.stream_messages`) and each batch is encoded and sent before the
+next is fetched, so memory use stays at one batch however large the export.
+When the client disconnects the response stops being iterated: the cursor
+is closed and the export's slot freed. At most EXPORT_CONCURRENCY exports
+run at once per worker: a request takes a slot with `acquire`, which never
+waits, and is turned away when none is free.
+
+Parquet needs pyarrow; without it only NDJSON and CSV are offered.
+"""
+import asyncio
+import csv
+import io
+import os
+import weakref
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from .rendering import dumps, format_datetime
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 2000))
+EXPORT_CONCURRENCY = int(os.getenv("EXPORT_CONCURRENCY", 2))
+
+# Columns of an export, in order. Reposts are included, with the message
+# they repost as `duplicate_of`, and so are deleted messages: a backtest
+# needs the calls that were deleted after they failed.
+COLUMNS = (
+    "id", "channel_id", "channel_name", "created_at", "body", "duplicate_of", "edited_at", "deleted_at",
+)
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+FORMATS = ("ndjson", "csv", "parquet") if pyarrow is not None else ("ndjson", "csv")
+
+_running = 0
+
+
+def _format_optional(value):
+    return None if value is None else format_datetime(value)
+
+
+def acquire() -> bool:
+    """Takes an export slot if one is free, without waiting. `stream` frees it."""
+    global _running
+    if _running >= EXPORT_CONCURRENCY:
+        return False
+    _running += 1
+    return True
+
+
+def _release():
+    global _running
+    _running -= 1
+
+
+class NDJSONEncoder:
+    def encode(self, rows) -> bytes:
+        return "".join(
+            dumps({
+                "id": row.id,
+                "channel_id": row.channel_id,
+                "channel_name": row.channel_name,
+                "created_at": format_datetime(row.created_at),
+                "body": row.body,
+                "duplicate_of": row.duplicate_of,
+                "edited_at": _format_optional(row.edited_at),
+                "deleted_at": _format_optional(row.deleted_at),
+            }) + "\n"
+            for row in rows
+        ).encode("utf-8")
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class CSVEncoder:
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._writer.writerow(COLUMNS)
+
+    def encode(self, rows) -> bytes:
+        self._writer.writerows(
+            (
+                row.id,
+                row.channel_id,
+                row.channel_name,
+                format_datetime(row.created_at),
+                row.body,
+                row.duplicate_of,
+                _format_optional(row.edited_at),
+                _format_optional(row.deleted_at),
+            )
+            for row in rows
+        )
+        return self._drain()
+
+    def finish(self) -> bytes:
+        return self._drain()
+
+    def _drain(self) -> bytes:
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return text.encode("utf-8")
+
+
+class ParquetEncoder:
+    """Writes each batch as a row group; the footer goes out with `finish`."""
+
+    def __init__(self):
+        self._schema = pyarrow.schema([
+            ("id", pyarrow.int64()),
+            ("channel_id", pyarrow.int64()),
+            ("channel_name", pyarrow.string()),
+            ("created_at", pyarrow.timestamp("us", tz="UTC")),
+            ("body", pyarrow.string()),
+            ("duplicate_of", pyarrow.int64()),
+            ("edited_at", pyarrow.timestamp("us", tz="UTC")),
+            ("deleted_at", pyarrow.timestamp("us", tz="UTC")),
+        ])
+        self._buffer = io.BytesIO()
+        self._writer = pyarrow.parquet.ParquetWriter(self._buffer, self._schema)
+
+    def encode(self, rows) -> bytes:
+        columns = {name: [getattr(row, name) for row in rows] for name in COLUMNS}
+        self._writer.write_table(pyarrow.Table.from_pydict(columns, schema=self._schema))
+        return self._drain()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._drain()
+
+    def _drain(self) -> bytes:
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+ENCODERS = {"ndjson": NDJSONEncoder, "csv": CSVEncoder, "parquet": ParquetEncoder}
+
+
+def stream(batches, export_format: str):
+    """
+    Encodes batches of `crud.EXPORT_COLUMNS` rows as they arrive, in the
+    slot the caller took with `acquire`. The slot is freed when the export
+    ends, fails or is abandoned, and also when the response is dropped
+    before it was ever iterated (the client left before the first chunk).
+    """
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            _release()
+
+    chunks = _encode(batches, export_format, release)
+    weakref.finalize(chunks, release)
+    return chunks
+
+
+async def _encode(batches, export_format: str, release):
+    # Encoding runs in a thread, off the event loop.
+    try:
+        encoder = ENCODERS[export_format]()
+        async for rows in batches:
+            chunk = await asyncio.to_thread(encoder.encode, rows)
+            if chunk:
+                yield chunk
+        chunk = await asyncio.to_thread(encoder.finish)
+        if chunk:
+            yield chunk
+    finally:
+        try:
+            await batches.aclose()
+        finally:
+            release()
@@ -0,0 +1,208 @@
+"""
+Host-wide fan-out of new messages between API workers (FANOUT_MODE=host).
+
+With several uvicorn workers on a host, only one of them (the hub, elected
+through an exclusive lock on FANOUT_LOCK) listens to Postgres. It encodes
+each new message once and relays it over a Unix socket to the other
+workers, which feed it to their own hot feed cache and WebSocket clients.
+When the hub exits, its lock is released and a remaining worker takes over.
+
+Records on the socket are a type byte and a length, followed for messages
+by their ID, channel ID, `created_at` (microseconds since the epoch), the
+time the hub received its NOTIFY, the ID and channel ID of the message it
+reposts (0 for none) and the message's JSON. Records of edits and deletions
+carry the message's ID and channel ID, then the delta frame's JSON.
+"""
+import asyncio
+import fcntl
+import logging
+import math
+import os
+import struct
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+FANOUT_MODE = os.getenv("FANOUT_MODE", "local")
+FANOUT_SOCKET = os.getenv("FANOUT_SOCKET", "/tmp/callers-fanout.sock")
+FANOUT_LOCK = os.getenv("FANOUT_LOCK", FANOUT_SOCKET + ".lock")
+# Bytes a worker may fall behind by before the hub drops it; it resyncs from
+# the database when it reconnects.
+FANOUT_MAX_BUFFER = int(os.getenv("FANOUT_MAX_BUFFER", 4 * 1024 * 1024))
+
+KIND_MESSAGE = b"M"
+KIND_RESYNC = b"R"
+KIND_CHANGE = b"C"
+_HEADER = struct.Struct(">cI")
+_MESSAGE = struct.Struct(">qqqdqq")
+_CHANGE = struct.Struct(">qq")
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass
+class Delivery:
+    """A new message, encoded once, as handed to each worker."""
+
+    message_id: int
+    channel_id: int
+    created_at: datetime
+    message_json: str
+    # Wall-clock time the message's NOTIFY was received, for latency metrics.
+    received_at: float | None = None
+    # For a repost of another channel's call, the original message and its
+    # channel (when known).
+    duplicate_of: int | None = None
+    original_channel_id: int | None = None
+
+
+@dataclass
+class Change:
+    """An edit or deletion of a message, as the delta frame sent to clients."""
+
+    message_id: int
+    channel_id: int
+    frame_json: str
+
+
+def encode_delivery(delivery: Delivery) -> bytes:
+    created_at = delivery.created_at
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    micros = (created_at - _EPOCH) // timedelta(microseconds=1)
+    received_at = delivery.received_at if delivery.received_at is not None else float("nan")
+    body = _MESSAGE.pack(
+        delivery.message_id,
+        delivery.channel_id,
+        micros,
+        received_at,
+        delivery.duplicate_of or 0,
+        delivery.original_channel_id or 0,
+    )
+    body += delivery.message_json.encode()
+    return _HEADER.pack(KIND_MESSAGE, len(body)) + body
+
+
+RESYNC_RECORD = _HEADER.pack(KIND_RESYNC, 0)
+
+
+def decode_delivery(body: bytes) -> Delivery:
+    message_id, channel_id, micros, received_at, duplicate_of, original_channel_id = _MESSAGE.unpack_from(body)
+    return Delivery(
+        message_id=message_id,
+        channel_id=channel_id,
+        created_at=_EPOCH + timedelta(microseconds=micros),
+        message_json=body[_MESSAGE.size:].decode(),
+        received_at=None if math.isnan(received_at) else received_at,
+        duplicate_of=duplicate_of or None,
+        original_channel_id=original_channel_id or None,
+    )
+
+
+def encode_change(change: Change) -> bytes:
+    body = _CHANGE.pack(change.message_id, change.channel_id) + change.frame_json.encode()
+    return _HEADER.pack(KIND_CHANGE, len(body)) + body
+
+
+def decode_change(body: bytes) -> Change:
+    message_id, channel_id = _CHANGE.unpack_from(body)
+    return Change(message_id, channel_id, body[_CHANGE.size:].decode())
+
+
+async def read_record(reader: asyncio.StreamReader) -> Delivery | Change | None:
+    """
+    Reads the next record from the hub: a delivery, a change, or None for a
+    resync. Raises `asyncio.IncompleteReadError` when the hub goes away.
+    """
+    kind, length = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    body = await reader.readexactly(length) if length else b""
+    if kind == KIND_MESSAGE:
+        return decode_delivery(body)
+    if kind == KIND_CHANGE:
+        return decode_change(body)
+    return None
+
+
+def acquire_hub_lock(path: str = FANOUT_LOCK):
+    """
+    Tries to become the host's hub. Returns the open lock file, which must
+    be kept open for as long as this process is the hub, or None if another
+    process holds the lock.
+    """
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+class FanoutHub:
+    """Unix socket server relaying deliveries to the host's other workers."""
+
+    def __init__(self, path: str = FANOUT_SOCKET, max_buffer: int = FANOUT_MAX_BUFFER):
+        self.path = path
+        self.max_buffer = max_buffer
+        self._writers: set[asyncio.StreamWriter] = set()
+        self._server: asyncio.AbstractServer | None = None
+
+    def __len__(self):
+        return len(self._writers)
+
+    async def start(self):
+        # A socket file left by a hub that died; we hold the lock, so it's stale.
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._accept, path=self.path)
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            # Workers never send anything; EOF means they went away.
+            await reader.read()
+        finally:
+            self._drop(writer)
+
+    def _drop(self, writer: asyncio.StreamWriter):
+        self._writers.discard(writer)
+        writer.close()
+
+    def publish(self, record: bytes):
+        """Sends a record to every connected worker, without waiting on any of them."""
+        for writer in list(self._writers):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                logging.warning("Dropping a fan-out subscriber that fell behind.")
+                self._drop(writer)
+                continue
+            writer.write(record)
+
+    async def close(self):
+        for writer in list(self._writers):
+            self._drop(writer)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+async def subscribe(on_connect, on_delivery, on_resync, path: str = FANOUT_SOCKET):
+    """
+    Connects to the hub and hands its records to the callbacks until it goes away.
+
+    `on_connect` runs once the connection is up and before the first record
+    is handled, so a worker can resync without missing anything.
+    `on_delivery` is handed both new messages (`Delivery`) and edits and
+    deletions (`Change`).
+    """
+    reader, writer = await asyncio.open_unix_connection(path)
+    try:
+        await on_connect()
+        while True:
+            delivery = await read_record(reader)
+            if delivery is None:
+                await on_resync()
+            else:
+                await on_delivery(delivery)
+    finally:
+        writer.close()
@@ -0,0 +1,159 @@
+import bisect
+import hashlib
+import os
+from datetime import datetime
+
+from . import compression
+
+# Number of most recent messages kept in memory for first-page feed reads.
+FEED_CACHE_SIZE = int(os.getenv("FEED_CACHE_SIZE", 500))
+
+
+def parse_datetime(value: str) -> datetime:
+    # datetime.fromisoformat only understands a trailing "Z" from Python 3.11.
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+
+class FeedPage:
+    """A rendered first page of the feed, with its compressed bodies."""
+
+    def __init__(self, body: bytes, etag: str, last: tuple[datetime, int] | None):
+        self.body = body
+        self.etag = etag
+        self.last = last
+        self._encoded: dict[str, bytes] = {}
+
+    def encoded(self, encoding: str | None) -> bytes:
+        """
+        The body in a content encoding, compressed on first use and kept for
+        as long as the page is.
+        """
+        if encoding is None:
+            return self.body
+        body = self._encoded.get(encoding)
+        if body is None:
+            body = self._encoded[encoding] = compression.compress(self.body, encoding)
+        return body
+
+
+class HotFeedCache:
+    """
+    The most recent messages of the feed, kept pre-serialized in memory.
+
+    Entries are ordered newest first by `(created_at, id)`, like the feed
+    query, and the buffer never holds more than `capacity` messages: adding a
+    message to a full buffer evicts the oldest one. Rendered pages and their
+    ETags are memoized until the next change.
+    """
+
+    def __init__(self, capacity: int = FEED_CACHE_SIZE):
+        self.capacity = capacity
+        # Sort keys are the negated (timestamp, id) of each entry, so the
+        # ascending order bisect works with is newest first.
+        self._keys: list[tuple[float, int]] = []
+        self._entries: list[tuple[datetime, int, int, str]] = []
+        self._pages: dict[int, FeedPage] = {}
+        self.warm = False
+        # True when the buffer holds every message in the feed.
+        self.complete = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def load(self, messages: list[tuple[datetime, int, int, str]]):
+        """
+        Replaces the buffer with `(created_at, id, channel_id, json)` tuples,
+        newest first, as returned by the feed query.
+        """
+        self._keys = []
+        self._entries = []
+        self._pages.clear()
+        for created_at, message_id, channel_id, message_json in messages[: self.capacity]:
+            self._keys.append((-created_at.timestamp(), -message_id))
+            self._entries.append((created_at, message_id, channel_id, message_json))
+        self.complete = len(messages) < self.capacity
+        self.warm = True
+
+    def add(self, message: dict, message_json: str):
+        """Inserts a message received from the collector at its feed position."""
+        self.insert(
+            parse_datetime(message["created_at"]), message["id"], message["channel"]["id"], message_json
+        )
+
+    def insert(self, created_at: datetime, message_id: int, channel_id: int, message_json: str):
+        """Inserts an encoded message at its feed position."""
+        if not self.warm:
+            return
+        key = (-created_at.timestamp(), -message_id)
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            return
+        if index >= self.capacity:
+            # Older than everything we keep.
+            self.complete = False
+            return
+
+        self._keys.insert(index, key)
+        self._entries.insert(index, (created_at, message_id, channel_id, message_json))
+        if len(self._entries) > self.capacity:
+            self._keys.pop()
+            self._entries.pop()
+            self.complete = False
+        self._pages.clear()
+
+    def update(self, message_id: int, patch):
+        """Replaces a cached message's JSON with `patch(json)`, if it is cached."""
+        for index, (created_at, entry_id, channel_id, message_json) in enumerate(self._entries):
+            if entry_id == message_id:
+                self._entries[index] = (created_at, entry_id, channel_id, patch(message_json))
+                self._pages.clear()
+                return
+
+    def remove(self, message_id: int):
+        """
+        Drops a deleted message. The buffer is then one short: the first page
+        at full capacity is read from the database again until it refills.
+        """
+        for index, entry in enumerate(self._entries):
+            if entry[1] == message_id:
+                del self._entries[index]
+                del self._keys[index]
+                self._pages.clear()
+                return
+
+    def position_of(self, message_id: int) -> tuple[datetime, int] | None:
+        """Returns the `(created_at, id)` of a cached message, if present."""
+        for created_at, entry_id, _, _ in self._entries:
+            if entry_id == message_id:
+                return created_at, entry_id
+        return None
+
+    def since(self, position: tuple[datetime, int]) -> list[tuple[int, int, str]] | None:
+        """
+        Returns the `(id, channel_id, json)` of every message newer than
+        `position`, oldest first, or None if the buffer may not hold all of them.
+        """
+        if not self.warm:
+            return None
+        created_at, message_id = position
+        index = bisect.bisect_left(self._keys, (-created_at.timestamp(), -message_id))
+        if index == len(self._entries) and not self.complete:
+            # The position is older than anything we keep.
+            return None
+        return [entry[1:] for entry in reversed(self._entries[:index])]
+
+    def first_page(self, limit: int) -> FeedPage | None:
+        """Returns the first `limit` messages, or None if they aren't all cached."""
+        if not self.warm or limit < 1 or (limit > len(self._entries) and not self.complete):
+            return None
+
+        page = self._pages.get(limit)
+        if page is None:
+            entries = self._entries[:limit]
+            body = ("[" + ",".join(entry[3] for entry in entries) + "]").encode("utf-8")
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            last = (entries[-1][0], entries[-1][1]) if len(entries) == limit else None
+            page = self._pages[limit] = FeedPage(body, etag, last)
+        return page
@@ -0,0 +1,70 @@
+"""
+Stream frames and the WebSocket subprotocols they can be encoded in.
+
+Frames are produced as JSON text. A `Frame` encodes itself into another
+subprotocol the first time a client speaking it needs the frame, and keeps
+that encoding, so a broadcast is encoded once per subprotocol however many
+clients receive it.
+
+- `json`: JSON text frames (the default).
+- `msgpack`: the same objects as MessagePack binary frames. Offered only
+  when the msgpack package is installed.
+"""
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+# Subprotocols this server can speak. Without msgpack installed only JSON is
+# offered.
+SUBPROTOCOLS = (JSON, MSGPACK) if msgpack is not None else (JSON,)
+
+
+def negotiate(offered: list[str]) -> str:
+    """
+    Picks the first subprotocol the client offered that the server speaks.
+
+    Clients that offer none we know get JSON, like before subprotocols were
+    negotiated.
+    """
+    for subprotocol in offered:
+        if subprotocol in SUBPROTOCOLS:
+            return subprotocol
+    return JSON
+
+
+class Frame:
+    """A frame to send to stream clients, encoded lazily per subprotocol."""
+
+    __slots__ = ("text", "_encoded")
+
+    def __init__(self, text: str):
+        self.text = text
+        self._encoded: dict[str, bytes] = {}
+
+    def encode(self, subprotocol: str) -> str | bytes:
+        """The frame in a subprotocol: text for JSON, bytes otherwise."""
+        if subprotocol == JSON:
+            return self.text
+        encoded = self._encoded.get(subprotocol)
+        if encoded is None:
+            encoded = self._encoded[subprotocol] = msgpack.packb(json.loads(self.text))
+        return encoded
+
+    def __repr__(self):
+        return f"Frame({self.text!r})"
+
+
+def decode(data: str | bytes, subprotocol: str):
+    """Decodes a frame sent by a client in its subprotocol."""
+    if isinstance(data, str):
+        # Control messages may always be sent as JSON text.
+        return json.loads(data)
+    if subprotocol == MSGPACK:
+        return msgpack.unpackb(data)
+    return json.loads(data)
@@ -2,23 +2,32 @@ import asyncio
 import asyncpg
 import json
 import os
+import time
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from prometheus_fastapi_instrumentator import Instrumentator
 from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.middleware.gzip import DEFAULT_EXCLUDED_CONTENT_TYPES
 
-from . import crud, schemas
+from . import compression, crud, export, fanout, frames, media, metrics, rendering, schemas
+from .connections import ConnectionManager, RESYNC_FRAME
+from .feed_cache import HotFeedCache, parse_datetime
+from .pagination import decode_cursor, decode_ranked_cursor, encode_cursor
 from .database import get_db, DATABASE_URL
 
 load_dotenv()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Pass the manager instance to the listener
+    # Startup: Serve the first feed page from memory as soon as possible
+    await warm_feed_cache()
     print("Starting up and initializing DB listener...")
-    listener_task = asyncio.create_task(db_listener(manager))
+    listener_task = asyncio.create_task(run_fanout())
     yield
     # Shutdown
     print("Shutting down, cancelling listener task...")
@@ -50,35 +59,54 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept(subprotocol="json")
-        self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+# Feed pages arrive here already compressed (see `read_messages`); this
+# gzips the other responses.
+app.add_middleware(
+    GZipMiddleware,
+    minimum_size=compression.COMPRESS_MIN_SIZE,
+    compresslevel=compression.GZIP_LEVEL,
+    # Parquet exports are compressed already.
+    exclude_content_types=(*DEFAULT_EXCLUDED_CONTENT_TYPES, export.MEDIA_TYPES["parquet"]),
+)
 
 manager = ConnectionManager()
+feed_cache = HotFeedCache()
+# Set while this worker is the host's fan-out hub (FANOUT_MODE=host).
+hub: fanout.FanoutHub | None = None
+
+async def warm_feed_cache():
+    """Loads the most recent messages into the hot feed cache."""
+    try:
+        async for db in get_db():
+            rows = await crud.get_feed_rows(db, limit=feed_cache.capacity)
+            feed_cache.load([
+                (row.created_at, row.id, row.channel_id, rendering.render_row(row))
+                for row in rows
+            ])
+        print(f"Feed cache warmed with {len(feed_cache)} messages.")
+    except Exception as e:
+        # Not fatal: the feed is served from the database until the next warm-up.
+        print(f"Could not warm the feed cache: {e}")
 
 async def db_listener(manager: ConnectionManager):
     """Listens for new message notifications and broadcasts them."""
     conn = None
+    reconnecting = False
     while True:
         try:
             if conn is None or conn.is_closed():
                 print("Connecting to database for listener...")
                 conn = await asyncpg.connect(dsn=DATABASE_URL)
                 await conn.add_listener("new_message", notification_handler)
+                await conn.add_listener("message_changes", change_handler)
                 print("Database listener connected and listening.")
+                if reconnecting:
+                    # Notifications sent while we were disconnected are lost.
+                    await resync()
+                reconnecting = True
 
             # The `await` here is important. It allows the loop to yield
             # and prevents it from busy-waiting, while also checking for connection health.
@@ -99,18 +127,213 @@ async def db_listener(manager: ConnectionManager):
             await asyncio.sleep(10)
 
 async def notification_handler(connection, pid, channel, payload):
-    """Handles the notification from PostgreSQL."""
-    print(f"Received notification: {payload}")
-    message_id = int(payload)
-    
-    # Need a new session to fetch the message
+    """
+    Handles the notification from PostgreSQL.
+
+    The payload is a JSON array of messages already serialized by the
+    collector in the `schemas.Message` shape, which are forwarded as-is.
+    Messages too large for a NOTIFY are sent as bare IDs and loaded here.
+    Live messages also carry the collector's stage timestamps, which are
+    recorded as latency metrics and stripped before forwarding, and reposts
+    of another channel's call name their original under "duplicate_of".
+    """
+    received_at = time.time()
+    print(f"Received notification ({len(payload)} bytes)")
+    oversized_ids = []
+    for item in json.loads(payload):
+        if isinstance(item, int):
+            oversized_ids.append(item)
+        else:
+            created_at = parse_datetime(item["created_at"])
+            stages = item.pop("stages", None)
+            if stages is not None:
+                record_stage_latencies(created_at, stages, received_at)
+            original = item.pop("duplicate_of", None) or {}
+            await publish(fanout.Delivery(
+                message_id=item["id"],
+                channel_id=item["channel"]["id"],
+                created_at=created_at,
+                message_json=encode_message(item),
+                received_at=received_at,
+                duplicate_of=original.get("id"),
+                original_channel_id=original.get("channel_id"),
+            ))
+
+    if oversized_ids:
+        await broadcast_messages_by_id(oversized_ids, received_at=received_at)
+
+async def change_handler(connection, pid, channel, payload):
+    """
+    Handles a 'message_changes' notification: a JSON array of the edits and
+    deletions the collector applied, as the compact delta frames streamed to
+    clients. Updates too large for a NOTIFY come without their body and are
+    loaded here.
+    """
+    for change in json.loads(payload):
+        if change["type"] == "update" and "body" not in change:
+            change = await load_update(change["id"])
+            if change is None:
+                continue
+        await publish_change(fanout.Change(
+            message_id=change["id"], channel_id=change["channel_id"], frame_json=encode_message(change)
+        ))
+
+async def load_update(message_id: int) -> dict | None:
+    """The `update` delta of an edited message, from the database."""
+    async for db in get_db():
+        message = await crud.get_message(db, message_id)
+        if message is None or message.edited_at is None:
+            return None
+        return {
+            "type": "update",
+            "id": message.id,
+            "channel_id": message.channel_id,
+            "version": message.version,
+            "edited_at": rendering.format_datetime(message.edited_at),
+            "body": message.body,
+        }
+
+def record_stage_latencies(created_at: datetime, stages: dict, received_at: float):
+    """
+    Records the latency of each stage a message went through before its
+    NOTIFY arrived: posted on Telegram, seen by the collector's handler
+    (`received`), and written to Postgres (`written`, just before commit).
+    """
+    observe = metrics.E2E_STAGE_SECONDS.labels
+    observe(stage="telegram_to_handler").observe(stages["received"] - created_at.timestamp())
+    observe(stage="handler_to_commit").observe(stages["written"] - stages["received"])
+    observe(stage="commit_to_notify").observe(received_at - stages["written"])
+
+def encode_message(message: dict) -> str:
+    """Encodes a message dict exactly as the collector rendered it."""
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+async def broadcast_messages_by_id(message_ids: list[int], received_at: float | None = None):
+    """Loads messages from the database and broadcasts them."""
+    # Need a new session to fetch the messages
     async for db in get_db():
-        message = await crud.get_message(db, message_id=message_id)
-        if message:
+        for message in await crud.get_messages_by_ids(db, message_ids=message_ids):
             # Pydantic model to dict, then to JSON string
             message_schema = schemas.Message.from_orm(message)
-            message_json = message_schema.model_dump_json()
-            await manager.broadcast(message_json)
+            await publish(fanout.Delivery(
+                message_id=message.id,
+                channel_id=message.channel_id,
+                created_at=message.created_at,
+                message_json=message_schema.model_dump_json(),
+                received_at=received_at,
+                duplicate_of=message.duplicate_of,
+            ))
+
+async def deliver(delivery: fanout.Delivery):
+    """Hands a new message to this worker's feed cache and WebSocket clients."""
+    if delivery.duplicate_of is not None:
+        await deliver_repost(delivery)
+        return
+    feed_cache.insert(
+        delivery.created_at, delivery.message_id, delivery.channel_id, delivery.message_json
+    )
+    await manager.broadcast(
+        delivery.message_json,
+        message_id=delivery.message_id,
+        channel_id=delivery.channel_id,
+        received_at=delivery.received_at,
+    )
+
+async def deliver_repost(delivery: fanout.Delivery):
+    """
+    Tells stream clients that already have the original of a repost where
+    else it was posted, with a compact frame:
+    `{"type": "repost", "id": <original id>, "message_id": <repost id>, "channel": {...}}`.
+    Reposts are not part of the feed, so the feed cache is left alone.
+    """
+    message = json.loads(delivery.message_json)
+    repost = json.dumps(
+        {
+            "type": "repost",
+            "id": delivery.duplicate_of,
+            "message_id": delivery.message_id,
+            "channel": message["channel"],
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    await manager.broadcast_repost(
+        repost,
+        delivery.message_json,
+        message_id=delivery.message_id,
+        channel_id=delivery.channel_id,
+        original_channel_id=delivery.original_channel_id,
+        received_at=delivery.received_at,
+    )
+
+async def apply_change(change: fanout.Change):
+    """
+    Applies an edit or deletion to this worker's feed cache and streams its
+    delta frame to the clients interested in the message's channel, which
+    patch their view in place.
+    """
+    delta = json.loads(change.frame_json)
+    if delta["type"] == "delete":
+        feed_cache.remove(change.message_id)
+    else:
+        feed_cache.update(change.message_id, lambda message_json: rendering.apply_update(message_json, delta))
+    # Without a message ID, so clients replaying missed messages get it after the replay.
+    await manager.broadcast(change.frame_json, channel_id=change.channel_id)
+
+async def publish_change(change: fanout.Change):
+    """Applies a change here and, on the hub, in the host's other workers."""
+    if hub is not None:
+        hub.publish(fanout.encode_change(change))
+    await apply_change(change)
+
+async def deliver_record(record: fanout.Delivery | fanout.Change):
+    """Hands a record relayed by the hub to `deliver` or `apply_change`."""
+    if isinstance(record, fanout.Change):
+        await apply_change(record)
+    else:
+        await deliver(record)
+
+async def publish(delivery: fanout.Delivery):
+    """Delivers a new message here and, on the hub, to the host's other workers."""
+    if hub is not None:
+        hub.publish(fanout.encode_delivery(delivery))
+    await deliver(delivery)
+
+async def resync():
+    """Reloads the feed cache here and, on the hub, in the host's other workers."""
+    if hub is not None:
+        hub.publish(fanout.RESYNC_RECORD)
+    await warm_feed_cache()
+
+async def run_fanout():
+    """
+    Feeds new messages to this worker: straight from Postgres by default, or
+    in FANOUT_MODE=host through the host's hub, which is whichever worker
+    holds the fan-out lock (see `fanout.py`).
+    """
+    global hub
+    if fanout.FANOUT_MODE != "host":
+        await db_listener(manager)
+        return
+    while True:
+        lock = fanout.acquire_hub_lock()
+        if lock is not None:
+            print("This worker is the fan-out hub.")
+            hub = fanout.FanoutHub()
+            try:
+                await hub.start()
+                await db_listener(manager)
+            finally:
+                await hub.close()
+                hub = None
+                lock.close()
+        try:
+            # Reload the feed cache once connected: messages relayed before
+            # that were missed.
+            await fanout.subscribe(warm_feed_cache, deliver_record, warm_feed_cache)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            print(f"Fan-out hub unavailable: {e}. Retrying in 1 second...")
+        await asyncio.sleep(1)
 
 @app.get("/healthz", tags=["health"])
 async def health_check():
@@ -118,18 +341,327 @@ async def health_check():
     return {"status": "ok"}
 
 @app.get("/api/feed", response_model=list[schemas.Message])
-async def read_messages(skip: int = 0, limit: int = 50, db: AsyncSession = Depends(get_db)):
-    messages = await crud.get_messages(db, skip=skip, limit=limit)
+async def read_messages(
+    request: Request,
+    skip: int = 0,
+    limit: int = 50,
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Returns a page of the feed, most recent first.
+
+    Pass the `X-Next-Cursor` header of a page as `cursor` to fetch the page
+    after it. The header is omitted once the end of the feed is reached.
+
+    The first page is served from the hot feed cache when possible, with a
+    strong ETag so unchanged polls get a 304 Not Modified. Pages are
+    compressed with brotli or gzip, as the client accepts; hot pages keep
+    their compressed bodies until the feed changes.
+    """
+    encoding = compression.choose_encoding(request.headers.get("accept-encoding", ""))
+    if skip == 0 and not cursor:
+        page = feed_cache.first_page(limit)
+        if page is not None:
+            metrics.FEED_CACHE_REQUESTS.labels(result="hit").inc()
+            if len(page.body) < compression.COMPRESS_MIN_SIZE:
+                encoding = None
+            headers = {"ETag": compression.encoded_etag(page.etag, encoding), "Vary": "Accept-Encoding"}
+            if page.last is not None:
+                headers["X-Next-Cursor"] = encode_cursor(*page.last)
+            if_none_match = request.headers.get("if-none-match", "")
+            if headers["ETag"] in (tag.strip() for tag in if_none_match.split(",")):
+                return Response(status_code=304, headers=headers)
+            return _encoded_response(page.encoded(encoding), encoding, headers)
+        metrics.FEED_CACHE_REQUESTS.labels(result="miss").inc()
+
+    try:
+        before = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Rendered straight from the rows: no ORM objects, no pydantic validation.
+    rows = await crud.get_feed_rows(db, skip=skip, limit=limit, before=before)
+    headers = {"Vary": "Accept-Encoding"}
+    if len(rows) == limit:
+        last = rows[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
+    body = rendering.render_page(rows).encode("utf-8")
+    if encoding is None or len(body) < compression.COMPRESS_MIN_SIZE:
+        return _encoded_response(body, None, headers)
+    return _encoded_response(compression.compress(body, encoding), encoding, headers)
+
+def _encoded_response(body: bytes, encoding: str | None, headers: dict) -> Response:
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/api/search", response_model=list[schemas.Message])
+async def search_messages(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=256),
+    channel_id: list[int] = Query(default=[]),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    sort: str = Query("recent", pattern="^(recent|rank)$"),
+    limit: int = Query(50, ge=1, le=100),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Full text search over message bodies.
+
+    `q` uses web search syntax ("quoted phrases", OR, -excluded). Results can
+    be restricted to channels (repeat `channel_id`) and a `since`/`until`
+    time range, and are ordered newest first or, with `sort=rank`, by
+    relevance. Paging works like `/api/feed`, through `X-Next-Cursor`.
+    """
+    by_rank = sort == "rank"
+    try:
+        after = None
+        if cursor:
+            after = decode_ranked_cursor(cursor) if by_rank else decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    results = await crud.search_messages(
+        db,
+        q,
+        limit=limit,
+        channel_ids=set(channel_id),
+        since=since,
+        until=until,
+        by_rank=by_rank,
+        after=after,
+    )
+    if len(results) == limit:
+        last, rank = results[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(
+            last.created_at, last.id, rank=rank if by_rank else None
+        )
+    return [message for message, _ in results]
+
+@app.get("/api/tokens/trending", response_model=list[schemas.TrendingToken])
+async def read_trending_tokens(
+    hours: int = Query(24, ge=1, le=24 * 7),
+    limit: int = Query(20, ge=1, le=100),
+    kind: str | None = Query(None, pattern="^(ticker|evm|solana|dex_link)$"),
+    db: AsyncSession = Depends(get_db),
+):
+    """Returns the tokens mentioned most over the last `hours`."""
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    return await crud.get_trending_tokens(db, since=since, limit=limit, kind=kind)
+
+@app.get("/api/tokens/{token:path}/messages", response_model=list[schemas.Message])
+async def read_token_messages(
+    token: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=100),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Returns messages mentioning a ticker (with or without "$"), contract
+    address or DEX link, most recent first. Paged like `/api/feed`.
+    """
+    try:
+        before = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    messages = await crud.get_messages_by_token(db, token, limit=limit, before=before)
+    if len(messages) == limit:
+        last = messages[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
     return messages
 
-async def client_listener(websocket: WebSocket):
-    """Listens for messages from the client to detect disconnection."""
+# Bucket sizes of the activity rollups, and the default window of each.
+STATS_GRANULARITIES = {
+    "1m": (timedelta(minutes=1), timedelta(hours=1)),
+    "1h": (timedelta(hours=1), timedelta(hours=24)),
+    "1d": (timedelta(days=1), timedelta(days=30)),
+}
+# Most buckets a stats request may span, which bounds what it reads.
+STATS_MAX_BUCKETS = int(os.getenv("STATS_MAX_BUCKETS", 1500))
+
+def stats_range(
+    granularity: str, since: datetime | None, until: datetime | None
+) -> tuple[datetime, datetime]:
+    """
+    Turns a requested time range into bucket boundaries: from the bucket
+    holding `since` up to and including the one holding `until` (now by
+    default), defaulting to the granularity's usual window.
+    """
+    step, window = STATS_GRANULARITIES[granularity]
+    until = until or datetime.now(timezone.utc)
+    since = since or until - window
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=timezone.utc)
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    start = epoch + (since - epoch) // step * step
+    end = epoch + (until - epoch) // step * step + step
+    if (end - start) / step > STATS_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Range spans more than {STATS_MAX_BUCKETS} buckets; use a coarser granularity",
+        )
+    return start, end
+
+@app.get("/api/stats/channels", response_model=list[schemas.ChannelActivity])
+async def read_channel_stats(
+    granularity: str = Query("1h", pattern="^(1m|1h|1d)$"),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    channel_id: list[int] = Query(default=[]),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Returns messages per channel per `granularity` bucket between `since`
+    and `until` (by default the last hour, day or 30 days), oldest first.
+    Read from the activity rollups only, so the cost depends on the range,
+    not on the size of the history.
+    """
+    start, end = stats_range(granularity, since, until)
+    return await crud.get_channel_activity(
+        db, granularity, start, end, channel_ids=set(channel_id)
+    )
+
+@app.get("/api/stats/tokens", response_model=list[schemas.TrendingToken])
+async def read_token_stats(
+    granularity: str = Query("1h", pattern="^(1m|1h|1d)$"),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: int = Query(20, ge=1, le=100),
+    kind: str | None = Query(None, pattern="^(ticker|evm|solana|dex_link)$"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Returns the most mentioned tokens between `since` and `until`, counted
+    in `granularity` buckets from the activity rollups.
+    """
+    start, end = stats_range(granularity, since, until)
+    return await crud.get_token_stats(db, granularity, start, end, limit=limit, kind=kind)
+
+@app.get("/api/export")
+async def export_messages(
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv|parquet)$"),
+    channel_id: list[int] = Query(default=[]),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    token: str | None = Query(None, min_length=1, max_length=256),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Streams every message matching the filters as NDJSON, CSV or Parquet,
+    oldest first, for bulk pulls that would otherwise page through the feed.
+    Reposts are included, with the message they repost as `duplicate_of`.
+
+    Only EXPORT_CONCURRENCY exports run at once; more get a 429.
+    """
+    if export_format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"{export_format} exports are not available on this server")
+    if not export.acquire():
+        raise HTTPException(
+            status_code=429, detail="Too many exports running", headers={"Retry-After": "30"}
+        )
+    batches = crud.stream_messages(
+        db,
+        channel_ids=set(channel_id),
+        since=since,
+        until=until,
+        token=token,
+        batch_size=export.EXPORT_BATCH_SIZE,
+    )
+    return StreamingResponse(
+        export.stream(batches, export_format),
+        media_type=export.MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="messages.{export_format}"'},
+    )
+
+@app.get("/api/media/{message_id}")
+async def read_media(message_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Returns a message's photo, video or document. Files are downloaded from
+    Telegram on their first request, which waits up to MEDIA_FETCH_TIMEOUT
+    seconds and then answers 202 with a Retry-After while the download goes
+    on. Range requests are supported, so videos can be seeked.
+    """
+    return await _media_response(request, db, message_id, thumbnail=False)
+
+@app.get("/api/media/{message_id}/thumbnail")
+async def read_media_thumbnail(message_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    """Returns the JPEG thumbnail of a message's media, if it has one."""
+    return await _media_response(request, db, message_id, thumbnail=True)
+
+async def _media_response(request: Request, db: AsyncSession, message_id: int, thumbnail: bool) -> Response:
+    attached = await media.fetch(db, message_id)
+    if attached is None or (thumbnail and attached.thumbnail is None):
+        raise HTTPException(status_code=404, detail="Media not found")
+    digest = attached.thumbnail_sha256 if thumbnail else attached.sha256
+    if digest is None:
+        # Accepted: the collector is downloading it.
+        return JSONResponse(
+            {"detail": "Media is not downloaded yet"},
+            status_code=202,
+            headers={"Retry-After": str(int(media.MEDIA_REQUEST_INTERVAL))},
+        )
+    path = media.store_path(digest)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Media file is missing from the store")
+
+    headers = {"ETag": f'"{digest}"', "Cache-Control": media.CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    if headers["ETag"] in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    media_type = "image/jpeg" if thumbnail else attached.mime_type or "application/octet-stream"
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+def parse_channel_ids(value) -> set[int]:
+    """Parses channel IDs given as a list or a comma-separated string."""
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, list):
+        return set()
+    channel_ids = set()
+    for channel_id in value:
+        try:
+            channel_ids.add(int(channel_id))
+        except (TypeError, ValueError):
+            continue
+    return channel_ids
+
+def handle_client_message(websocket: WebSocket, data: str | bytes, subprotocol: str = frames.JSON):
+    """
+    Applies a control message sent by a stream client:
+    `{"type": "subscribe" | "unsubscribe", "channels": [<channel id>, ...]}`,
+    as JSON text or in the client's subprotocol. Anything else is ignored.
+    """
     try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        # This exception is expected when the client closes the connection.
-        pass
+        message = frames.decode(data, subprotocol)
+    except Exception:
+        return
+    if not isinstance(message, dict):
+        return
+    channel_ids = parse_channel_ids(message.get("channels"))
+    if message.get("type") == "subscribe":
+        manager.subscribe(websocket, channel_ids)
+    elif message.get("type") == "unsubscribe":
+        manager.unsubscribe(websocket, channel_ids)
+
+async def client_listener(websocket: WebSocket, subprotocol: str):
+    """Listens for messages from the client, and detects disconnection."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            break
+        data = message.get("text")
+        handle_client_message(websocket, data if data is not None else message.get("bytes"), subprotocol)
+
+PING_FRAME = frames.Frame(json.dumps({"type": "ping"}))
 
 async def server_pinger(websocket: WebSocket):
     """Sends a ping to the client every 20 seconds to keep the connection alive."""
@@ -137,7 +669,9 @@ async def server_pinger(websocket: WebSocket):
         try:
             await asyncio.sleep(20)
             # The subprotocol negotiation ensures the client should understand this.
-            await websocket.send_json({"type": "ping"})
+            # Pings go through the send queue so they never interleave with a
+            # frame being written by the connection's writer task.
+            manager.send(websocket, PING_FRAME)
         except (WebSocketDisconnect, asyncio.CancelledError):
             # Stop pinging if the client disconnects or the task is cancelled.
             break
@@ -145,17 +679,107 @@ async def server_pinger(websocket: WebSocket):
             print(f"Error in WebSocket pinger: {e}")
             break
 
+# Most messages replayed to a reconnecting client; beyond that the client is
+# told to resync over REST instead.
+WS_REPLAY_LIMIT = int(os.getenv("WS_REPLAY_LIMIT", 200))
+
+async def load_replay(
+    last_seen_id: int | None, cursor: str | None, channel_ids: set[int]
+) -> list[tuple[int, str]] | None:
+    """
+    Collects the messages a reconnecting client missed, oldest first.
+
+    The client's position is an opaque feed cursor or the ID of the newest
+    message it has seen. Missed messages come from the hot feed cache when it
+    covers the gap and from the database otherwise. With `channel_ids`, only
+    those channels are replayed. Returns None when the position is unknown or
+    the gap exceeds WS_REPLAY_LIMIT.
+    """
+    if cursor:
+        try:
+            position = decode_cursor(cursor)
+        except ValueError:
+            return None
+    else:
+        position = feed_cache.position_of(last_seen_id)
+
+    if position is not None:
+        cached = feed_cache.since(position)
+        if cached is not None:
+            replay = [
+                (message_id, message_json)
+                for message_id, channel_id, message_json in cached
+                if not channel_ids or channel_id in channel_ids
+            ]
+            return replay if len(replay) <= WS_REPLAY_LIMIT else None
+
+    async for db in get_db():
+        if position is None:
+            message = await crud.get_message(db, message_id=last_seen_id)
+            if message is None:
+                return None
+            position = (message.created_at, message.id)
+        rows = await crud.get_feed_rows_after(
+            db, after=position, limit=WS_REPLAY_LIMIT + 1, channel_ids=channel_ids
+        )
+        if len(rows) > WS_REPLAY_LIMIT:
+            return None
+        return [(row.id, rendering.render_row(row)) for row in rows]
+
+async def replay_missed_messages(
+    websocket: WebSocket, last_seen_id: int | None, cursor: str | None, channel_ids: set[int]
+):
+    """Sends a reconnecting client what it missed, then switches it to live mode."""
+    try:
+        replay = await load_replay(last_seen_id, cursor, channel_ids)
+    except Exception as e:
+        print(f"Error loading WebSocket replay: {e}")
+        replay = None
+    if replay is None:
+        # Too far behind (or unknown position): reload the feed over REST.
+        replay = [(None, RESYNC_FRAME)]
+    manager.finish_replay(websocket, replay)
+
 @app.websocket("/api/feed/stream")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(
+    websocket: WebSocket,
+    last_seen_id: int | None = None,
+    cursor: str | None = None,
+    channels: str | None = None,
+):
+    """
+    Streams new messages as they are ingested.
+
+    By default every channel is streamed. `channels` (comma-separated IDs)
+    subscribes the client to just those channels from the start; clients can
+    also send `{"type": "subscribe" | "unsubscribe", "channels": [...]}`.
+
+    A reconnecting client passes the ID of the newest message it has seen as
+    `last_seen_id` (or a feed `cursor`) and is first sent the messages it
+    missed, oldest first, before it receives live messages.
+
+    Frames are JSON text by default; clients offering the `msgpack`
+    subprotocol get the same objects as MessagePack binary frames. Frames
+    are also compressed with permessage-deflate when the client supports it
+    (uvicorn's `--ws-per-message-deflate`, on by default).
+    """
+    channel_ids = parse_channel_ids(channels) if channels else set()
+    resuming = last_seen_id is not None or bool(cursor)
+    subprotocol = frames.negotiate(websocket.scope.get("subprotocols", []))
+    client = await manager.connect(
+        websocket, replaying=resuming, channels=channel_ids, subprotocol=subprotocol
+    )
+    if resuming:
+        await replay_missed_messages(websocket, last_seen_id, cursor, channel_ids)
     
     # Run listener and pinger concurrently
-    listener_task = asyncio.create_task(client_listener(websocket))
+    listener_task = asyncio.create_task(client_listener(websocket, subprotocol))
     pinger_task = asyncio.create_task(server_pinger(websocket))
     
-    # Wait for either task to complete (which signals a disconnect or error)
+    # Wait for any task to complete (which signals a disconnect or error).
+    # The writer task only finishes if a send to the socket fails.
     done, pending = await asyncio.wait(
-        [listener_task, pinger_task],
+        [listener_task, pinger_task, client.writer_task],
         return_when=asyncio.FIRST_COMPLETED,
     )
 
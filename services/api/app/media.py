@@ -0,0 +1,65 @@
+"""
+Serving message media from the content-addressed media store.
+
+The collector records media metadata at ingest but downloads files lazily:
+the first request for a file sends its message ID on the 'media_requests'
+channel, and waits for the collector shard tracking the channel to store
+the file under MEDIA_DIR (shared with the collector) by its SHA-256 and
+record the digest. Later requests are served straight from disk, with range
+requests and long-lived caching, since a message's media never changes.
+"""
+import asyncio
+import os
+
+from sqlalchemy import func, select
+
+from . import crud
+
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+# How long a request waits for the collector to download a file.
+MEDIA_FETCH_TIMEOUT = float(os.getenv("MEDIA_FETCH_TIMEOUT", 30))
+# The download request is repeated this often while waiting, in case the
+# collector missed it (NOTIFYs are lost while it reconnects).
+MEDIA_REQUEST_INTERVAL = 5.0
+MEDIA_POLL_INTERVAL = 0.25
+
+# Files are immutable, and so are their URLs' contents.
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def store_path(digest: str) -> str:
+    """Where the file with a given SHA-256 lives; mirrors the collector's `media.store_path`."""
+    return os.path.join(MEDIA_DIR, digest[:2], digest[2:4], digest)
+
+
+async def request_download(db, message_id: int):
+    """Asks the collector to download a message's media."""
+    await db.execute(select(func.pg_notify("media_requests", str(message_id))))
+    await db.commit()
+
+
+async def fetch(db, message_id: int, timeout: float | None = None):
+    """
+    Waits until a message's media is downloaded, requesting the download and
+    polling for its digest. Returns its row, None if the message has no
+    media, or the row without a digest if it wasn't downloaded in time
+    (by default MEDIA_FETCH_TIMEOUT seconds).
+
+    Each poll is its own short transaction: the session is closed in between,
+    so waiting requests don't hold on to pooled connections.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (MEDIA_FETCH_TIMEOUT if timeout is None else timeout)
+    requested_at = None
+    try:
+        while True:
+            media = await crud.get_media(db, message_id)
+            if media is None or media.sha256 is not None or loop.time() >= deadline:
+                return media
+            if requested_at is None or loop.time() - requested_at >= MEDIA_REQUEST_INTERVAL:
+                await request_download(db, message_id)
+                requested_at = loop.time()
+            await db.close()
+            await asyncio.sleep(MEDIA_POLL_INTERVAL)
+    finally:
+        await db.close()
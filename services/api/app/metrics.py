@@ -0,0 +1,49 @@
+"""
+Application metrics for the API service.
+
+These are registered in the default Prometheus registry, so they are served
+by the `/metrics` endpoint exposed by the `Instrumentator`.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+WS_CONNECTIONS = Gauge(
+    "api_ws_connections",
+    "Currently connected feed stream clients.",
+)
+
+WS_FANOUT_SECONDS = Histogram(
+    "api_ws_fanout_seconds",
+    "Time taken to hand one frame to every client send queue.",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5),
+)
+
+WS_SEND_LAG_SECONDS = Histogram(
+    "api_ws_send_lag_seconds",
+    "Time a frame waits in a client send queue before it is written.",
+)
+
+WS_SEND_QUEUE_DEPTH = Gauge(
+    "api_ws_send_queue_depth",
+    "Frames waiting in the send queues of the clients reached by the last broadcast.",
+)
+
+WS_EVICTIONS = Counter(
+    "api_ws_slow_consumer_evictions_total",
+    "Clients that fell too far behind, by the action taken.",
+    ["action"],
+)
+
+FEED_CACHE_REQUESTS = Counter(
+    "api_feed_cache_requests_total",
+    "First-page feed reads, by whether the hot feed cache could serve them.",
+    ["result"],
+)
+
+E2E_STAGE_SECONDS = Histogram(
+    "api_e2e_stage_seconds",
+    "Latency of each stage between a call being posted on Telegram and its "
+    "delivery to stream clients: telegram_to_handler, handler_to_commit, "
+    "commit_to_notify and notify_to_delivery (to the last client).",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
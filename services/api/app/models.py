@@ -1,8 +1,27 @@
-from sqlalchemy import Column, BigInteger, String, DateTime, ForeignKey, Index, func
+import os
+
+from sqlalchemy import (
+    Column, BigInteger, Integer, LargeBinary, String, DateTime, ForeignKey, Index, func, literal_column,
+)
+# Importing the dialect registers the typed full text search functions.
+from sqlalchemy.dialects import postgresql  # noqa: F401
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
 
+# Text search configuration for message bodies. Calls are mostly tickers,
+# addresses and slang, so no stemming or stop words. It is inlined rather than
+# bound so queries match the expression of the full text index.
+SEARCH_CONFIG = literal_column("'simple'")
+
+def body_tsvector(body):
+    return func.to_tsvector(SEARCH_CONFIG, body)
+
+# Mirrors the collector's setting: messages is range partitioned by month on
+# created_at, which is then part of the primary key, and each partition
+# carries its own feed index (see the collector's `partitions.py`).
+MESSAGES_PARTITIONED = os.getenv("MESSAGES_PARTITIONED", "false").lower() in ("1", "true", "yes")
+
 class Channel(Base):
     __tablename__ = "channels"
 
@@ -17,15 +36,112 @@ class Message(Base):
     id = Column(BigInteger, primary_key=True, index=True)
     channel_id = Column(BigInteger, ForeignKey("channels.id"), nullable=False, index=True)
     body = Column(String, nullable=False)
-    created_at = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, primary_key=MESSAGES_PARTITIONED)
     ingested_at = Column(
         DateTime(timezone=True),
         nullable=False,
         server_default=func.now()
     )
+    # The message pre-rendered at ingest up to its channel (see `rendering.py`).
+    rendered = Column(String, nullable=True)
+    # The earlier message from another channel this one reposts, set by the
+    # collector's near-duplicate detection. Reposts are left out of the feed.
+    duplicate_of = Column(BigInteger, nullable=True)
+    # Edits and deletions on Telegram, applied by the collector: the last
+    # edit, the body's version, and the soft delete, which hides the message.
+    edited_at = Column(DateTime(timezone=True), nullable=True)
+    version = Column(Integer, nullable=False, server_default="1")
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
 
     channel = relationship("Channel", back_populates="messages")
+    # Loaded with the message: it is one row by primary key, and async
+    # sessions can't lazy load on attribute access.
+    media = relationship(
+        "MessageMedia",
+        primaryjoin="Message.id == foreign(MessageMedia.message_id)",
+        uselist=False,
+        lazy="joined",
+        viewonly=True,
+    )
+
+    __table_args__ = (
+        # Serves both the first feed page and keyset (cursor) pagination.
+        *(() if MESSAGES_PARTITIONED else (
+            Index("idx_messages_created_at_id_desc", created_at.desc(), id.desc()),
+        )),
+        # Latest stored message per channel, for the collector's backfill.
+        Index("idx_messages_channel_id_id", channel_id, id),
+        # Full text search over message bodies (Postgres only).
+        Index(
+            "idx_messages_body_fts", body_tsvector(body), postgresql_using="gin"
+        ).ddl_if(dialect="postgresql"),
+        {"postgresql_partition_by": "RANGE (created_at)"} if MESSAGES_PARTITIONED else {},
+    )
+
+class MessageMention(Base):
+    """A ticker, contract address or DEX link found in a message at ingest."""
+    __tablename__ = "message_mentions"
+
+    message_id = Column(BigInteger, primary_key=True)
+    kind = Column(String, primary_key=True)
+    token = Column(String, primary_key=True)
+    channel_id = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("idx_message_mentions_token_created_at", token, created_at.desc()),
+        Index("idx_message_mentions_created_at", created_at),
+    )
+
+class MessageMedia(Base):
+    """
+    A message's photo, video or document, recorded by the collector at ingest.
+    The digests name its files in the media store once downloaded.
+    """
+    __tablename__ = "message_media"
+
+    message_id = Column(BigInteger, primary_key=True)
+    channel_id = Column(BigInteger, nullable=False)
+    kind = Column(String, nullable=False)
+    mime_type = Column(String, nullable=True)
+    size = Column(BigInteger, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    file_id = Column(BigInteger, nullable=False)
+    file_reference = Column(LargeBinary, nullable=True)
+    # Telegram size type of the thumbnail, if the media has one.
+    thumbnail = Column(String, nullable=True)
+    sha256 = Column(String, nullable=True)
+    thumbnail_sha256 = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("idx_message_media_file_id", file_id),
+    )
+
+class ChannelActivity(Base):
+    """Messages per channel per 1m/1h/1d bucket, kept by the collector (see its `rollups.py`)."""
+    __tablename__ = "channel_activity"
+
+    granularity = Column(String, primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    channel_id = Column(BigInteger, primary_key=True)
+    messages = Column(Integer, nullable=False)
 
     __table_args__ = (
-        Index("idx_messages_created_at_desc", created_at.desc()),
-    ) 
\ No newline at end of file
+        Index("idx_channel_activity_channel_bucket", granularity, channel_id, bucket),
+    )
+
+class TokenActivity(Base):
+    """Mentions per token and channel per 1m/1h/1d bucket, kept by the collector."""
+    __tablename__ = "token_activity"
+
+    granularity = Column(String, primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    kind = Column(String, primary_key=True)
+    token = Column(String, primary_key=True)
+    channel_id = Column(BigInteger, primary_key=True)
+    mentions = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("idx_token_activity_token_bucket", granularity, token, bucket),
+    )
@@ -0,0 +1,49 @@
+import base64
+from datetime import datetime
+
+
+def encode_cursor(created_at: datetime, message_id: int, rank: float | None = None) -> str:
+    """
+    Encodes a feed position as an opaque cursor.
+
+    The cursor points at the last message of a page; the next page starts with
+    the message immediately older than it in `(created_at, id)` order. Search
+    results ordered by relevance also carry the `rank` of that message.
+    """
+    raw = f"{created_at.isoformat()}|{message_id}"
+    if rank is not None:
+        raw += f"|{rank!r}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode(cursor: str) -> list[str]:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return base64.urlsafe_b64decode(padded).decode().split("|")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """
+    Decodes a cursor produced by `encode_cursor`.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        created_at, message_id = _decode(cursor)[:2]
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def decode_ranked_cursor(cursor: str) -> tuple[float, datetime, int]:
+    """
+    Decodes a cursor that was encoded with a `rank`.
+
+    Raises:
+        ValueError: If the cursor is malformed or has no rank.
+    """
+    try:
+        created_at, message_id, rank = _decode(cursor)
+        return float(rank), datetime.fromisoformat(created_at), int(message_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
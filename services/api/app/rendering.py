@@ -0,0 +1,72 @@
+"""
+Direct JSON rendering of feed rows, bypassing ORM objects and pydantic.
+
+The output is byte-for-byte what `schemas.Message.model_dump_json()` returns
+for the same message. When the collector stored a pre-rendered head for a
+message (`messages.rendered`), a feed entry is that head followed by its
+channel; only the channel is rendered at read time, so renames still show.
+orjson is used when installed.
+"""
+import json
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value) -> str:
+    """Compact JSON with non-ASCII characters unescaped, like pydantic's."""
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def format_datetime(value: datetime) -> str:
+    # Match pydantic's JSON encoding, which renders UTC offsets as "Z".
+    text = value.isoformat()
+    if text.endswith("+00:00"):
+        text = text[:-6] + "Z"
+    return text
+
+
+def render_head(message_id: int, body: str, created_at: datetime) -> str:
+    """Renders a message up to its channel: `{"id":..,"body":..,"created_at":..,"channel":`."""
+    return dumps({"id": message_id, "body": body, "created_at": format_datetime(created_at)})[:-1] + ',"channel":'
+
+
+def render_channel(channel_id: int, name: str) -> str:
+    return dumps({"id": channel_id, "name": name})
+
+
+def render_row(row) -> str:
+    """
+    Renders a row of `crud.FEED_COLUMNS` as `schemas.Message` JSON, from its
+    stored head when there is one. Messages with media or edits always have
+    one: the collector renders them into it.
+    """
+    head = row.rendered or render_head(row.id, row.body, row.created_at)
+    return head + render_channel(row.channel_id, row.channel_name) + "}"
+
+
+def render_page(rows) -> str:
+    return "[" + ",".join(render_row(row) for row in rows) + "]"
+
+
+def apply_update(message_json: str, update: dict) -> str:
+    """
+    Applies an edit's `update` delta (see the collector's
+    `payloads.render_change`) to a message's JSON, in `schemas.Message` order.
+    """
+    message = json.loads(message_json)
+    patched = {
+        "id": message["id"],
+        "body": update["body"],
+        "created_at": message["created_at"],
+        "edited_at": update["edited_at"],
+    }
+    if "media" in message:
+        patched["media"] = message["media"]
+    patched["channel"] = message["channel"]
+    return dumps(patched)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 from datetime import datetime
 
 class Channel(BaseModel):
@@ -8,11 +8,45 @@ class Channel(BaseModel):
     class Config:
         from_attributes = True
 
+class MessageMedia(BaseModel):
+    """A message's media; the file is served from /api/media/{message id}."""
+    kind: str
+    mime_type: str | None
+    size: int | None
+    width: int | None
+    height: int | None
+    # Whether /api/media/{message id}/thumbnail has a thumbnail.
+    thumbnail: bool
+
+    @field_validator("thumbnail", mode="before")
+    @classmethod
+    def _has_thumbnail(cls, value):
+        # The ORM row holds the Telegram thumbnail size type, or NULL.
+        return value if isinstance(value, bool) else value is not None
+
+    class Config:
+        from_attributes = True
+
 class Message(BaseModel):
     id: int
     body: str
     created_at: datetime
+    # Left out of the JSON for messages never edited.
+    edited_at: datetime | None = Field(default=None, exclude_if=lambda edited_at: edited_at is None)
+    # Left out of the JSON for messages without media.
+    media: MessageMedia | None = Field(default=None, exclude_if=lambda media: media is None)
     channel: Channel
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True 
+
+class TrendingToken(BaseModel):
+    token: str
+    kind: str
+    mentions: int
+    channels: int
+
+class ChannelActivity(BaseModel):
+    channel_id: int
+    bucket: datetime
+    messages: int
@@ -1,3 +1,4 @@
+import os
 import pytest
 import pytest_asyncio
 from fastapi.testclient import TestClient
@@ -55,4 +56,264 @@ async def test_read_messages(test_db):
     assert len(data) == 1
     assert data[0]["body"] == "Test message"
     # The channel is not directly embedded in the response anymore based on the Pydantic schema
-    # assert data[0]["channel"]["name"] == "Test Channel" 
\ No newline at end of file
+    # assert data[0]["channel"]["name"] == "Test Channel" 
+@pytest.mark.asyncio
+async def test_read_messages_cursor_pagination(test_db):
+    # Add a page worth of older messages behind the one from the previous test
+    async with TestingSessionLocal() as session:
+        for message_id in range(10, 15):
+            session.add(Message(
+                id=message_id,
+                channel_id=1,
+                body=f"Older message {message_id}",
+                created_at=datetime(2023, 1, 1, 12, message_id),
+            ))
+        await session.commit()
+
+    first = client.get("/api/feed", params={"limit": 3})
+    assert first.status_code == 200
+    assert [m["id"] for m in first.json()] == [1, 14, 13]
+    cursor = first.headers["X-Next-Cursor"]
+
+    second = client.get("/api/feed", params={"limit": 3, "cursor": cursor})
+    assert [m["id"] for m in second.json()] == [12, 11, 10]
+
+    third = client.get("/api/feed", params={"limit": 3, "cursor": second.headers["X-Next-Cursor"]})
+    assert third.json() == []
+    assert "X-Next-Cursor" not in third.headers
+
+    # Offset paging keeps working for existing clients
+    legacy = client.get("/api/feed", params={"limit": 3, "skip": 3})
+    assert [m["id"] for m in legacy.json()] == [12, 11, 10]
+
+def test_read_messages_rejects_malformed_cursor():
+    response = client.get("/api/feed", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+def test_search_query_uses_full_text_index_expression():
+    from sqlalchemy.dialects import postgresql
+    from app.crud import build_search_query
+
+    query = build_search_query("pepe", channel_ids={1}, by_rank=True)
+    sql = str(query.compile(dialect=postgresql.dialect()))
+
+    # Must match the expression of idx_messages_body_fts to use the GIN index
+    assert "to_tsvector('simple', messages.body) @@ websearch_to_tsquery('simple'" in sql
+    assert "ORDER BY ts_rank_cd" in sql
+
+def test_search_rejects_cursor_without_rank_when_sorting_by_rank():
+    response = client.get("/api/search", params={"q": "pepe", "sort": "rank", "cursor": "MjAyMy0wMS0wMXwx"})
+    assert response.status_code == 400
+
+def test_search_requires_query():
+    response = client.get("/api/search")
+    assert response.status_code == 422
+
+@pytest.mark.asyncio
+async def test_token_endpoints(test_db):
+    from app.models import MessageMention
+
+    async with TestingSessionLocal() as session:
+        session.add(Message(id=20, channel_id=1, body="Aping $PEPE", created_at=datetime.utcnow()))
+        session.add(Message(id=21, channel_id=1, body="$pepe again, also $WIF", created_at=datetime.utcnow()))
+        for message_id, token in [(20, "$PEPE"), (21, "$PEPE"), (21, "$WIF")]:
+            session.add(MessageMention(
+                message_id=message_id, kind="ticker", token=token, channel_id=1, created_at=datetime.utcnow()
+            ))
+        await session.commit()
+
+    response = client.get("/api/tokens/pepe/messages")
+    assert response.status_code == 200
+    assert sorted(m["id"] for m in response.json()) == [20, 21]
+
+    trending = client.get("/api/tokens/trending", params={"hours": 1}).json()
+    assert trending[0] == {"token": "$PEPE", "kind": "ticker", "mentions": 2, "channels": 1}
+
+@pytest.mark.asyncio
+async def test_token_messages_by_pasted_dex_link(test_db):
+    from urllib.parse import quote
+    from app.crud import normalize_token
+    from app.models import MessageMention
+
+    link = "dexscreener.com/solana/7GCihgDB8fe6KNjn2MYtkzZcRjQy3t9GHdC8uHYmW2hr"
+    async with TestingSessionLocal() as session:
+        session.add(MessageMention(
+            message_id=20, kind="dex_link", token=link, channel_id=1, created_at=datetime.utcnow()
+        ))
+        await session.commit()
+
+    pasted = f"https://www.DexScreener.com/{link.partition('/')[2]}/?maker=abc"
+    assert normalize_token(pasted) == normalize_token(link) == link
+    response = client.get(f"/api/tokens/{quote(pasted, safe='')}/messages")
+    assert response.status_code == 200
+    assert [m["id"] for m in response.json()] == [20]
+
+@pytest.mark.asyncio
+async def test_read_messages_leaves_out_reposts(test_db):
+    async with TestingSessionLocal() as session:
+        session.add(Channel(id=2, name="Reposting Channel"))
+        await session.commit()
+        session.add(Message(id=30, channel_id=2, body="Aping $PEPE", created_at=datetime.utcnow(), duplicate_of=20))
+        await session.commit()
+
+    response = client.get("/api/feed", params={"limit": 100})
+    assert response.status_code == 200
+    ids = [m["id"] for m in response.json()]
+    assert 20 in ids
+    assert 30 not in ids
+
+@pytest.mark.asyncio
+async def test_read_messages_shows_edits_and_leaves_out_deletions(test_db):
+    now = datetime.utcnow()
+    async with TestingSessionLocal() as session:
+        # Edited messages have a head re-rendered by the collector.
+        rendered = f'{{"id":31,"body":"Sell $PEPE","created_at":"{now.isoformat()}","edited_at":"{now.isoformat()}","channel":'
+        session.add(Message(
+            id=31, channel_id=1, body="Sell $PEPE", created_at=now, edited_at=now, version=2, rendered=rendered
+        ))
+        session.add(Message(id=32, channel_id=1, body="Buy $RUG", created_at=now, deleted_at=now))
+        await session.commit()
+
+    messages = {m["id"]: m for m in client.get("/api/feed", params={"limit": 100}).json()}
+    assert 32 not in messages
+    assert "edited_at" in messages[31]
+    assert "edited_at" not in messages[20]
+
+@pytest.mark.asyncio
+async def test_stats_read_from_rollups(test_db):
+    from datetime import timedelta, timezone
+    from app.models import ChannelActivity, TokenActivity
+
+    hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    async with TestingSessionLocal() as session:
+        for bucket, channel_id, messages in [(hour - timedelta(hours=2), 1, 4), (hour, 1, 2), (hour, 2, 5)]:
+            session.add(ChannelActivity(granularity="1h", bucket=bucket, channel_id=channel_id, messages=messages))
+        for channel_id, mentions in [(1, 3), (2, 1)]:
+            session.add(TokenActivity(
+                granularity="1h", bucket=hour, kind="ticker", token="$PEPE", channel_id=channel_id, mentions=mentions
+            ))
+        await session.commit()
+
+    channels = client.get("/api/stats/channels", params={"granularity": "1h", "channel_id": 1}).json()
+    assert [row["messages"] for row in channels] == [4, 2]
+
+    tokens = client.get("/api/stats/tokens", params={"granularity": "1h"}).json()
+    assert tokens == [{"token": "$PEPE", "kind": "ticker", "mentions": 4, "channels": 2}]
+
+def test_stats_reject_ranges_with_too_many_buckets():
+    response = client.get(
+        "/api/stats/channels",
+        params={"granularity": "1m", "since": "2024-01-01T00:00:00Z", "until": "2024-02-01T00:00:00Z"},
+    )
+    assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_media_is_served_with_ranges_and_cache_headers(test_db, tmp_path, monkeypatch):
+    import hashlib
+    from app import media
+    from app.models import MessageMedia
+
+    data = b"\x89PNG chart bytes"
+    digest = hashlib.sha256(data).hexdigest()
+    monkeypatch.setattr(media, "MEDIA_DIR", str(tmp_path))
+    path = media.store_path(digest)
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(data)
+    async with TestingSessionLocal() as session:
+        session.add(MessageMedia(
+            message_id=40, channel_id=1, kind="photo", mime_type="image/png", size=len(data),
+            file_id=555, sha256=digest,
+        ))
+        await session.commit()
+
+    response = client.get("/api/media/40")
+    assert response.status_code == 200
+    assert response.content == data
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["etag"] == f'"{digest}"'
+    assert "immutable" in response.headers["cache-control"]
+
+    partial = client.get("/api/media/40", headers={"Range": "bytes=5-9"})
+    assert partial.status_code == 206
+    assert partial.content == data[5:10]
+    assert partial.headers["content-range"] == f"bytes 5-9/{len(data)}"
+
+    assert client.get("/api/media/40", headers={"If-None-Match": f'"{digest}"'}).status_code == 304
+    assert client.get("/api/media/40/thumbnail").status_code == 404
+    assert client.get("/api/media/41").status_code == 404
+
+@pytest.mark.asyncio
+async def test_media_not_yet_downloaded_is_requested_from_the_collector(test_db, monkeypatch):
+    from unittest.mock import AsyncMock
+    from app import media
+    from app.models import MessageMedia
+
+    async with TestingSessionLocal() as session:
+        session.add(MessageMedia(message_id=42, channel_id=1, kind="video", mime_type="video/mp4", file_id=777))
+        await session.commit()
+    request_download = AsyncMock()
+    monkeypatch.setattr(media, "request_download", request_download)
+    monkeypatch.setattr(media, "MEDIA_FETCH_TIMEOUT", 0.1)
+
+    response = client.get("/api/media/42")
+    assert response.status_code == 202
+    assert response.headers["retry-after"] == "5"
+    assert request_download.await_args.args[1] == 42
+
+@pytest.mark.asyncio
+async def test_media_fetch_releases_the_session_between_polls(monkeypatch):
+    from types import SimpleNamespace
+    from unittest.mock import AsyncMock
+    from app import crud, media
+
+    get_media = AsyncMock(return_value=SimpleNamespace(sha256=None))
+    monkeypatch.setattr(crud, "get_media", get_media)
+    monkeypatch.setattr(media, "request_download", AsyncMock())
+    monkeypatch.setattr(media, "MEDIA_POLL_INTERVAL", 0.01)
+    db = AsyncMock()
+
+    await media.fetch(db, 42, timeout=0.05)
+    assert get_media.await_count > 1
+    assert db.close.await_count >= get_media.await_count
+
+@pytest.mark.asyncio
+async def test_export_streams_filtered_messages_oldest_first(test_db, monkeypatch):
+    import csv
+    import io
+    import json as jsonlib
+    from app import export
+    from app.models import MessageMention
+
+    async with TestingSessionLocal() as session:
+        for message_id, channel_id, minute in [(50, 1, 1), (51, 2, 2), (52, 1, 3), (53, 1, 4)]:
+            session.add(Message(
+                id=message_id, channel_id=channel_id, body=f"Export {message_id} $WIF",
+                created_at=datetime(2020, 6, 1, 0, minute),
+            ))
+        session.add(MessageMention(
+            message_id=52, kind="ticker", token="$WIF", channel_id=1, created_at=datetime(2020, 6, 1, 0, 3)
+        ))
+        await session.commit()
+    monkeypatch.setattr(export, "EXPORT_BATCH_SIZE", 2)
+    window = {"since": "2020-06-01T00:00:00", "until": "2020-06-01T00:04:00"}
+
+    response = client.get("/api/export", params={**window, "channel_id": 1})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [jsonlib.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == [50, 52]
+    assert lines[0]["channel_name"] == "Test Channel"
+
+    by_token = client.get("/api/export", params={**window, "format": "csv", "token": "wif"})
+    rows = list(csv.reader(io.StringIO(by_token.text)))
+    assert rows[0] == list(export.COLUMNS)
+    assert [row[0] for row in rows[1:]] == ["52"]
+
+def test_export_turns_requests_away_when_all_slots_are_taken(monkeypatch):
+    from app import export
+
+    monkeypatch.setattr(export, "_running", export.EXPORT_CONCURRENCY)
+    response = client.get("/api/export")
+    assert response.status_code == 429
+    assert "retry-after" in response.headers
@@ -0,0 +1,276 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.connections import ConnectionManager, RESYNC_FRAME
+
+
+def _fake_websocket(send_text=None):
+    websocket = MagicMock()
+    websocket.accept = AsyncMock()
+    websocket.close = AsyncMock()
+    websocket.send_text = send_text or AsyncMock()
+    return websocket
+
+
+@pytest.mark.asyncio
+async def test_broadcast_delivers_frame_to_every_client():
+    """
+    Tests that a broadcast frame is written to every connected client.
+    """
+    manager = ConnectionManager()
+    sockets = [_fake_websocket() for _ in range(3)]
+    for websocket in sockets:
+        await manager.connect(websocket)
+
+    await manager.broadcast('{"id":1}')
+    await asyncio.sleep(0.01)
+
+    for websocket in sockets:
+        websocket.send_text.assert_awaited_once_with('{"id":1}')
+
+
+@pytest.mark.asyncio
+async def test_slow_client_does_not_delay_other_clients():
+    """
+    Tests that a client stuck in send_text does not hold up the others.
+    """
+    stalled = asyncio.Event()
+
+    async def never_returns(frame):
+        await stalled.wait()
+
+    manager = ConnectionManager()
+    slow = _fake_websocket(send_text=AsyncMock(side_effect=never_returns))
+    fast = _fake_websocket()
+    await manager.connect(slow)
+    await manager.connect(fast)
+
+    await manager.broadcast("a")
+    await manager.broadcast("b")
+    await asyncio.sleep(0.01)
+
+    assert [call.args[0] for call in fast.send_text.await_args_list] == ["a", "b"]
+    stalled.set()
+
+
+@pytest.mark.asyncio
+async def test_lagging_client_gets_resync_marker():
+    """
+    Tests that a client past the lag bound has its backlog replaced by a resync marker.
+    """
+    stalled = asyncio.Event()
+
+    async def blocks(frame):
+        await stalled.wait()
+
+    manager = ConnectionManager(send_queue_size=2, slow_consumer_policy="resync")
+    slow = _fake_websocket(send_text=AsyncMock(side_effect=blocks))
+    client = await manager.connect(slow)
+
+    for frame in ["a", "b", "c", "d"]:
+        await manager.broadcast(frame)
+        await asyncio.sleep(0)
+
+    queued = [client.queue.get_nowait()[0] for _ in range(client.queue.qsize())]
+    assert queued == [RESYNC_FRAME]
+    assert json.loads(RESYNC_FRAME.text) == {"type": "resync"}
+    stalled.set()
+
+
+@pytest.mark.asyncio
+async def test_lagging_client_is_dropped_with_drop_policy():
+    """
+    Tests that the "drop" policy disconnects a client past the lag bound.
+    """
+    stalled = asyncio.Event()
+
+    async def blocks(frame):
+        await stalled.wait()
+
+    manager = ConnectionManager(send_queue_size=1, slow_consumer_policy="drop")
+    slow = _fake_websocket(send_text=AsyncMock(side_effect=blocks))
+    await manager.connect(slow)
+
+    for frame in ["a", "b", "c"]:
+        await manager.broadcast(frame)
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.01)
+
+    assert slow not in manager.active_connections
+    slow.close.assert_awaited_once_with(code=1013)
+    stalled.set()
+
+
+@pytest.mark.asyncio
+async def test_dead_socket_does_not_break_broadcast():
+    """
+    Tests that a socket failing mid-send only stops its own writer.
+    """
+    manager = ConnectionManager()
+    dead = _fake_websocket(send_text=AsyncMock(side_effect=RuntimeError("closed")))
+    alive = _fake_websocket()
+    dead_client = await manager.connect(dead)
+    await manager.connect(alive)
+
+    await manager.broadcast("a")
+    await asyncio.sleep(0.01)
+    await manager.broadcast("b")
+    await asyncio.sleep(0.01)
+
+    assert dead_client.writer_task.done()
+    assert [call.args[0] for call in alive.send_text.await_args_list] == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_replay_is_sent_before_live_frames_without_duplicates():
+    """
+    Tests that frames broadcast during a replay follow it, deduplicated.
+    """
+    # Arrange
+    manager = ConnectionManager()
+    websocket = _fake_websocket()
+    await manager.connect(websocket, replaying=True)
+
+    # Act
+    await manager.broadcast("live-3", message_id=3)
+    await manager.broadcast("live-4", message_id=4)
+    manager.finish_replay(websocket, [(2, "replay-2"), (3, "replay-3")])
+    await manager.broadcast("live-5", message_id=5)
+    await asyncio.sleep(0.01)
+
+    # Assert
+    sent = [call.args[0] for call in websocket.send_text.await_args_list]
+    assert sent == ["replay-2", "replay-3", "live-4", "live-5"]
+
+
+@pytest.mark.asyncio
+async def test_broadcast_reaches_only_channel_subscribers_and_firehose():
+    """
+    Tests that a channel's frame skips clients subscribed to other channels.
+    """
+    # Arrange
+    manager = ConnectionManager()
+    everything, follows_7, follows_8 = (_fake_websocket() for _ in range(3))
+    await manager.connect(everything)
+    await manager.connect(follows_7, channels={7})
+    await manager.connect(follows_8)
+    manager.subscribe(follows_8, {8})
+
+    # Act
+    await manager.broadcast("from-7", message_id=1, channel_id=7)
+    await asyncio.sleep(0.01)
+
+    # Assert
+    everything.send_text.assert_awaited_once_with("from-7")
+    follows_7.send_text.assert_awaited_once_with("from-7")
+    follows_8.send_text.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_unsubscribing_from_every_channel_restores_firehose():
+    """
+    Tests that a client with no subscriptions left receives every channel again.
+    """
+    # Arrange
+    manager = ConnectionManager()
+    websocket = _fake_websocket()
+    await manager.connect(websocket, channels={7})
+
+    # Act
+    manager.unsubscribe(websocket, {7})
+    await manager.broadcast("from-8", message_id=1, channel_id=8)
+    await asyncio.sleep(0.01)
+
+    # Assert
+    websocket.send_text.assert_awaited_once_with("from-8")
+    assert manager.subscribers == {}
+
+
+@pytest.mark.asyncio
+async def test_disconnect_removes_client_from_subscriber_index():
+    """
+    Tests that disconnected clients do not linger in the subscriber index.
+    """
+    # Arrange
+    manager = ConnectionManager()
+    websocket = _fake_websocket()
+    await manager.connect(websocket, channels={7, 8})
+
+    # Act
+    manager.disconnect(websocket)
+
+    # Assert
+    assert manager.subscribers == {}
+    assert manager.firehose == set()
+
+
+@pytest.mark.asyncio
+async def test_broadcast_records_delivery_latency_after_last_write():
+    """
+    Tests that the NOTIFY-to-delivery latency is recorded once, when the last client got the frame.
+    """
+    from unittest.mock import patch
+
+    manager = ConnectionManager()
+    for _ in range(2):
+        await manager.connect(_fake_websocket())
+
+    with patch("app.connections.metrics.E2E_STAGE_SECONDS") as histogram:
+        await manager.broadcast('{"id":1}', message_id=1, received_at=0.0)
+        await asyncio.sleep(0.01)
+
+    histogram.labels.assert_called_once_with(stage="notify_to_delivery")
+    histogram.labels.return_value.observe.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_broadcast_encodes_frame_once_per_subprotocol(monkeypatch):
+    """
+    Tests that a broadcast is encoded once per subprotocol and shared by the clients speaking it.
+    """
+    import msgpack
+    from app import frames
+
+    packb = MagicMock(side_effect=msgpack.packb)
+    monkeypatch.setattr(frames.msgpack, "packb", packb)
+    manager = ConnectionManager()
+    json_sockets = [_fake_websocket() for _ in range(2)]
+    msgpack_sockets = [_fake_websocket() for _ in range(3)]
+    for websocket in msgpack_sockets:
+        websocket.send_bytes = AsyncMock()
+        await manager.connect(websocket, subprotocol="msgpack")
+    for websocket in json_sockets:
+        await manager.connect(websocket)
+
+    await manager.broadcast('{"id":1,"body":"Buy $XYZ 🚀"}')
+    await asyncio.sleep(0.01)
+
+    assert packb.call_count == 1
+    for websocket in json_sockets:
+        websocket.send_text.assert_awaited_once_with('{"id":1,"body":"Buy $XYZ 🚀"}')
+    for websocket in msgpack_sockets:
+        (data,) = websocket.send_bytes.await_args.args
+        assert msgpack.unpackb(data) == {"id": 1, "body": "Buy $XYZ 🚀"}
+    msgpack_sockets[0].accept.assert_awaited_once_with(subprotocol="msgpack")
+
+
+@pytest.mark.asyncio
+async def test_repost_is_compact_only_for_clients_that_got_the_original():
+    """
+    Tests that clients sent the original get a repost frame, and subscribers of the repost's channel alone get the full message.
+    """
+    manager = ConnectionManager()
+    firehose, original_follower, repost_follower = (_fake_websocket() for _ in range(3))
+    await manager.connect(firehose)
+    await manager.connect(original_follower, channels={7})
+    await manager.connect(repost_follower, channels={8})
+
+    await manager.broadcast_repost("repost", "full", message_id=2, channel_id=8, original_channel_id=7)
+    await asyncio.sleep(0.01)
+
+    firehose.send_text.assert_awaited_once_with("repost")
+    original_follower.send_text.assert_not_awaited()
+    repost_follower.send_text.assert_awaited_once_with("full")
@@ -0,0 +1,92 @@
+import asyncio
+import io
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from app import export
+
+
+def _rows(*ids):
+    return [
+        SimpleNamespace(
+            id=message_id,
+            channel_id=1,
+            channel_name="Calls",
+            created_at=datetime(2024, 1, 1, 12, message_id, tzinfo=timezone.utc),
+            body=f"Buy ${message_id}, now",
+            duplicate_of=None,
+            edited_at=None,
+            deleted_at=None,
+        )
+        for message_id in ids
+    ]
+
+
+async def _batches(*batches):
+    for batch in batches:
+        yield batch
+
+
+async def _collect(batches, export_format):
+    assert export.acquire()
+    return [chunk async for chunk in export.stream(batches, export_format)]
+
+
+def test_csv_export_sends_header_once_and_a_chunk_per_batch():
+    chunks = asyncio.run(_collect(_batches(_rows(1, 2), _rows(3)), "csv"))
+
+    text = b"".join(chunks).decode()
+    assert len(chunks) == 2
+    assert text.splitlines()[0] == ",".join(export.COLUMNS)
+    assert text.splitlines()[1] == '1,1,Calls,2024-01-01T12:01:00Z,"Buy $1, now",,,'
+    assert len(text.splitlines()) == 4
+
+
+def test_parquet_export_streams_row_groups_then_footer():
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    chunks = asyncio.run(_collect(_batches(_rows(1, 2), _rows(3)), "parquet"))
+
+    table = pyarrow.parquet.read_table(io.BytesIO(b"".join(chunks)))
+    assert len(chunks) == 3
+    assert table.column("id").to_pylist() == [1, 2, 3]
+    assert table.schema.field("created_at").type == pyarrow.timestamp("us", tz="UTC")
+
+
+def test_abandoned_export_closes_its_rows_and_frees_its_slot():
+    closed = []
+
+    async def batches():
+        try:
+            for message_id in range(100):
+                yield _rows(message_id)
+        finally:
+            closed.append(True)
+
+    async def abandon():
+        assert export.acquire()
+        stream = export.stream(batches(), "ndjson")
+        await stream.__anext__()
+        assert export._running == 1
+        # What the server does when the client goes away mid-download.
+        await stream.aclose()
+
+    asyncio.run(abandon())
+
+    assert closed == [True]
+    assert export._running == 0
+
+
+def test_slots_are_taken_without_waiting_and_freed_by_unstarted_exports():
+    taken = [export.acquire() for _ in range(export.EXPORT_CONCURRENCY + 1)]
+    assert taken == [True] * export.EXPORT_CONCURRENCY + [False]
+
+    # Responses dropped before their first chunk still free their slot.
+    for _ in range(export.EXPORT_CONCURRENCY):
+        export.stream(_batches(), "csv")
+    assert export._running == 0
+    assert export.acquire()
+    export.stream(_batches(), "csv")
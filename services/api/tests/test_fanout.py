@@ -0,0 +1,152 @@
+import asyncio
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+from app import fanout
+from app.fanout import Delivery, FanoutHub
+
+# Runs a worker-side subscriber in its own process and prints the first
+# delivery it receives.
+SUBSCRIBER = """
+import asyncio, sys
+from app import fanout
+
+async def main():
+    async def on_delivery(delivery):
+        print(delivery.message_id, delivery.created_at.isoformat(), delivery.message_json, flush=True)
+        raise SystemExit(0)
+
+    async def noop():
+        pass
+
+    await fanout.subscribe(noop, on_delivery, noop, path=sys.argv[1])
+
+asyncio.run(main())
+"""
+
+
+def _delivery(message_id=1):
+    return Delivery(
+        message_id=message_id,
+        channel_id=7,
+        created_at=datetime(2024, 1, 1, 12, 0, 0, 123456, tzinfo=timezone.utc),
+        message_json='{"id":%d,"body":"gm ✓"}' % message_id,
+    )
+
+
+async def _wait_for_subscribers(hub, count):
+    for _ in range(500):
+        if len(hub) == count:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"{len(hub)} of {count} subscribers connected")
+
+
+@pytest.mark.asyncio
+async def test_hub_relays_deliveries_and_resyncs_to_subscribers(tmp_path):
+    """
+    Tests that every subscriber receives each delivery intact, and resync records.
+    """
+    path = str(tmp_path / "fanout.sock")
+    hub = FanoutHub(path)
+    await hub.start()
+    received = [[], []]
+
+    async def run(log):
+        async def on_delivery(delivery):
+            log.append(delivery)
+
+        async def on_resync():
+            log.append("resync")
+
+        async def on_connect():
+            log.append("connected")
+
+        await fanout.subscribe(on_connect, on_delivery, on_resync, path=path)
+
+    tasks = [asyncio.create_task(run(log)) for log in received]
+    await _wait_for_subscribers(hub, 2)
+
+    hub.publish(fanout.encode_delivery(_delivery(1)))
+    hub.publish(fanout.RESYNC_RECORD)
+    await asyncio.sleep(0.05)
+    await hub.close()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    for log in received:
+        assert log == ["connected", _delivery(1), "resync"]
+    assert not os.path.exists(path)
+
+
+def test_only_one_process_holds_the_hub_lock(tmp_path):
+    """
+    Tests that the hub lock is exclusive and is released when its holder closes it.
+    """
+    path = str(tmp_path / "fanout.lock")
+
+    first = fanout.acquire_hub_lock(path)
+    second = fanout.acquire_hub_lock(path)
+    first.close()
+    third = fanout.acquire_hub_lock(path)
+
+    assert first is not None
+    assert second is None
+    assert third is not None
+    third.close()
+
+
+@pytest.mark.asyncio
+async def test_hub_serves_worker_processes(tmp_path):
+    """
+    Tests that worker processes on the same host receive the hub's deliveries.
+    """
+    path = str(tmp_path / "fanout.sock")
+    hub = FanoutHub(path)
+    await hub.start()
+    app_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workers = [
+        await asyncio.create_subprocess_exec(
+            sys.executable, "-c", SUBSCRIBER, path,
+            cwd=app_root, stdout=subprocess.PIPE, env={**os.environ, "PYTHONPATH": app_root},
+        )
+        for _ in range(2)
+    ]
+    try:
+        await _wait_for_subscribers(hub, 2)
+        hub.publish(fanout.encode_delivery(_delivery(42)))
+        outputs = [await asyncio.wait_for(worker.communicate(), timeout=10) for worker in workers]
+    finally:
+        await hub.close()
+
+    for stdout, _ in outputs:
+        assert stdout.decode().strip() == '42 2024-01-01T12:00:00.123456+00:00 {"id":42,"body":"gm ✓"}'
+
+
+def test_delivery_record_round_trips_reposts():
+    """
+    Tests that the original of a repost survives encoding, and plain messages have none.
+    """
+    repost = Delivery(**{**_delivery(2).__dict__, "duplicate_of": 1, "original_channel_id": 9})
+    record = fanout.encode_delivery(repost)
+    plain = fanout.encode_delivery(_delivery(1))
+
+    assert fanout.decode_delivery(record[fanout._HEADER.size:]) == repost
+    decoded = fanout.decode_delivery(plain[fanout._HEADER.size:])
+    assert (decoded.duplicate_of, decoded.original_channel_id) == (None, None)
+
+
+@pytest.mark.asyncio
+async def test_read_record_returns_changes():
+    """
+    Tests that edits and deletions relayed by the hub are read back as changes.
+    """
+    change = fanout.Change(message_id=42, channel_id=3, frame_json='{"type":"delete","id":42,"channel_id":3}')
+    reader = asyncio.StreamReader()
+    reader.feed_data(fanout.encode_change(change) + fanout.encode_delivery(_delivery(43)))
+
+    assert await fanout.read_record(reader) == change
+    assert (await fanout.read_record(reader)).message_id == 43
@@ -0,0 +1,197 @@
+import json
+from datetime import datetime, timezone
+
+from fastapi.testclient import TestClient
+
+from app import main
+from app.feed_cache import HotFeedCache
+
+
+def _message(message_id, minute):
+    message = {
+        "id": message_id,
+        "body": f"Message {message_id}",
+        "created_at": f"2023-01-01T12:{minute:02d}:00Z",
+        "channel": {"id": 1, "name": "Test Channel"},
+    }
+    return message, json.dumps(message, separators=(",", ":"))
+
+
+def _loaded_cache(capacity, message_ids):
+    cache = HotFeedCache(capacity=capacity)
+    cache.load([
+        (datetime(2023, 1, 1, 12, message_id, tzinfo=timezone.utc), message_id, 1, _message(message_id, message_id)[1])
+        for message_id in sorted(message_ids, reverse=True)
+    ])
+    return cache
+
+
+def _page_ids(page):
+    return [message["id"] for message in json.loads(page.body)]
+
+
+def test_first_page_is_none_until_warmed():
+    """
+    Tests that a cold cache never answers, so reads fall back to the database.
+    """
+    cache = HotFeedCache(capacity=10)
+
+    assert cache.first_page(5) is None
+
+
+def test_add_keeps_newest_messages_in_feed_order():
+    """
+    Tests that new messages are inserted by position and the oldest evicted.
+    """
+    # Arrange
+    cache = _loaded_cache(capacity=3, message_ids=[1, 2, 3])
+
+    # Act
+    cache.add(*_message(5, 5))
+    cache.add(*_message(4, 4))
+
+    # Assert
+    assert _page_ids(cache.first_page(3)) == [5, 4, 3]
+
+
+def test_first_page_beyond_cached_messages_is_a_miss():
+    """
+    Tests that a page larger than the buffer is not served from it.
+    """
+    # Arrange
+    cache = _loaded_cache(capacity=3, message_ids=[1, 2, 3, 4])
+
+    # Assert
+    assert cache.first_page(4) is None
+
+
+def test_etag_changes_only_when_feed_changes():
+    """
+    Tests that the ETag is stable across reads and changes with new messages.
+    """
+    # Arrange
+    cache = _loaded_cache(capacity=10, message_ids=[1, 2])
+    etag = cache.first_page(2).etag
+
+    # Act / Assert
+    assert cache.first_page(2).etag == etag
+    cache.add(*_message(3, 3))
+    assert cache.first_page(2).etag != etag
+
+
+def test_read_messages_serves_first_page_from_cache_with_etag(monkeypatch):
+    """
+    Tests that /api/feed answers from the cache and honours If-None-Match.
+    """
+    # Arrange
+    monkeypatch.setattr(main, "feed_cache", _loaded_cache(capacity=10, message_ids=[1, 2, 3]))
+    client = TestClient(main.app)
+
+    # Act
+    response = client.get("/api/feed", params={"limit": 2})
+    not_modified = client.get(
+        "/api/feed", params={"limit": 2}, headers={"If-None-Match": response.headers["ETag"]}
+    )
+
+    # Assert
+    assert response.status_code == 200
+    assert [message["id"] for message in response.json()] == [3, 2]
+    assert "X-Next-Cursor" in response.headers
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+
+
+def test_since_returns_missed_messages_oldest_first():
+    """
+    Tests that a replay from the cache covers everything after the position.
+    """
+    # Arrange
+    cache = _loaded_cache(capacity=10, message_ids=[1, 2, 3, 4])
+
+    # Act
+    replay = cache.since(cache.position_of(2))
+
+    # Assert
+    assert [message_id for message_id, _, _ in replay] == [3, 4]
+
+
+def test_since_is_none_when_position_predates_the_buffer():
+    """
+    Tests that the cache refuses replays it cannot prove are complete.
+    """
+    # Arrange
+    cache = _loaded_cache(capacity=3, message_ids=[1, 2, 3, 4])
+
+    # Act
+    replay = cache.since((datetime(2023, 1, 1, 12, 1, tzinfo=timezone.utc), 1))
+
+    # Assert
+    assert replay is None
+
+
+def test_stream_replays_missed_messages_on_reconnect(monkeypatch):
+    """
+    Tests that a client reconnecting with last_seen_id first gets what it missed.
+    """
+    # Arrange
+    monkeypatch.setattr(main, "feed_cache", _loaded_cache(capacity=10, message_ids=[1, 2, 3]))
+    client = TestClient(main.app)
+
+    # Act
+    with client.websocket_connect("/api/feed/stream?last_seen_id=1", subprotocols=["json"]) as websocket:
+        received = [websocket.receive_json()["id"], websocket.receive_json()["id"]]
+
+    # Assert
+    assert received == [2, 3]
+
+
+def test_read_messages_serves_cached_page_compressed_per_accept_encoding(monkeypatch):
+    """
+    Tests that a hot page is sent brotli or gzip compressed as accepted, each with its own ETag.
+    """
+    # Arrange
+    cache = _loaded_cache(capacity=20, message_ids=range(20))
+    monkeypatch.setattr(main, "feed_cache", cache)
+    client = TestClient(main.app)
+
+    # Act
+    responses = {
+        encoding: client.get("/api/feed", params={"limit": 20}, headers={"Accept-Encoding": encoding})
+        for encoding in ("br", "gzip", "identity")
+    }
+    not_modified = client.get(
+        "/api/feed",
+        params={"limit": 20},
+        headers={"Accept-Encoding": "br", "If-None-Match": responses["br"].headers["ETag"]},
+    )
+
+    # Assert
+    assert responses["br"].headers["Content-Encoding"] == "br"
+    assert responses["gzip"].headers["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in responses["identity"].headers
+    assert len({response.headers["ETag"] for response in responses.values()}) == 3
+    assert all(response.json() == responses["identity"].json() for response in responses.values())
+    assert not_modified.status_code == 304
+    page = cache.first_page(20)
+    assert page.encoded("br") is page.encoded("br")
+
+
+def test_edits_and_deletions_change_cached_pages():
+    """
+    Tests that an edit is patched into the cached page and a deleted message leaves it.
+    """
+    # Arrange
+    cache = _loaded_cache(capacity=5, message_ids=range(3))
+    before = cache.first_page(3)
+
+    # Act
+    cache.update(1, lambda message_json: message_json.replace('"id":1', '"id":1,"edited":true'))
+    edited = cache.first_page(3)
+    cache.remove(2)
+    cache.update(99, lambda message_json: "never applied")
+
+    # Assert
+    assert edited.etag != before.etag
+    assert json.loads(edited.body)[1]["edited"] is True
+    assert _page_ids(cache.first_page(2)) == [1, 0]
+    assert cache.position_of(2) is None
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from app import rendering, schemas
+
+
+def _row(body, created_at, rendered=None):
+    return SimpleNamespace(
+        id=7,
+        body=body,
+        created_at=created_at,
+        rendered=rendered,
+        channel_id=3,
+        channel_name="Calls \"Pro\" 🚀",
+    )
+
+
+def _expected(row):
+    return schemas.Message(
+        id=row.id,
+        body=row.body,
+        created_at=row.created_at,
+        channel=schemas.Channel(id=row.channel_id, name=row.channel_name),
+    ).model_dump_json()
+
+
+@pytest.mark.parametrize("body", [
+    "Buy $XYZ",
+    "Ünïcödé 🚀 and 中文",
+    'Quotes " and \\ backslashes / slashes',
+    "Control \n\t\r\x00\x1f characters",
+    "Line separators   ",
+    "",
+])
+@pytest.mark.parametrize("created_at", [
+    datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc),
+    datetime(2023, 1, 1, 12, 0, 0, 123456, tzinfo=timezone.utc),
+    datetime(2023, 1, 1, 12, 0, tzinfo=timezone(timedelta(hours=2))),
+    datetime(2023, 1, 1, 12, 0),
+])
+def test_render_row_matches_schema_json(body, created_at):
+    row = _row(body, created_at)
+    assert rendering.render_row(row) == _expected(row)
+
+
+def test_render_row_uses_stored_head_with_current_channel():
+    created_at = datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc)
+    head = rendering.render_head(7, "Stored body", created_at)
+    row = _row("Ignored body", created_at, rendered=head)
+
+    rendered = rendering.render_row(row)
+
+    assert rendered == _expected(_row("Stored body", created_at))
+
+
+def test_render_page_is_a_json_array():
+    created_at = datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc)
+    rows = [_row("a", created_at), _row("b", created_at)]
+    assert rendering.render_page(rows) == "[" + ",".join(map(_expected, rows)) + "]"
+    assert rendering.render_page([]) == "[]"
+
+
+def test_schema_renders_media_before_channel_like_the_collector():
+    """Media is left out of messages without any, and sits before the channel otherwise."""
+    created_at = datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc)
+    plain = schemas.Message(id=7, body="gm", created_at=created_at, channel=schemas.Channel(id=3, name="c"))
+    with_media = schemas.Message(
+        id=8,
+        body="",
+        created_at=created_at,
+        media=schemas.MessageMedia(
+            kind="photo", mime_type="image/jpeg", size=81234, width=1280, height=720, thumbnail="m"
+        ),
+        channel=schemas.Channel(id=3, name="c"),
+    )
+
+    assert "media" not in plain.model_dump_json()
+    assert with_media.model_dump_json() == (
+        '{"id":8,"body":"","created_at":"2023-01-01T12:00:00Z",'
+        '"media":{"kind":"photo","mime_type":"image/jpeg","size":81234,"width":1280,"height":720,"thumbnail":true},'
+        '"channel":{"id":3,"name":"c"}}'
+    )
+
+
+def test_apply_update_replaces_body_and_keeps_schema_order():
+    """An edit's delta yields the JSON the schema renders for the edited message."""
+    created_at = datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc)
+    edited_at = created_at + timedelta(minutes=5)
+    original = schemas.Message(id=7, body="Buy $XYZ", created_at=created_at, channel=schemas.Channel(id=3, name="c"))
+    update = {
+        "type": "update", "id": 7, "channel_id": 3, "version": 2,
+        "edited_at": rendering.format_datetime(edited_at), "body": "Sell $XYZ",
+    }
+
+    patched = rendering.apply_update(original.model_dump_json(), update)
+
+    assert patched == schemas.Message(
+        id=7, body="Sell $XYZ", created_at=created_at, edited_at=edited_at, channel=schemas.Channel(id=3, name="c")
+    ).model_dump_json()
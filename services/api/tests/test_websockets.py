@@ -34,4 +34,87 @@ def test_websocket_receives_ping():
             assert data == {"type": "ping"}
     finally:
         # Restore the original sleep function to avoid side effects on other tests
-        main.asyncio.sleep = original_sleep 
\ No newline at end of file
+        main.asyncio.sleep = original_sleep 
+
+@pytest.mark.asyncio
+async def test_notification_handler_forwards_payload_without_db_lookup():
+    """
+    Tests that pre-serialized messages in a NOTIFY payload are broadcast as-is,
+    without the collector's stage timestamps.
+    """
+    from unittest.mock import ANY, AsyncMock, patch
+    from app import main
+
+    message = '{"id":1,"body":"Buy $XYZ 🚀","created_at":"2023-01-01T12:00:00Z","channel":{"id":7,"name":"Calls"}}'
+    stamped = message[:-1] + ',"stages":{"received":1672574400.5,"written":1672574400.75}}'
+    with patch.object(main.manager, "broadcast", new_callable=AsyncMock) as mock_broadcast, \
+            patch.object(main, "broadcast_messages_by_id", new_callable=AsyncMock) as mock_lookup, \
+            patch.object(main, "record_stage_latencies") as mock_record:
+        await main.notification_handler(None, 0, "new_message", f"[{stamped},2]")
+
+    mock_broadcast.assert_awaited_once_with(message, message_id=1, channel_id=7, received_at=ANY)
+    mock_lookup.assert_awaited_once_with([2], received_at=ANY)
+    stages = mock_record.call_args.args[1]
+    assert stages == {"received": 1672574400.5, "written": 1672574400.75}
+
+@pytest.mark.asyncio
+async def test_notification_handler_sends_reposts_as_compact_frames():
+    """
+    Tests that a repost of another channel's call is broadcast as a repost and kept out of the feed cache.
+    """
+    import json
+    from unittest.mock import AsyncMock, patch
+    from app import main
+
+    message = '{"id":2,"body":"Buy $XYZ","created_at":"2023-01-01T12:00:05Z","channel":{"id":8,"name":"Other"}}'
+    reposted = message[:-1] + ',"duplicate_of":{"id":1,"channel_id":7}}'
+    with patch.object(main.manager, "broadcast_repost", new_callable=AsyncMock) as mock_repost, \
+            patch.object(main.feed_cache, "insert") as mock_insert:
+        await main.notification_handler(None, 0, "new_message", f"[{reposted}]")
+
+    mock_insert.assert_not_called()
+    repost, full = mock_repost.await_args.args
+    assert json.loads(repost) == {"type": "repost", "id": 1, "message_id": 2, "channel": {"id": 8, "name": "Other"}}
+    assert full == message
+    assert mock_repost.await_args.kwargs["original_channel_id"] == 7
+
+@pytest.mark.asyncio
+async def test_change_handler_broadcasts_deltas_and_patches_feed_cache():
+    """
+    Tests that edits and deletions are streamed as delta frames, not replayable
+    messages, and applied to the feed cache.
+    """
+    import json
+    from unittest.mock import AsyncMock, patch
+    from app import main
+
+    update = {"type": "update", "id": 1, "channel_id": 7, "version": 2,
+              "edited_at": "2023-01-01T12:05:00Z", "body": "Sell $XYZ"}
+    delete = {"type": "delete", "id": 2, "channel_id": 7}
+    with patch.object(main.manager, "broadcast", new_callable=AsyncMock) as mock_broadcast, \
+            patch.object(main.feed_cache, "update") as mock_update, \
+            patch.object(main.feed_cache, "remove") as mock_remove:
+        await main.change_handler(None, 0, "message_changes", json.dumps([update, delete]))
+
+    frames = [call.args[0] for call in mock_broadcast.await_args_list]
+    assert [json.loads(frame) for frame in frames] == [update, delete]
+    assert all(call.kwargs == {"channel_id": 7} for call in mock_broadcast.await_args_list)
+    assert mock_update.call_args.args[0] == 1
+    mock_remove.assert_called_once_with(2)
+
+def test_websocket_negotiates_msgpack_subprotocol():
+    """
+    Tests that a client offering msgpack gets binary MessagePack frames.
+    """
+    import msgpack
+    from app import main
+    original_sleep = asyncio.sleep
+    main.asyncio.sleep = lambda t: original_sleep(t / 20)
+
+    try:
+        with client.websocket_connect("/api/feed/stream", subprotocols=["msgpack", "json"]) as websocket:
+            assert websocket.accepted_subprotocol == "msgpack"
+            data = websocket.receive_bytes()
+            assert msgpack.unpackb(data) == {"type": "ping"}
+    finally:
+        main.asyncio.sleep = original_sleep
@@ -1,5 +1,4 @@
 import os
-import time
 import yaml
 from dotenv import load_dotenv
 
@@ -15,30 +14,116 @@ if not API_HASH:
     raise ValueError("Missing required environment variable: API_HASH")
 
 SESSION_STRING = os.getenv("SESSION_STRING")
+
+# Sharding (see `sharding.py`): each collector process is a shard with its
+# own SESSION_STRING, and channels are spread over the live shards.
+SHARD_ID = os.getenv("SHARD_ID", "0")
+SHARD_HEARTBEAT_INTERVAL = float(os.getenv("SHARD_HEARTBEAT_INTERVAL", 10))
+SHARD_TTL = float(os.getenv("SHARD_TTL", 30))
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", 64))
+
+# Stand-in for Telegram that posts synthetic messages (see `fake_telegram.py`),
+# for running shards locally without accounts.
+TELEGRAM_FAKE = os.getenv("TELEGRAM_FAKE", "false").lower() in ("1", "true", "yes")
+FAKE_TELEGRAM_INTERVAL = float(os.getenv("FAKE_TELEGRAM_INTERVAL", 5))
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 CHANNEL_CONFIG_PATH = os.getenv("CHANNEL_CONFIG_PATH", "channels.yml")
 CHANNEL_CONFIG_POLL = int(os.getenv("CHANNEL_CONFIG_POLL", 30))
 
+# Port of the Prometheus metrics endpoint; 0 disables it.
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+
+# Write-behind ingestion: messages are buffered and flushed to Postgres in
+# batches once either bound is reached.
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 200))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", 0.25))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 10000))
+# Without a spool, a batch the database rejects is retried this many times,
+# backing off from INGEST_RETRY_DELAY seconds, before it is dropped.
+INGEST_WRITE_RETRIES = int(os.getenv("INGEST_WRITE_RETRIES", 3))
+INGEST_RETRY_DELAY = float(os.getenv("INGEST_RETRY_DELAY", 0.5))
+
+# Durable spool for live messages (see `spool.py`). Set SPOOL_DIR to an
+# empty value to buffer in memory only.
+# Shards other than the default one keep their own spool under it.
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool" if SHARD_ID == "0" else f"spool/shard-{SHARD_ID}")
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024))
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", 512 * 1024 * 1024))
+SPOOL_FSYNC_INTERVAL = float(os.getenv("SPOOL_FSYNC_INTERVAL", 0.01))
+# Consecutive failed writes of a batch before it is split to find a record
+# the database rejects, which is then moved to the dead-letter file.
+SPOOL_MAX_FAILURES = int(os.getenv("SPOOL_MAX_FAILURES", 5))
+
+# History backfill: channels are caught up from their newest stored message,
+# BACKFILL_CONCURRENCY at a time. Channels with nothing stored yet start from
+# their BACKFILL_INITIAL_LIMIT most recent messages.
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", 4))
+BACKFILL_INITIAL_LIMIT = int(os.getenv("BACKFILL_INITIAL_LIMIT", 200))
+
+# Channel entities (ID, access hash, title) kept in memory; the full set is
+# persisted in the channels table.
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", 1000))
+
+# Near-duplicate detection of calls cross-posted between channels (see
+# `dedupe.py`). A window of 0 turns it off.
+DEDUPE_WINDOW_SECONDS = float(os.getenv("DEDUPE_WINDOW_SECONDS", 300))
+DEDUPE_MAX_DISTANCE = int(os.getenv("DEDUPE_MAX_DISTANCE", 3))
+DEDUPE_MIN_WORDS = int(os.getenv("DEDUPE_MIN_WORDS", 4))
+# How often the originals stored by other shards are added to the index.
+DEDUPE_SYNC_INTERVAL = float(os.getenv("DEDUPE_SYNC_INTERVAL", 5))
+
+# Activity rollups (see `rollups.py`): minute and hour buckets are pruned
+# after these periods, every ROLLUP_PRUNE_INTERVAL seconds.
+ROLLUP_MINUTE_RETENTION_HOURS = int(os.getenv("ROLLUP_MINUTE_RETENTION_HOURS", 48))
+ROLLUP_HOUR_RETENTION_DAYS = int(os.getenv("ROLLUP_HOUR_RETENTION_DAYS", 90))
+ROLLUP_PRUNE_INTERVAL = int(os.getenv("ROLLUP_PRUNE_INTERVAL", 3600))
+# Deletions of messages not stored yet wait this long for the message.
+TOMBSTONE_RETENTION_HOURS = int(os.getenv("TOMBSTONE_RETENTION_HOURS", 168))
+
+# Message media (see `media.py`): metadata is stored at ingest and files are
+# downloaded into MEDIA_DIR, shared with the API, when it first asks for
+# them. Thumbnails are the Telegram size closest to MEDIA_THUMBNAIL_SIZE px.
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+MEDIA_THUMBNAIL_SIZE = int(os.getenv("MEDIA_THUMBNAIL_SIZE", 320))
+
+# Monthly range partitioning of the messages table (see `partitions.py`).
+# Only applies when the table is first created; an existing unpartitioned
+# table is left as is.
+MESSAGES_PARTITIONED = os.getenv("MESSAGES_PARTITIONED", "false").lower() in ("1", "true", "yes")
+MESSAGES_PARTITIONS_AHEAD = int(os.getenv("MESSAGES_PARTITIONS_AHEAD", 2))
+MESSAGES_HOT_PARTITIONS = int(os.getenv("MESSAGES_HOT_PARTITIONS", 2))
+MESSAGES_RETENTION_MONTHS = int(os.getenv("MESSAGES_RETENTION_MONTHS", 0))
+MESSAGES_ARCHIVE_DIR = os.getenv("MESSAGES_ARCHIVE_DIR") or None
+PARTITION_MAINTENANCE_INTERVAL = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL", 3600))
+
 _channels_cache = {
     "data": None,
-    "last_loaded": 0,
+    "mtime": None,
 }
 
 def get_channels():
     """
     Loads the channel list from the configured YAML file.
-    Caches the result for CHANNEL_CONFIG_POLL seconds to avoid frequent file reads.
+    The file is only re-read when its modification time changes; the
+    collector checks for changes every CHANNEL_CONFIG_POLL seconds in the
+    background rather than on every message.
     """
-    now = time.time()
-    if now - _channels_cache["last_loaded"] > CHANNEL_CONFIG_POLL:
+    try:
+        mtime = os.stat(CHANNEL_CONFIG_PATH).st_mtime_ns
+    except OSError as e:
+        print(f"Error loading channel config: {e}. Using cached or empty list.")
+        return _channels_cache["data"] or []
+
+    if mtime != _channels_cache["mtime"]:
         try:
             with open(CHANNEL_CONFIG_PATH, "r") as f:
                 data = yaml.safe_load(f)
                 _channels_cache["data"] = data.get("channels", [])
-                _channels_cache["last_loaded"] = now
-        except (yaml.YAMLError, FileNotFoundError) as e:
+        except (yaml.YAMLError, OSError) as e:
             print(f"Error loading channel config: {e}. Using cached or empty list.")
-            # Reset timer so we don't spam errors, but still use old data if available
-            _channels_cache["last_loaded"] = now
+        # Remember the mtime even on errors so we don't spam them, but still
+        # use old data if available
+        _channels_cache["mtime"] = mtime
 
-    return _channels_cache["data"] or [] 
\ No newline at end of file
+    return _channels_cache["data"] or []
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""
+Near-duplicate detection of calls cross-posted between channels.
+
+Each message body is fingerprinted at ingest with a 64-bit SimHash over
+shingles of its normalized words, and its contract addresses are kept
+alongside. A message is a duplicate of an earlier one from another channel,
+posted within DEDUPE_WINDOW_SECONDS, when their SimHashes differ in at most
+DEDUPE_MAX_DISTANCE bits and they mention the same addresses.
+
+Recent fingerprints are kept in memory and looked up by bands: the 64 bits
+are split into DEDUPE_MAX_DISTANCE + 1 bands, so any two fingerprints within
+the distance share at least one band exactly. Entries are evicted once they
+have been in the index for the window.
+
+Messages are indexed only once their batch is committed, so nothing is
+linked to a row that never made it to the database. Each shard has its own
+index, and it also indexes the originals the other shards stored, read back
+every DEDUPE_SYNC_INTERVAL seconds (`storage.sync_duplicate_index`). Copies
+stored by two shards within one interval of each other are therefore not
+linked to each other.
+"""
+import hashlib
+import re
+import time
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+
+from . import config
+
+_WORD_RE = re.compile(r"[$\w]+")
+_SHINGLE_SIZE = 3
+_BITS = 64
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    simhash: int
+    addresses: frozenset[str]
+
+
+def normalize(text: str) -> list[str]:
+    """Lowercase words of a body, without punctuation, emoji or formatting."""
+    return _WORD_RE.findall(unicodedata.normalize("NFKC", text).lower())
+
+
+def simhash(features: list[str]) -> int:
+    """64-bit SimHash of a list of features, each weighted once per occurrence."""
+    weights = [0] * _BITS
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+        for bit in range(_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def fingerprint(body: str, addresses: frozenset[str] = frozenset()) -> Fingerprint | None:
+    """
+    Fingerprints a message body, or returns None for messages too short to
+    tell apart from unrelated ones ("gm", "LFG 🚀") that mention no address.
+    """
+    words = normalize(body)
+    if len(words) < config.DEDUPE_MIN_WORDS and not addresses:
+        return None
+    if len(words) < _SHINGLE_SIZE:
+        features = words
+    else:
+        features = [" ".join(words[i:i + _SHINGLE_SIZE]) for i in range(len(words) - _SHINGLE_SIZE + 1)]
+    return Fingerprint(simhash(features + sorted(addresses)), addresses)
+
+
+def fingerprint_batch(rows: list[dict], mentions: list[dict]) -> list[Fingerprint | None]:
+    """Fingerprints queued messages, given their extracted mentions (`extract_batch`)."""
+    addresses: dict[int, set[str]] = {}
+    for mention in mentions:
+        if mention["kind"] in ("evm", "solana"):
+            addresses.setdefault(mention["message_id"], set()).add(mention["token"])
+    return [
+        fingerprint(row["body"], frozenset(addresses.get(row["message_id"], ())))
+        for row in rows
+    ]
+
+
+@dataclass
+class _Entry:
+    fingerprint: Fingerprint
+    message_id: int
+    channel_id: int
+    created_at: datetime
+    indexed_at: float
+
+
+class DuplicateIndex:
+    """Recent fingerprints, looked up by SimHash bands and evicted by age."""
+
+    def __init__(
+        self,
+        window: float = config.DEDUPE_WINDOW_SECONDS,
+        max_distance: int = config.DEDUPE_MAX_DISTANCE,
+    ):
+        self.window = window
+        self.max_distance = max_distance
+        self._band_bits = -(-_BITS // (max_distance + 1))
+        self._entries: deque[_Entry] = deque()
+        self._bands: dict[tuple[int, int], set[int]] = {}
+        self._by_id: dict[int, _Entry] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._by_id
+
+    def _band_keys(self, value: int):
+        mask = (1 << self._band_bits) - 1
+        for band in range(0, _BITS, self._band_bits):
+            yield band, value >> band & mask
+
+    def _evict(self, now: float):
+        while self._entries and now - self._entries[0].indexed_at > self.window:
+            entry = self._entries.popleft()
+            del self._by_id[entry.message_id]
+            for key in self._band_keys(entry.fingerprint.simhash):
+                ids = self._bands[key]
+                ids.discard(entry.message_id)
+                if not ids:
+                    del self._bands[key]
+
+    def find(self, fp: Fingerprint, message_id: int, channel_id: int, created_at: datetime) -> _Entry | None:
+        """The earliest indexed message `fp` duplicates, if any."""
+        candidates = set()
+        for key in self._band_keys(fp.simhash):
+            candidates |= self._bands.get(key, set())
+        best = None
+        for candidate_id in candidates:
+            entry = self._by_id[candidate_id]
+            if (
+                candidate_id != message_id
+                and entry.channel_id != channel_id
+                and entry.fingerprint.addresses == fp.addresses
+                and abs((created_at - entry.created_at).total_seconds()) <= self.window
+                and bin(entry.fingerprint.simhash ^ fp.simhash).count("1") <= self.max_distance
+                and (best is None or (entry.created_at, entry.message_id) < (best.created_at, best.message_id))
+            ):
+                best = entry
+        return best
+
+    def add(self, fp: Fingerprint, message_id: int, channel_id: int, created_at: datetime, now: float):
+        if message_id in self._by_id:
+            return
+        entry = _Entry(fp, message_id, channel_id, created_at, now)
+        self._entries.append(entry)
+        self._by_id[message_id] = entry
+        for key in self._band_keys(fp.simhash):
+            self._bands.setdefault(key, set()).add(message_id)
+
+    def link(
+        self, rows: list[dict], fingerprints: list[Fingerprint | None], now: float | None = None
+    ) -> list[tuple[dict, Fingerprint]]:
+        """
+        Marks the duplicates among queued messages, in order: a duplicate
+        gets the `duplicate_of` ID and `original_channel_id` of the first
+        copy, whether indexed or earlier in the batch. Returns the other
+        messages with their fingerprints, to `index` once they are stored.
+        """
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+        batch = DuplicateIndex(self.window, self.max_distance)
+        originals = []
+        for row, fp in zip(rows, fingerprints):
+            # Links from an earlier attempt at writing the batch are redone.
+            row.pop("duplicate_of", None)
+            row.pop("original_channel_id", None)
+            if fp is None:
+                continue
+            key = (fp, row["message_id"], row["channel_id"], row["created_at"])
+            found = [entry for entry in (self.find(*key), batch.find(*key)) if entry is not None]
+            if not found:
+                batch.add(*key, now)
+                originals.append((row, fp))
+                continue
+            original = min(found, key=lambda entry: (entry.created_at, entry.message_id))
+            row["duplicate_of"] = original.message_id
+            row["original_channel_id"] = original.channel_id
+        return originals
+
+    def index(self, originals: list[tuple[dict, Fingerprint]], now: float | None = None):
+        """Indexes stored messages, as returned by `link`, for later copies to be linked to."""
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+        for row, fp in originals:
+            self.add(fp, row["message_id"], row["channel_id"], row["created_at"], now)
@@ -0,0 +1,143 @@
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from telethon import types, utils
+
+from . import config, storage
+
+
+@dataclass
+class CachedChannel:
+    """
+    The parts of a channel entity needed to address it without a resolve RPC.
+
+    Telethon accepts an `InputPeerChannel` (ID + access hash) anywhere it
+    accepts an entity, so this is enough for history requests and the
+    handler's `chats=` filter.
+    """
+
+    id: int
+    title: str
+    access_hash: int | None = None
+    username: str | None = None
+
+    @classmethod
+    def from_entity(cls, entity) -> "CachedChannel":
+        return cls(
+            id=entity.id,
+            title=getattr(entity, "title", None) or str(entity.id),
+            access_hash=getattr(entity, "access_hash", None),
+            username=getattr(entity, "username", None),
+        )
+
+    @classmethod
+    def from_row(cls, row: dict) -> "CachedChannel":
+        return cls(
+            id=row["id"], title=row["name"], access_hash=row["access_hash"], username=row["username"]
+        )
+
+    @property
+    def peer_id(self) -> int:
+        """The marked peer ID, as seen in `event.chat_id`."""
+        if self.access_hash is None:
+            return utils.get_peer_id(types.PeerChat(self.id))
+        return utils.get_peer_id(types.PeerChannel(self.id))
+
+    def input_peer(self):
+        if self.access_hash is None:
+            return types.InputPeerChat(self.id)
+        return types.InputPeerChannel(self.id, self.access_hash)
+
+
+def normalize_username(spec: str) -> str | None:
+    """Returns the username of a `@name` / `t.me/name` spec, if it is one."""
+    spec = spec.strip()
+    for prefix in ("https://", "http://"):
+        spec = spec.removeprefix(prefix)
+    for prefix in ("t.me/", "telegram.me/", "@"):
+        spec = spec.removeprefix(prefix)
+    if not spec or "/" in spec or "+" in spec or " " in spec:
+        return None
+    return spec.lower()
+
+
+class EntityCache:
+    """
+    Bounded in-memory LRU of channel entities, backed by the channels table.
+
+    Lookups check memory first, then the database; only channels seen in
+    neither need a `get_entity` RPC. Cached titles are refreshed lazily from
+    the titles carried by updates rather than by re-resolving.
+    """
+
+    def __init__(self, capacity: int = config.ENTITY_CACHE_SIZE):
+        self.capacity = capacity
+        self._by_id: OrderedDict[int, CachedChannel] = OrderedDict()
+        self._by_username: dict[str, int] = {}
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def _put(self, channel: CachedChannel):
+        self._by_id[channel.id] = channel
+        self._by_id.move_to_end(channel.id)
+        if channel.username:
+            self._by_username[channel.username.lower()] = channel.id
+        while len(self._by_id) > self.capacity:
+            _, evicted = self._by_id.popitem(last=False)
+            if evicted.username:
+                self._by_username.pop(evicted.username.lower(), None)
+
+    def _get(self, channel_id: int) -> CachedChannel | None:
+        channel = self._by_id.get(channel_id)
+        if channel is not None:
+            self._by_id.move_to_end(channel_id)
+        return channel
+
+    async def load(self):
+        """Warms the cache from the channels table."""
+        for row in await storage.load_channel_entities(self.capacity):
+            self._put(CachedChannel.from_row(row))
+        logging.info(f"Loaded {len(self)} cached channel entities.")
+
+    async def lookup(self, spec) -> CachedChannel | None:
+        """
+        Finds a channel by channels.yml entry (ID or username) without an RPC.
+        Titles are not looked up here; they are unique to neither Telegram nor
+        the cache.
+        """
+        spec = str(spec).strip()
+        if spec.lstrip("-").isdigit():
+            channel_id = int(spec)
+            # Accept both raw and marked (-100...) channel IDs.
+            if channel_id < 0:
+                channel_id = utils.resolve_id(channel_id)[0]
+            channel = self._get(channel_id)
+            if channel is None:
+                row = await storage.find_channel_entity(channel_id=channel_id)
+                channel = CachedChannel.from_row(row) if row else None
+        else:
+            username = normalize_username(spec)
+            if username is None:
+                return None
+            channel_id = self._by_username.get(username)
+            channel = self._get(channel_id) if channel_id is not None else None
+            if channel is None:
+                row = await storage.find_channel_entity(username=username)
+                channel = CachedChannel.from_row(row) if row else None
+        if channel is not None:
+            self._put(channel)
+        return channel
+
+    async def remember(self, entity) -> CachedChannel:
+        """Caches and persists a freshly resolved entity."""
+        channel = CachedChannel.from_entity(entity)
+        if channel.username:
+            channel.username = channel.username.lower()
+        self._put(channel)
+        await storage.save_channel_entity(channel.id, channel.title, channel.username, channel.access_hash)
+        return channel
+
+
+entity_cache = EntityCache()
@@ -0,0 +1,102 @@
+"""
+Entity extraction for incoming messages.
+
+Calls are searched by ticker, contract address and DEX link, so these are
+pulled out of each message once at ingest time and stored in the
+`message_mentions` table. All patterns are combined into one precompiled
+regex so a message body is scanned in a single pass.
+"""
+import re
+
+# Hosts whose links point at a token's chart or trading page.
+DEX_HOSTS = (
+    "dexscreener.com",
+    "dextools.io",
+    "birdeye.so",
+    "geckoterminal.com",
+    "pump.fun",
+    "gmgn.ai",
+    "photon-sol.tinyastro.io",
+    "app.uniswap.org",
+    "raydium.io",
+    "jup.ag",
+)
+
+# Only link schemes and hosts are matched case-insensitively: base58 leaves
+# out I, O and l, which a case-insensitive class would let back in.
+_MENTION_RE = re.compile(
+    r"(?P<dex_link>(?i:https?://(?:www\.)?(?:"
+    + "|".join(re.escape(host) for host in DEX_HOSTS)
+    + r"))/[^\s<>()\"']+)"
+    r"|(?P<evm>\b0x[a-fA-F0-9]{40}\b)"
+    r"|(?P<solana>\b[1-9A-HJ-NP-Za-km-z]{32,44}\b)"
+    r"|(?<![\w$])\$(?P<ticker>[A-Za-z][A-Za-z0-9]{1,14})\b"
+)
+_ADDRESS_IN_LINK_RE = re.compile(r"\b(?:0x[a-fA-F0-9]{40}|[1-9A-HJ-NP-Za-km-z]{32,44})\b")
+
+
+def _looks_like_base58_address(token: str) -> bool:
+    # Long plain words also match the base58 alphabet; real addresses mix
+    # digits or letter cases.
+    return not (token.isalpha() and (token.islower() or token.isupper()))
+
+
+def normalize_dex_link(link: str) -> str:
+    """
+    How a DEX link is stored: `host/path`, with the host lowercased and
+    without "www.", and no scheme, query string or fragment. The API
+    normalizes links it is searched by the same way (`crud.normalize_token`).
+    """
+    link = link.split("?", 1)[0].split("#", 1)[0].rstrip("/.,")
+    host, _, path = link.split("://", 1)[-1].partition("/")
+    return f"{host.lower().removeprefix('www.')}/{path}"
+
+
+def extract_mentions(text: str) -> list[tuple[str, str]]:
+    """
+    Returns the distinct `(kind, token)` mentions found in a message body.
+
+    Kinds are "ticker" ($XYZ, stored uppercase with the dollar sign), "evm"
+    (0x addresses, lowercase), "solana" (base58 addresses, case preserved)
+    and "dex_link" (chart/trading URLs without query string). Addresses
+    inside DEX links are reported as addresses too.
+    """
+    if not text:
+        return []
+
+    mentions: dict[tuple[str, str], None] = {}
+    for match in _MENTION_RE.finditer(text):
+        kind = match.lastgroup
+        token = match.group(kind)
+        if kind == "dex_link":
+            link = normalize_dex_link(token)
+            mentions[("dex_link", link)] = None
+            path = link.partition("/")[2]
+            for address in _ADDRESS_IN_LINK_RE.findall(path):
+                if address.lower().startswith("0x"):
+                    mentions[("evm", address.lower())] = None
+                elif _looks_like_base58_address(address):
+                    mentions[("solana", address)] = None
+        elif kind == "evm":
+            mentions[("evm", token.lower())] = None
+        elif kind == "solana":
+            if _looks_like_base58_address(token):
+                mentions[("solana", token)] = None
+        else:
+            mentions[("ticker", "$" + token.upper())] = None
+    return list(mentions)
+
+
+def extract_batch(rows: list[dict]) -> list[dict]:
+    """Extracts mention rows for the `message_mentions` table from queued messages."""
+    return [
+        {
+            "message_id": row["message_id"],
+            "channel_id": row["channel_id"],
+            "kind": kind,
+            "token": token,
+            "created_at": row["created_at"],
+        }
+        for row in rows
+        for kind, token in extract_mentions(row["body"])
+    ]
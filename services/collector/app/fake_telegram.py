@@ -0,0 +1,194 @@
+"""
+A stand-in for Telethon's `TelegramClient`, for running the collector (and
+several shards of it) locally without Telegram accounts (TELEGRAM_FAKE).
+
+Only the parts the collector uses are implemented. Any channels.yml entry
+resolves to a synthetic channel whose ID is derived from the entry, and
+every channel posts a message every FAKE_TELEGRAM_INTERVAL seconds on a
+timeline computed from the clock. Every process therefore sees the same
+channels and the same history, message IDs included, the way shards of a
+real collector see the same Telegram. Live messages go to the handlers
+registered for their chat, and history is served by `iter_messages`.
+Messages are never edited or deleted, so edit and deletion handlers are
+registered but never called.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from telethon import events, utils
+
+from . import config
+from .entity_cache import normalize_username
+
+# Fake channel IDs start here; message IDs are `slot * _SLOT_SIZE + index`,
+# so they grow with time within a channel, as Telegram's do.
+_CHANNEL_ID_BASE = 9_100_000_000
+_SLOTS = 10_000_000
+_SLOT_SIZE = 10 ** 11
+_TICKERS = ("PEPE", "WIF", "BONK", "MOG", "POPCAT", "BRETT", "TOSHI", "GIGA")
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+@dataclass
+class FakeChannel:
+    id: int
+    title: str
+    access_hash: int
+    username: str | None = None
+
+
+@dataclass
+class FakeMessage:
+    id: int
+    text: str
+    date: datetime
+
+
+@dataclass
+class FakeNewMessage:
+    """What the collector reads from a `events.NewMessage.Event`."""
+
+    chat_id: int
+    chat: FakeChannel
+    message: FakeMessage
+
+
+@dataclass
+class _Dialog:
+    title: str
+    entity: FakeChannel
+
+
+class _FakeSession:
+    def save(self) -> str:
+        return "fake"
+
+
+class FakeTelegramClient:
+    def __init__(self, interval: float = config.FAKE_TELEGRAM_INTERVAL):
+        self.interval = interval
+        self.session = _FakeSession()
+        self._channels: dict[int, FakeChannel] = {}
+        self._handlers: list[tuple] = []
+        # Index of the last message posted live, per channel.
+        self._posted: dict[int, int] = {}
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._post_forever())
+        logging.warning("Using the fake Telegram client: messages are synthetic.")
+        return self
+
+    async def disconnect(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # Entities
+
+    def channel(self, spec) -> FakeChannel:
+        """The synthetic channel for a channels.yml entry or channel ID."""
+        if isinstance(spec, int) or str(spec).lstrip("-").isdigit():
+            channel_id = int(spec)
+            if channel_id < 0:
+                channel_id = utils.resolve_id(channel_id)[0]
+            if channel_id in self._channels:
+                return self._channels[channel_id]
+            key = str(channel_id)
+        else:
+            key = normalize_username(str(spec)) or str(spec).strip()
+            channel_id = _CHANNEL_ID_BASE + _hash(key) % _SLOTS
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            channel = self._channels[channel_id] = FakeChannel(
+                id=channel_id,
+                title=f"Fake {key}",
+                access_hash=_hash(f"access:{key}") >> 1,
+                username=None if key.isdigit() else key,
+            )
+        return channel
+
+    async def get_entity(self, spec):
+        return self.channel(spec)
+
+    async def iter_dialogs(self):
+        for channel in list(self._channels.values()):
+            yield _Dialog(title=channel.title, entity=channel)
+
+    # Timeline
+
+    def _phase(self, channel_id: int) -> float:
+        return _hash(f"phase:{channel_id}") % 1000 / 1000 * self.interval
+
+    def _latest_index(self, channel_id: int, now: float) -> int:
+        return int((now - self._phase(channel_id)) // self.interval)
+
+    def _message(self, channel: FakeChannel, index: int) -> FakeMessage:
+        posted_at = index * self.interval + self._phase(channel.id)
+        ticker = _TICKERS[index % len(_TICKERS)]
+        return FakeMessage(
+            id=(channel.id - _CHANNEL_ID_BASE) * _SLOT_SIZE + index,
+            text=f"{channel.title} call #{index}: ${ticker} entry {index % 97 / 1000:.3f}",
+            date=datetime.fromtimestamp(posted_at, timezone.utc),
+        )
+
+    async def iter_messages(self, peer, limit=None, min_id=0, reverse=False):
+        """Channel history, newest first (oldest first with `reverse`)."""
+        channel = self.channel(getattr(peer, "channel_id", peer))
+        latest = self._latest_index(channel.id, time.time())
+        first = max(0, min_id - (channel.id - _CHANNEL_ID_BASE) * _SLOT_SIZE + 1) if min_id else 0
+        if limit is not None:
+            first = max(first, latest - limit + 1)
+        indexes = range(first, latest + 1) if reverse else range(latest, first - 1, -1)
+        for index in indexes:
+            yield self._message(channel, index)
+
+    # Live updates
+
+    def add_event_handler(self, callback, event=None):
+        self._handlers.append((callback, event))
+
+    def remove_event_handler(self, callback, event=None):
+        self._handlers = [(cb, ev) for cb, ev in self._handlers if cb != callback]
+
+    def _new_message_handlers(self) -> list[tuple]:
+        # `events.MessageEdited` is a subclass of `events.NewMessage`.
+        return [(callback, event) for callback, event in self._handlers if type(event) is events.NewMessage]
+
+    def _subscribed(self) -> set[int]:
+        """Marked IDs of the chats the new message handlers listen to."""
+        chats = set()
+        for _, event in self._new_message_handlers():
+            chats.update(getattr(event, "chats", None) or ())
+        return chats
+
+    async def post_due(self, now: float | None = None):
+        """Delivers the messages posted since the last call to their handlers."""
+        now = time.time() if now is None else now
+        for peer_id in self._subscribed():
+            channel = self.channel(peer_id)
+            latest = self._latest_index(channel.id, now)
+            first = self._posted.get(channel.id, latest) + 1
+            for index in range(first, latest + 1):
+                update = FakeNewMessage(chat_id=peer_id, chat=channel, message=self._message(channel, index))
+                for callback, event in self._new_message_handlers():
+                    if peer_id in (getattr(event, "chats", None) or ()):
+                        await callback(update)
+                self._posted[channel.id] = index
+            self._posted.setdefault(channel.id, latest)
+
+    async def _post_forever(self):
+        while True:
+            await asyncio.sleep(min(self.interval / 2, 0.25))
+            try:
+                await self.post_due()
+            except Exception:
+                logging.exception("Fake Telegram client failed to post messages.")
@@ -1,11 +1,25 @@
 import asyncio
-from app import storage, telegram_client
+
+from prometheus_client import start_http_server
+
+from app import config, storage, telegram_client
 
 async def main():
+    if config.METRICS_PORT:
+        start_http_server(config.METRICS_PORT)
+        print(f"Serving metrics on port {config.METRICS_PORT}.")
+
     print("Setting up database...")
     await storage.setup_database()
     print("Database setup complete.")
 
+    await storage.start_ingestion()
+    # Keep references so the tasks aren't garbage collected.
+    if config.MESSAGES_PARTITIONED:
+        maintenance = asyncio.create_task(storage.partition_maintenance_loop())
+    rollup_pruning = asyncio.create_task(storage.rollup_maintenance_loop())
+    if storage.duplicate_index is not None:
+        duplicate_sync = asyncio.create_task(storage.duplicate_sync_loop())
     await telegram_client.start_client()
     
     # Keep the main coroutine alive to allow the client to run in the background.
@@ -14,6 +28,13 @@ async def main():
         await asyncio.Event().wait()
     except (KeyboardInterrupt, asyncio.CancelledError):
         print("Collector shutting down.")
+    finally:
+        try:
+            # Lets the other shards take this shard's channels over at once.
+            await storage.remove_shard(config.SHARD_ID)
+        except Exception as e:
+            print(f"Failed to unregister shard {config.SHARD_ID}: {e}")
+        await storage.stop_ingestion()
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
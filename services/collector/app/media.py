@@ -0,0 +1,132 @@
+"""
+Message media: photos, videos and documents attached to messages.
+
+Only metadata is captured at ingest (`describe`), into `message_media`. The
+files themselves are downloaded the first time the API asks for them: it
+sends the message ID on the 'media_requests' channel, the shard tracking the
+channel downloads the file and its thumbnail, and records their digests.
+
+Files are kept in a content-addressed store under MEDIA_DIR, named by their
+SHA-256, so a chart reposted by ten channels is stored once. Reposts that
+forward the same Telegram file are not even downloaded again.
+"""
+import hashlib
+import os
+import tempfile
+
+from telethon import types
+
+from . import config
+
+_SIZED_THUMBS = (types.PhotoSize, types.PhotoSizeProgressive)
+_CHUNK_SIZE = 1024 * 1024
+
+
+def _largest(sizes) -> types.PhotoSize | types.PhotoSizeProgressive | None:
+    sized = [size for size in sizes or () if isinstance(size, _SIZED_THUMBS)]
+    return max(sized, key=lambda size: size.w * size.h, default=None)
+
+
+def _thumbnail(sizes, full=None) -> str | None:
+    """
+    The type of the thumbnail size closest to MEDIA_THUMBNAIL_SIZE pixels on
+    its longer side, other than the full-size image itself.
+    """
+    sized = [size for size in sizes or () if isinstance(size, _SIZED_THUMBS) and size is not full]
+    if not sized:
+        return None
+    return min(sized, key=lambda size: abs(max(size.w, size.h) - config.MEDIA_THUMBNAIL_SIZE)).type
+
+
+def _document_kind(document: types.Document) -> str:
+    for attribute in document.attributes:
+        if isinstance(attribute, types.DocumentAttributeSticker):
+            return "sticker"
+        if isinstance(attribute, types.DocumentAttributeAnimated):
+            return "animation"
+    for attribute in document.attributes:
+        if isinstance(attribute, types.DocumentAttributeVideo):
+            return "video"
+        if isinstance(attribute, types.DocumentAttributeAudio):
+            return "voice" if attribute.voice else "audio"
+    if document.mime_type.startswith("image/"):
+        return "image"
+    return "document"
+
+
+def describe(message) -> dict | None:
+    """
+    Metadata of a Telethon message's photo or document, or None when it has
+    neither (web page previews, polls and the like are not media here).
+
+    The file reference is kept hex encoded so the row stays JSON for the spool.
+    """
+    media = getattr(message, "media", None)
+    if isinstance(media, types.MessageMediaPhoto) and isinstance(media.photo, types.Photo):
+        photo = media.photo
+        full = _largest(photo.sizes)
+        return {
+            "kind": "photo",
+            "mime_type": "image/jpeg",
+            "size": max(full.sizes) if isinstance(full, types.PhotoSizeProgressive) else getattr(full, "size", None),
+            "width": getattr(full, "w", None),
+            "height": getattr(full, "h", None),
+            "file_id": photo.id,
+            "file_reference": photo.file_reference.hex(),
+            "thumbnail": _thumbnail(photo.sizes, full),
+        }
+    if isinstance(media, types.MessageMediaDocument) and isinstance(media.document, types.Document):
+        document = media.document
+        width = height = None
+        for attribute in document.attributes:
+            if isinstance(attribute, (types.DocumentAttributeImageSize, types.DocumentAttributeVideo)):
+                width, height = attribute.w, attribute.h
+        return {
+            "kind": _document_kind(document),
+            "mime_type": document.mime_type,
+            "size": document.size,
+            "width": width,
+            "height": height,
+            "file_id": document.id,
+            "file_reference": document.file_reference.hex(),
+            "thumbnail": _thumbnail(document.thumbs),
+        }
+    return None
+
+
+def store_path(digest: str, root: str | None = None) -> str:
+    """Where the file with a given SHA-256 lives: `<root>/ab/cd/abcd...`."""
+    return os.path.join(root or config.MEDIA_DIR, digest[:2], digest[2:4], digest)
+
+
+def temp_path(root: str | None = None) -> str:
+    """
+    A new empty file in the store's directory to download into, so that
+    `store` can rename it into place.
+    """
+    root = root or config.MEDIA_DIR
+    os.makedirs(root, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=root, prefix=".tmp-")
+    os.close(fd)
+    return path
+
+
+def store(path: str, root: str | None = None) -> str:
+    """
+    Moves a downloaded file (see `temp_path`) into the content-addressed
+    store and returns its SHA-256. The file is hashed in chunks, so videos
+    are never held in memory, and renamed, so readers never see a partial
+    file. When the store already has it, the download is just deleted.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_CHUNK_SIZE):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+    stored = store_path(digest, root)
+    if os.path.exists(stored):
+        os.unlink(path)
+        return digest
+    os.makedirs(os.path.dirname(stored), exist_ok=True)
+    os.replace(path, stored)
+    return digest
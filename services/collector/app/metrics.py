@@ -0,0 +1,67 @@
+"""
+Prometheus metrics exported by the collector, served on METRICS_PORT.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+INGEST_BATCH_SIZE = Histogram(
+    "collector_ingest_batch_size",
+    "Number of messages written per ingestion flush.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 200, 500, 1000),
+)
+
+INGEST_FLUSH_SECONDS = Histogram(
+    "collector_ingest_flush_seconds",
+    "Time spent writing one ingestion batch to Postgres.",
+)
+
+INGEST_QUEUE_DEPTH = Gauge(
+    "collector_ingest_queue_depth",
+    "Messages waiting in the ingestion queue.",
+)
+
+INGEST_DROPPED_ROWS = Counter(
+    "collector_ingest_dropped_rows_total",
+    "Messages dropped by the in-memory ingestion queue after their batch failed every retry.",
+)
+
+SPOOL_BYTES = Gauge(
+    "collector_spool_bytes",
+    "Size of the spool's segment files on disk.",
+)
+
+SPOOL_LAG_BYTES = Gauge(
+    "collector_spool_lag_bytes",
+    "Spooled bytes not yet written to Postgres.",
+)
+
+SPOOL_LAG_SECONDS = Gauge(
+    "collector_spool_lag_seconds",
+    "Age of the oldest spooled message not yet written to Postgres.",
+)
+
+SPOOL_WRITE_FAILURES = Counter(
+    "collector_spool_write_failures_total",
+    "Failed attempts to write a spooled batch to Postgres.",
+)
+
+SPOOL_DEAD_LETTERS = Counter(
+    "collector_spool_dead_letters_total",
+    "Spooled records the database rejected, moved to the dead-letter file.",
+)
+
+TELEGRAM_TO_HANDLER_SECONDS = Histogram(
+    "collector_telegram_to_handler_seconds",
+    "Time from a message's Telegram date to the handler receiving it.",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+
+HANDLER_TO_COMMIT_SECONDS = Histogram(
+    "collector_handler_to_commit_seconds",
+    "Time from the handler receiving a message to its write being committed.",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 60),
+)
+
+DUPLICATES_DETECTED = Counter(
+    "collector_duplicates_detected_total",
+    "Messages found to repost a call from another channel.",
+)
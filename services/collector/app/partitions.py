@@ -0,0 +1,174 @@
+"""
+Monthly range partitions of the messages table (MESSAGES_PARTITIONED).
+
+Each month of `created_at` lives in its own partition, named
+`messages_yYYYYmMM`. Partitions are created ahead of time by the maintenance
+job, and on demand for older months reached by history backfill. The newest
+MESSAGES_HOT_PARTITIONS months keep a btree on `(created_at DESC, id DESC)`
+for the feed; older months only get a much smaller BRIN index on
+`created_at`. Months past MESSAGES_RETENTION_MONTHS are detached and, when
+MESSAGES_ARCHIVE_DIR is set, exported to gzipped CSV and dropped.
+"""
+import asyncio
+import gzip
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime, timezone
+
+import sqlalchemy
+
+from . import config
+
+PARENT = "messages"
+_NAME_RE = re.compile(rf"^{PARENT}_y(\d{{4}})m(\d{{2}})$")
+
+
+def month_of(value: datetime) -> date:
+    """Returns the first day of the (UTC) month `value` falls in."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_start(month: date) -> datetime:
+    return datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT}_y{month.year:04d}m{month.month:02d}"
+
+
+def parse_partition_name(name: str) -> date | None:
+    match = _NAME_RE.match(name)
+    return date(int(match[1]), int(match[2]), 1) if match else None
+
+
+@dataclass
+class MaintenancePlan:
+    """What the maintenance job has to do, given the existing partitions."""
+
+    create: list[date] = field(default_factory=list)
+    cool: list[date] = field(default_factory=list)
+    expire: list[date] = field(default_factory=list)
+
+
+def plan_maintenance(
+    existing: set[date],
+    now: datetime,
+    ahead: int = config.MESSAGES_PARTITIONS_AHEAD,
+    hot: int = config.MESSAGES_HOT_PARTITIONS,
+    retention: int = config.MESSAGES_RETENTION_MONTHS,
+) -> MaintenancePlan:
+    """
+    Plans partition maintenance.
+
+    Args:
+        existing: Months that already have a partition.
+        now: The current time.
+        ahead: Future months to create partitions for.
+        hot: Newest months that keep the feed's btree index.
+        retention: Months of messages to keep; 0 keeps everything.
+    """
+    current = month_of(now)
+    plan = MaintenancePlan()
+    plan.create = [
+        month for month in (add_months(current, offset) for offset in range(ahead + 1))
+        if month not in existing
+    ]
+    oldest_hot = add_months(current, 1 - hot)
+    oldest_kept = add_months(current, 1 - retention) if retention > 0 else None
+    for month in sorted(existing):
+        if oldest_kept is not None and month < oldest_kept:
+            plan.expire.append(month)
+        elif month < oldest_hot:
+            plan.cool.append(month)
+    return plan
+
+
+def is_hot(month: date, now: datetime, hot: int = config.MESSAGES_HOT_PARTITIONS) -> bool:
+    return month >= add_months(month_of(now), 1 - hot)
+
+
+async def is_partitioned(conn) -> bool:
+    """Whether the messages table exists as a partitioned table."""
+    result = await conn.execute(sqlalchemy.text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:parent)"
+    ), {"parent": PARENT})
+    return result.first() is not None
+
+
+async def existing_partitions(conn) -> set[date]:
+    result = await conn.execute(sqlalchemy.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:parent)"
+    ), {"parent": PARENT})
+    months = (parse_partition_name(name) for name in result.scalars())
+    return {month for month in months if month is not None}
+
+
+async def create_partition(conn, month: date, hot: bool):
+    """Creates a month's partition with the index matching its age."""
+    name = partition_name(month)
+    await conn.execute(sqlalchemy.text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT} "
+        f"FOR VALUES FROM ('{month_start(month).isoformat()}') "
+        f"TO ('{month_start(add_months(month, 1)).isoformat()}')"
+    ))
+    if hot:
+        await conn.execute(sqlalchemy.text(
+            f"CREATE INDEX IF NOT EXISTS {name}_created_at_id_desc ON {name} (created_at DESC, id DESC)"
+        ))
+    else:
+        await cool_partition(conn, month)
+    logging.info(f"Created partition {name}.")
+
+
+async def cool_partition(conn, month: date):
+    """Swaps a partition's feed btree for a BRIN index once it is no longer hot."""
+    name = partition_name(month)
+    await conn.execute(sqlalchemy.text(
+        f"CREATE INDEX IF NOT EXISTS {name}_created_at_brin ON {name} USING brin (created_at)"
+    ))
+    await conn.execute(sqlalchemy.text(f"DROP INDEX IF EXISTS {name}_created_at_id_desc"))
+
+
+async def export_partition(conn, month: date, archive_dir: str) -> str:
+    """Writes a partition to `<archive_dir>/<partition>.csv.gz` and returns the path."""
+    name = partition_name(month)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    os.makedirs(archive_dir, exist_ok=True)
+    raw = await conn.get_raw_connection()
+    with gzip.open(path + ".tmp", "wb") as archive:
+        async def write(chunk):
+            await asyncio.to_thread(archive.write, chunk)
+
+        await raw.driver_connection.copy_from_table(name, output=write, format="csv", header=True)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+async def expire_partition(conn, month: date, archive_dir: str | None = config.MESSAGES_ARCHIVE_DIR):
+    """
+    Removes a month from the messages table. Without an archive directory the
+    partition is only detached and stays in the database as a plain table;
+    otherwise it is exported and dropped.
+    """
+    name = partition_name(month)
+    if archive_dir:
+        path = await export_partition(conn, month, archive_dir)
+        logging.info(f"Archived partition {name} to {path}.")
+    await conn.execute(sqlalchemy.text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+    if archive_dir:
+        await conn.execute(sqlalchemy.text(f"DROP TABLE {name}"))
+    # Mentions of expired messages would point at nothing.
+    await conn.execute(sqlalchemy.text(
+        "DELETE FROM message_mentions WHERE created_at < :end"
+    ), {"end": month_start(add_months(month, 1))})
+    logging.info(f"Expired partition {name}.")
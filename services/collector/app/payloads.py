@@ -0,0 +1,151 @@
+"""
+Pre-serialized NOTIFY payloads for the API service.
+
+The collector renders each message once, in exactly the JSON shape the API
+returns for `schemas.Message`, so the API can forward notifications to its
+WebSocket clients without querying the database again.
+"""
+import json
+from datetime import datetime
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more (default build).
+NOTIFY_PAYLOAD_LIMIT = 7999
+
+
+def _format_datetime(value: datetime) -> str:
+    # Match pydantic's JSON encoding, which renders UTC offsets as "Z".
+    text = value.isoformat()
+    if text.endswith("+00:00"):
+        text = text[:-6] + "Z"
+    return text
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def render_head(row: dict) -> str:
+    """
+    Renders a queued message row up to its channel, i.e. `schemas.Message`
+    JSON without `"channel":{...}}`. It is stored with the message so the
+    API can serve the feed without serializing it again; the channel is left
+    out because its name can change.
+    """
+    message = {
+        "id": row["message_id"],
+        "body": row["body"],
+        "created_at": _format_datetime(row["created_at"]),
+    }
+    if row.get("edited_at") is not None:
+        message["edited_at"] = _format_datetime(row["edited_at"])
+    if row.get("media"):
+        message["media"] = render_media(row["media"])
+    return _dumps(message)[:-1] + ',"channel":'
+
+
+def render_media(media: dict) -> dict:
+    """
+    The `schemas.MessageMedia` of a message's media metadata. Clients fetch
+    the file itself from the API's /api/media/{message id}.
+    """
+    return {
+        "kind": media["kind"],
+        "mime_type": media.get("mime_type"),
+        "size": media.get("size"),
+        "width": media.get("width"),
+        "height": media.get("height"),
+        "thumbnail": media.get("thumbnail") is not None,
+    }
+
+
+def render_message(row: dict, written_at: float | None = None) -> str:
+    """
+    Renders a queued message row as compact JSON matching `schemas.Message`.
+
+    Live messages (those with a `received_at`) also carry their stage
+    timestamps under "stages", for the API's latency metrics, and reposts of
+    another channel's call carry the original under "duplicate_of"; the API
+    strips both before forwarding the message.
+    """
+    head = row.get("rendered") or render_head(row)
+    parts = [head, _dumps({"id": row["channel_id"], "name": row["channel_name"]})]
+    if written_at is not None and row.get("received_at") is not None:
+        parts.append(',"stages":' + _dumps({"received": row["received_at"], "written": written_at}))
+    if row.get("duplicate_of") is not None:
+        original = {"id": row["duplicate_of"], "channel_id": row["original_channel_id"]}
+        parts.append(',"duplicate_of":' + _dumps(original))
+    parts.append("}")
+    return "".join(parts)
+
+
+def build_notify_payloads(
+    rows: list[dict], limit: int = NOTIFY_PAYLOAD_LIMIT, written_at: float | None = None
+) -> list[str]:
+    """
+    Packs rendered messages into as few NOTIFY payloads as possible.
+
+    Each payload is a JSON array. Elements are either a full message object
+    or, when a single message would not fit in a payload on its own, just its
+    integer ID so the API can fall back to loading it from the database.
+    """
+    return _pack(
+        [(render_message(row, written_at), str(row["message_id"])) for row in rows], limit
+    )
+
+
+def render_change(change: dict) -> str:
+    """
+    Renders an applied edit or deletion as the compact delta the API streams
+    to clients: `{"type":"update","id":..,"channel_id":..,"version":..,
+    "edited_at":..,"body":..}` or `{"type":"delete","id":..,"channel_id":..}`.
+    """
+    if change["op"] == "delete":
+        return _dumps({"type": "delete", "id": change["message_id"], "channel_id": change["channel_id"]})
+    return _dumps({
+        "type": "update",
+        "id": change["message_id"],
+        "channel_id": change["channel_id"],
+        "version": change["version"],
+        "edited_at": _format_datetime(change["edited_at"]),
+        "body": change["body"],
+    })
+
+
+def build_change_payloads(changes: list[dict], limit: int = NOTIFY_PAYLOAD_LIMIT) -> list[str]:
+    """
+    Packs rendered deltas into 'message_changes' NOTIFY payloads, like
+    `build_notify_payloads`. An update too large for a payload is sent
+    without its body, for the API to load.
+    """
+    items = []
+    for change in changes:
+        fallback = {"type": "update", "id": change["message_id"], "channel_id": change["channel_id"]}
+        items.append((render_change(change), _dumps(fallback)))
+    return _pack(items, limit)
+
+
+def _pack(items: list[tuple[str, str]], limit: int) -> list[str]:
+    """
+    Packs `(item, fallback)` JSON pairs into arrays of at most `limit`
+    bytes, using the fallback for items too large for a payload of their own.
+    """
+    payloads = []
+    packed: list[str] = []
+    size = 2  # the enclosing brackets
+
+    for item, fallback in items:
+        item_size = len(item.encode("utf-8"))
+        if item_size + 2 > limit:
+            item = fallback
+            item_size = len(item.encode("utf-8"))
+
+        # One extra byte for the separating comma
+        if packed and size + item_size + 1 > limit:
+            payloads.append("[" + ",".join(packed) + "]")
+            packed, size = [], 2
+        packed.append(item)
+        size += item_size + (1 if len(packed) > 1 else 0)
+
+    if packed:
+        payloads.append("[" + ",".join(packed) + "]")
+    return payloads
@@ -0,0 +1,162 @@
+"""
+Activity rollups: messages per channel and mentions per token, counted in
+1 minute, 1 hour and 1 day buckets.
+
+The counts are kept up to date by `storage.write_batch`, in the same
+transaction as the messages they count, and deleted messages are taken off
+them again by `storage.apply_changes`, so the API's `/api/stats` endpoints
+read a bounded number of buckets however much history there is. Minute and
+hour buckets are pruned after ROLLUP_MINUTE_RETENTION_HOURS and
+ROLLUP_HOUR_RETENTION_DAYS; day buckets are kept.
+
+Ranges whose messages were written without rollups (or backfilled from an
+older database) are recounted from `messages` and `message_mentions` with:
+
+    python -m app.rollups rebuild --since 2024-01-01 [--until 2024-02-01]
+"""
+import argparse
+import asyncio
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+import sqlalchemy
+
+from . import config
+
+# Bucket sizes, with the Postgres `date_trunc` unit for each.
+GRANULARITIES = {"1m": "minute", "1h": "hour", "1d": "day"}
+
+
+def bucket_start(value: datetime, granularity: str) -> datetime:
+    """Start of the UTC bucket holding `value`."""
+    value = value.astimezone(timezone.utc)
+    if granularity == "1m":
+        return value.replace(second=0, microsecond=0)
+    if granularity == "1h":
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def retention(granularity: str) -> timedelta | None:
+    """How long buckets of a granularity are kept; None for forever."""
+    if granularity == "1m":
+        return timedelta(hours=config.ROLLUP_MINUTE_RETENTION_HOURS)
+    if granularity == "1h":
+        return timedelta(days=config.ROLLUP_HOUR_RETENTION_DAYS)
+    return None
+
+
+def count_messages(rows: list[dict]) -> list[dict]:
+    """`channel_activity` increments for newly stored (or deleted) message rows."""
+    counts = Counter(
+        (granularity, bucket_start(row["created_at"], granularity), row["channel_id"])
+        for row in rows
+        for granularity in GRANULARITIES
+    )
+    return [
+        {"granularity": granularity, "bucket": bucket, "channel_id": channel_id, "messages": count}
+        for (granularity, bucket, channel_id), count in sorted(counts.items())
+    ]
+
+
+def count_mentions(mentions: list[dict]) -> list[dict]:
+    """`token_activity` increments for newly stored (or removed) mention rows."""
+    counts = Counter(
+        (
+            granularity,
+            bucket_start(mention["created_at"], granularity),
+            mention["kind"],
+            mention["token"],
+            mention["channel_id"],
+        )
+        for mention in mentions
+        for granularity in GRANULARITIES
+    )
+    return [
+        {
+            "granularity": granularity,
+            "bucket": bucket,
+            "kind": kind,
+            "token": token,
+            "channel_id": channel_id,
+            "mentions": count,
+        }
+        for (granularity, bucket, kind, token, channel_id), count in sorted(counts.items())
+    ]
+
+
+async def prune(conn, now: datetime):
+    """Deletes minute and hour buckets past their retention."""
+    for granularity in GRANULARITIES:
+        kept = retention(granularity)
+        if kept is None:
+            continue
+        for table in ("channel_activity", "token_activity"):
+            await conn.execute(
+                sqlalchemy.text(f"DELETE FROM {table} WHERE granularity = :granularity AND bucket < :cutoff"),
+                {"granularity": granularity, "cutoff": now - kept},
+            )
+
+
+async def rebuild(conn, since: datetime, until: datetime, now: datetime):
+    """
+    Recounts every bucket between two UTC day boundaries from the stored
+    messages and mentions, replacing what the rollups held for them.
+
+    The rollup tables are locked against the collector's writes meanwhile,
+    so live increments are neither lost nor counted twice; ingestion waits
+    in the spool.
+    """
+    await conn.execute(sqlalchemy.text(
+        "LOCK TABLE channel_activity, token_activity IN SHARE ROW EXCLUSIVE MODE"
+    ))
+    for granularity, unit in GRANULARITIES.items():
+        start = since
+        kept = retention(granularity)
+        if kept is not None:
+            start = max(since, bucket_start(now - kept, granularity))
+        if start >= until:
+            continue
+        bucket = f"date_trunc('{unit}', created_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"
+        params = {"granularity": granularity, "since": start, "until": until}
+        for table in ("channel_activity", "token_activity"):
+            await conn.execute(sqlalchemy.text(
+                f"DELETE FROM {table} "
+                "WHERE granularity = :granularity AND bucket >= :since AND bucket < :until"
+            ), params)
+        await conn.execute(sqlalchemy.text(
+            "INSERT INTO channel_activity (granularity, bucket, channel_id, messages) "
+            f"SELECT :granularity, {bucket}, channel_id, count(*) FROM messages "
+            "WHERE created_at >= :since AND created_at < :until AND deleted_at IS NULL GROUP BY 2, 3"
+        ), params)
+        await conn.execute(sqlalchemy.text(
+            "INSERT INTO token_activity (granularity, bucket, kind, token, channel_id, mentions) "
+            f"SELECT :granularity, {bucket}, kind, token, channel_id, count(*) FROM message_mentions "
+            "WHERE created_at >= :since AND created_at < :until GROUP BY 2, 3, 4, 5"
+        ), params)
+
+
+def _day(value: str) -> datetime:
+    day = date.fromisoformat(value)
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+
+async def _main(args):
+    from . import storage
+
+    now = datetime.now(timezone.utc)
+    until = _day(args.until) if args.until else bucket_start(now, "1d") + timedelta(days=1)
+    await storage.setup_database()
+    async with storage.engine.begin() as conn:
+        await rebuild(conn, _day(args.since), until, now)
+    await storage.engine.dispose()
+    print(f"Rebuilt rollups from {args.since} to {until.date()}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintains the activity rollups.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = commands.add_parser("rebuild", help="recount a range of days from stored messages")
+    rebuild_parser.add_argument("--since", required=True, help="first day to recount (YYYY-MM-DD, UTC)")
+    rebuild_parser.add_argument("--until", help="day after the last to recount (default: through today)")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,63 @@
+"""
+Spreading channels across collector shards.
+
+Each shard is a collector process with its own Telegram session, named by
+SHARD_ID. Shards announce themselves in the `collector_shards` table with a
+heartbeat; a shard whose heartbeat is older than SHARD_TTL is considered
+gone. The channels from channels.yml are assigned to the live shards with a
+consistent hash ring, so a shard joining or leaving only moves the channels
+it gains or loses.
+
+Handoffs are safe to overlap: messages are inserted idempotently, so a
+channel briefly tracked by two shards is still stored once, and a shard
+taking a channel over backfills it from the newest stored message.
+
+Database maintenance (partitions, rollup pruning) is not sharded: the live
+shard with the lowest ID runs it, under an advisory lock in case two shards
+briefly disagree on which one that is.
+"""
+import bisect
+import hashlib
+from collections.abc import Iterable
+
+from . import config
+from .entity_cache import normalize_username
+
+
+def _point(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def channel_key(spec) -> str:
+    """
+    The ring key of a channels.yml entry. Usernames are normalized, so `@Name`
+    and `t.me/name` land on the same shard.
+    """
+    spec = str(spec).strip()
+    return normalize_username(spec) or spec
+
+
+class HashRing:
+    """Consistent hash ring with `vnodes` points per shard."""
+
+    def __init__(self, shards: Iterable[str] = (), vnodes: int = config.SHARD_VNODES):
+        self.vnodes = vnodes
+        self.shards = frozenset(shards)
+        self._points: list[int] = []
+        self._owners: list[str] = []
+        for point, shard in sorted(
+            (_point(f"{shard}#{replica}"), shard) for shard in self.shards for replica in range(vnodes)
+        ):
+            self._points.append(point)
+            self._owners.append(shard)
+
+    def owner(self, key: str) -> str | None:
+        """The shard owning a key, or None on an empty ring."""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _point(key)) % len(self._points)
+        return self._owners[index]
+
+    def assign(self, specs: Iterable, shard: str) -> list:
+        """The entries of `specs` owned by `shard`, in order."""
+        return [spec for spec in specs if self.owner(channel_key(spec)) == shard]
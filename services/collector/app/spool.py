@@ -0,0 +1,339 @@
+"""
+Durable on-disk spool between the Telegram handlers and Postgres.
+
+Incoming messages are appended as JSON lines to segment files in SPOOL_DIR
+and acknowledged once fsynced; appends arriving within SPOOL_FSYNC_INTERVAL
+of each other share one fsync. A drainer task replays the spool into
+Postgres in batches and records how far it got in a checkpoint file, so
+messages survive both database outages and collector restarts. Segments are
+deleted once drained; when the undrained spool reaches SPOOL_MAX_BYTES,
+appends wait for the drainer.
+
+A batch that fails SPOOL_MAX_FAILURES times in a row is split to find a
+record the database rejects (an encoding or constraint error), which is
+moved to a dead-letter file next to the segments so it cannot hold up the
+messages behind it.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from . import config, metrics
+
+_SEGMENT_PREFIX = "spool-"
+_SEGMENT_SUFFIX = ".log"
+_CHECKPOINT = "checkpoint"
+_DEAD_LETTERS = "dead-letters.log"
+
+
+def _segment_name(seq: int) -> str:
+    return f"{_SEGMENT_PREFIX}{seq:012d}{_SEGMENT_SUFFIX}"
+
+
+# Timestamps of spooled rows: new messages have `created_at`, edits also
+# `edited_at` and deletions only `deleted_at` (see `storage.write_batch`).
+_DATETIME_KEYS = ("created_at", "edited_at", "deleted_at")
+
+
+def encode_row(row: dict) -> bytes:
+    record = dict(row)
+    for key in _DATETIME_KEYS:
+        if record.get(key) is not None:
+            record[key] = record[key].isoformat()
+    record.setdefault("received_at", time.time())
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+
+
+def decode_row(line: bytes) -> tuple[dict, float]:
+    record = json.loads(line)
+    for key in _DATETIME_KEYS:
+        if record.get(key) is not None:
+            record[key] = datetime.fromisoformat(record[key])
+    return record, record["received_at"]
+
+
+class Spool:
+    """
+    Append-only, fsync-batched message log with a checkpointed drainer.
+
+    Positions are `(segment, offset)` pairs. Everything before the checkpoint
+    has been written to Postgres; everything up to `_synced` is on disk.
+    """
+
+    def __init__(
+        self,
+        directory: str = config.SPOOL_DIR,
+        writer=None,
+        segment_bytes: int = config.SPOOL_SEGMENT_BYTES,
+        max_bytes: int = config.SPOOL_MAX_BYTES,
+        fsync_interval: float = config.SPOOL_FSYNC_INTERVAL,
+        max_batch_size: int = config.INGEST_BATCH_SIZE,
+        max_failures: int = config.SPOOL_MAX_FAILURES,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.max_batch_size = max_batch_size
+        self.max_failures = max_failures
+        self._writer = writer
+        self._file = None
+        self._seq = 0
+        self._sizes: dict[int, int] = {}
+        self._checkpoint = (0, 0)
+        self._synced = (0, 0)
+        self._written = 0
+        self._synced_written = 0
+        self._syncing: asyncio.Task | None = None
+        self._drainer: asyncio.Task | None = None
+        self._data = asyncio.Event()
+        self._space = asyncio.Event()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def open(self):
+        """Opens the spool, recovering its segments and checkpoint from disk."""
+        os.makedirs(self.directory, exist_ok=True)
+        segments = sorted(
+            int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX)
+        )
+        try:
+            with open(self._path(_CHECKPOINT)) as f:
+                seq, offset = json.load(f)
+        except (OSError, ValueError):
+            seq, offset = (segments[0] if segments else 0), 0
+        self._checkpoint = (seq, offset)
+
+        for segment in segments:
+            if segment < seq:
+                os.unlink(self._path(_segment_name(segment)))
+            else:
+                self._sizes[segment] = os.path.getsize(self._path(_segment_name(segment)))
+        if self._sizes:
+            self._seq = max(self._sizes)
+            self._truncate_torn_tail(self._seq)
+        else:
+            self._seq = seq
+        self._file = open(self._path(_segment_name(self._seq)), "ab")
+        self._sizes.setdefault(self._seq, 0)
+        self._synced = (self._seq, self._sizes[self._seq])
+        self._update_gauges()
+        if self._lag_bytes():
+            logging.info(f"Spool holds {self._lag_bytes()} bytes not yet written to the database.")
+
+    def _truncate_torn_tail(self, seq: int):
+        """Drops a partial record left by a crash in the middle of an append."""
+        path = self._path(_segment_name(seq))
+        with open(path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                logging.warning(f"Discarding {len(data) - end} bytes of a torn spool record.")
+                f.truncate(end)
+        self._sizes[seq] = end
+
+    def _disk_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def _lag_bytes(self) -> int:
+        return self._disk_bytes() - self._checkpoint[1]
+
+    def _update_gauges(self):
+        metrics.SPOOL_BYTES.set(self._disk_bytes())
+        metrics.SPOOL_LAG_BYTES.set(self._lag_bytes())
+
+    async def append(self, row: dict):
+        """Appends a message and returns once it is on disk."""
+        while self._lag_bytes() >= self.max_bytes:
+            logging.warning("Spool is full; waiting for the database to catch up.")
+            self._space.clear()
+            await self._space.wait()
+        record = encode_row(row)
+        self._file.write(record)
+        self._sizes[self._seq] += len(record)
+        self._written += len(record)
+        await self._sync(self._written)
+
+    async def _sync(self, target: int):
+        # Group commit: appends made while an fsync is pending share it.
+        while self._synced_written < target:
+            if self._syncing is None:
+                self._syncing = asyncio.create_task(self._fsync())
+            await asyncio.shield(self._syncing)
+
+    async def _fsync(self):
+        try:
+            await asyncio.sleep(self.fsync_interval)
+            file, written = self._file, self._written
+            position = (self._seq, self._sizes[self._seq])
+            file.flush()
+            if position[1] >= self.segment_bytes:
+                # Later appends go to a new segment; the old one is closed
+                # once its last bytes are synced.
+                self._seq += 1
+                self._sizes[self._seq] = 0
+                self._file = open(self._path(_segment_name(self._seq)), "ab")
+                position = (self._seq, 0)
+            await asyncio.to_thread(os.fsync, file.fileno())
+            if file is not self._file:
+                file.close()
+            self._synced_written = written
+            self._synced = position
+            self._update_gauges()
+            self._data.set()
+        finally:
+            self._syncing = None
+
+    def _read(
+        self, position: tuple[int, int], limit: int
+    ) -> tuple[list[tuple[dict, float, tuple[int, int]]], tuple[int, int]]:
+        """
+        Reads up to `limit` synced records after `position`, each with its
+        received time and the position just past it.
+        """
+        records = []
+        seq, offset = position
+        while len(records) < limit:
+            end = self._synced[1] if seq == self._synced[0] else self._sizes.get(seq, 0)
+            if offset < end:
+                with open(self._path(_segment_name(seq)), "rb") as f:
+                    f.seek(offset)
+                    while len(records) < limit and offset < end:
+                        line = f.readline()
+                        offset += len(line)
+                        records.append((*decode_row(line), (seq, offset)))
+            if offset >= end and seq < self._synced[0]:
+                seq, offset = seq + 1, 0
+            else:
+                break
+        return records, (seq, offset)
+
+    def _commit(self, position: tuple[int, int]):
+        """Checkpoints the drained position and deletes drained segments."""
+        path = self._path(_CHECKPOINT)
+        with open(path + ".tmp", "w") as f:
+            json.dump(list(position), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        for seq in [seq for seq in self._sizes if seq < position[0]]:
+            os.unlink(self._path(_segment_name(seq)))
+            del self._sizes[seq]
+        self._checkpoint = position
+        self._update_gauges()
+        self._space.set()
+
+    def _dead_letter(self, row: dict):
+        """Appends a record the database rejects to the dead-letter file."""
+        with open(self._path(_DEAD_LETTERS), "ab") as f:
+            f.write(encode_row(row))
+            f.flush()
+            os.fsync(f.fileno())
+        metrics.SPOOL_DEAD_LETTERS.inc()
+
+    async def _write(self, rows: list[dict]) -> bool:
+        try:
+            await self._writer(rows)
+        except Exception:
+            metrics.SPOOL_WRITE_FAILURES.inc()
+            return False
+        return True
+
+    async def _isolate(self, records: list[tuple[dict, float, tuple[int, int]]]) -> bool:
+        """
+        Bisects a batch that keeps failing down to the first record that
+        fails on its own, checkpointing the halves before it as they are
+        written. That record is dead-lettered and skipped only once the
+        database has shown it is up, by accepting part of the batch or the
+        record after it; otherwise the database is taken to be down and the
+        batch is left to the backoff. Returns whether the checkpoint moved.
+        """
+        rows = [row for row, _, _ in records]
+        # rows[lo:hi] is known to fail.
+        lo, hi = 0, len(rows)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if await self._write(rows[lo:mid]):
+                await asyncio.to_thread(self._commit, records[mid - 1][2])
+                lo = mid
+            else:
+                hi = mid
+        skip_to = lo + 1
+        if lo == 0:
+            if len(rows) < 2 or not await self._write(rows[1:2]):
+                return False
+            skip_to = 2
+        logging.error(
+            f"The database rejects spooled message {rows[lo].get('message_id')} of channel "
+            f"{rows[lo].get('channel_id')}; moving it to {self._path(_DEAD_LETTERS)}."
+        )
+        await asyncio.to_thread(self._dead_letter, rows[lo])
+        await asyncio.to_thread(self._commit, records[skip_to - 1][2])
+        return True
+
+    async def _drain(self):
+        failures = 0
+        while True:
+            self._data.clear()
+            records, position = await asyncio.to_thread(self._read, self._checkpoint, self.max_batch_size)
+            if not records:
+                if position != self._checkpoint:
+                    await asyncio.to_thread(self._commit, position)
+                    continue
+                metrics.SPOOL_LAG_SECONDS.set(0)
+                await self._data.wait()
+                continue
+
+            metrics.SPOOL_LAG_SECONDS.set(time.time() - records[0][1])
+            metrics.INGEST_BATCH_SIZE.observe(len(records))
+            started = time.perf_counter()
+            written = False
+            try:
+                await self._writer([row for row, _, _ in records])
+                written = True
+            except Exception:
+                # Nothing is lost: the batch stays in the spool and is retried.
+                failures += 1
+                metrics.SPOOL_WRITE_FAILURES.inc()
+                logging.exception(f"Failed to write {len(records)} spooled messages.")
+            finally:
+                metrics.INGEST_FLUSH_SECONDS.observe(time.perf_counter() - started)
+            if written:
+                failures = 0
+                await asyncio.to_thread(self._commit, position)
+                continue
+            if failures >= self.max_failures and await self._isolate(records):
+                failures = 0
+                continue
+            delay = min(2 ** (failures - 1), 30)
+            logging.warning(f"Retrying the spooled batch in {delay}s.")
+            await asyncio.sleep(delay)
+
+    def start(self):
+        if self._file is None:
+            self.open()
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.create_task(self._drain())
+
+    async def stop(self):
+        """Stops the drainer; whatever it has not written stays in the spool for the next start."""
+        if self._drainer is not None:
+            self._drainer.cancel()
+            try:
+                await self._drainer
+            except asyncio.CancelledError:
+                pass
+            self._drainer = None
+        if self._syncing is not None:
+            await asyncio.shield(self._syncing)
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
@@ -1,9 +1,22 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
 import sqlalchemy
-from sqlalchemy import Table, Column, BigInteger, String, MetaData, DateTime, func
+from sqlalchemy import (
+    Table, Column, BigInteger, Integer, LargeBinary, String, MetaData, DateTime, Index, func, literal_column,
+)
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
-from . import config
+from . import config, metrics, partitions, rollups
+from .dedupe import DuplicateIndex, fingerprint_batch
+from .extract import extract_batch
+from .payloads import build_change_payloads, build_notify_payloads, render_head
+from .spool import Spool
 
 # Ensure the DATABASE_URL uses the asyncpg driver
 db_url = config.DATABASE_URL
@@ -21,22 +34,844 @@ channels = Table(
     metadata,
     Column("id", BigInteger, primary_key=True),
     Column("name", String, nullable=False),
+    # Persisted Telethon entity data (see `entity_cache.py`), so known
+    # channels can be addressed without a resolve RPC after a restart.
+    Column("username", String, nullable=True),
+    Column("access_hash", BigInteger, nullable=True),
+    # Access hashes are per account: the shard whose session resolved it
+    # (NULL for the default shard, from before sharding).
+    Column("access_shard", String, nullable=True),
+    Index("idx_channels_username", "username"),
 )
 
+# Live collector shards (see `sharding.py`), each refreshing its heartbeat.
+collector_shards = Table(
+    "collector_shards",
+    metadata,
+    Column("shard_id", String, primary_key=True),
+    Column("host", String, nullable=False),
+    Column("pid", Integer, nullable=False),
+    Column("started_at", DateTime(timezone=True), nullable=False),
+    Column("heartbeat_at", DateTime(timezone=True), nullable=False),
+    Column("channels", Integer, nullable=False, server_default="0"),
+)
+
+# With MESSAGES_PARTITIONED, messages is range partitioned by month on
+# created_at, which then has to be part of the primary key.
 messages = Table(
     "messages",
     metadata,
     Column("id", BigInteger, primary_key=True),
     Column("channel_id", BigInteger, sqlalchemy.ForeignKey("channels.id"), nullable=False),
     Column("body", String, nullable=False),
-    Column("created_at", DateTime(timezone=True), nullable=False),
+    Column("created_at", DateTime(timezone=True), nullable=False, primary_key=config.MESSAGES_PARTITIONED),
     Column("ingested_at", DateTime(timezone=True), server_default=func.now()),
+    # The message's API JSON up to its channel (see `payloads.render_head`).
+    Column("rendered", String, nullable=True),
+    # The earlier message from another channel this one reposts (see
+    # `dedupe.py`); the API leaves duplicates out of the feed.
+    Column("duplicate_of", BigInteger, nullable=True),
+    # Edits and deletions on Telegram (see `apply_changes`): the time of the
+    # last edit, the number of versions of the body, and the soft delete
+    # time; the API leaves deleted messages out.
+    Column("edited_at", DateTime(timezone=True), nullable=True),
+    Column("version", Integer, nullable=False, server_default="1"),
+    Column("deleted_at", DateTime(timezone=True), nullable=True),
+    # Full text search over message bodies, used by the API's /api/search.
+    Index(
+        "idx_messages_body_fts",
+        func.to_tsvector(literal_column("'simple'"), literal_column("body")),
+        postgresql_using="gin",
+    ),
+    **({"postgresql_partition_by": "RANGE (created_at)"} if config.MESSAGES_PARTITIONED else {}),
+)
+
+# Keep in sync with the indexes declared on the API's `models.Message`.
+# Partitions get their own feed index, depending on their age.
+if not config.MESSAGES_PARTITIONED:
+    Index("idx_messages_created_at_id_desc", messages.c.created_at.desc(), messages.c.id.desc())
+Index("idx_messages_channel_id_id", messages.c.channel_id, messages.c.id)
+
+# Deletions of messages not stored yet, e.g. still waiting in the spool
+# (see `apply_changes`); `write_messages` stores them already deleted.
+message_tombstones = Table(
+    "message_tombstones",
+    metadata,
+    Column("message_id", BigInteger, primary_key=True),
+    Column("channel_id", BigInteger, nullable=False),
+    Column("deleted_at", DateTime(timezone=True), nullable=False),
+)
+
+# Tickers, contract addresses and DEX links found in each message (see
+# `extract.py`). `created_at` is the message's, copied so lookups by token
+# are answered from the index alone.
+message_mentions = Table(
+    "message_mentions",
+    metadata,
+    Column("message_id", BigInteger, primary_key=True),
+    Column("kind", String, primary_key=True),
+    Column("token", String, primary_key=True),
+    Column("channel_id", BigInteger, nullable=False),
+    Column("created_at", DateTime(timezone=True), nullable=False),
+    Index("idx_message_mentions_token_created_at", "token", sqlalchemy.text("created_at DESC")),
+    Index("idx_message_mentions_created_at", "created_at"),
+)
+
+# Photos, videos and documents attached to messages (see `media.py`). The
+# digests are those of the files in the media store, set once downloaded.
+message_media = Table(
+    "message_media",
+    metadata,
+    Column("message_id", BigInteger, primary_key=True),
+    Column("channel_id", BigInteger, nullable=False),
+    Column("kind", String, nullable=False),
+    Column("mime_type", String, nullable=True),
+    Column("size", BigInteger, nullable=True),
+    Column("width", Integer, nullable=True),
+    Column("height", Integer, nullable=True),
+    # The Telegram photo or document, shared by forwarded copies.
+    Column("file_id", BigInteger, nullable=False),
+    Column("file_reference", LargeBinary, nullable=True),
+    # Telegram size type of the thumbnail to download, if there is one.
+    Column("thumbnail", String, nullable=True),
+    Column("sha256", String, nullable=True),
+    Column("thumbnail_sha256", String, nullable=True),
+    Index("idx_message_media_file_id", "file_id"),
+)
+
+# Messages per channel and mentions per token in 1m/1h/1d buckets (see
+# `rollups.py`), kept in step with the inserts by `write_batch`.
+channel_activity = Table(
+    "channel_activity",
+    metadata,
+    Column("granularity", String, primary_key=True),
+    Column("bucket", DateTime(timezone=True), primary_key=True),
+    Column("channel_id", BigInteger, primary_key=True),
+    Column("messages", Integer, nullable=False),
+    Index("idx_channel_activity_channel_bucket", "granularity", "channel_id", "bucket"),
+)
+
+token_activity = Table(
+    "token_activity",
+    metadata,
+    Column("granularity", String, primary_key=True),
+    Column("bucket", DateTime(timezone=True), primary_key=True),
+    Column("kind", String, primary_key=True),
+    Column("token", String, primary_key=True),
+    Column("channel_id", BigInteger, primary_key=True),
+    Column("mentions", Integer, nullable=False),
+    Index("idx_token_activity_token_bucket", "granularity", "token", "bucket"),
 )
 
 async def setup_database():
-    """Creates tables in the database if they don't exist."""
+    """Creates tables, columns and indexes in the database if they don't exist."""
     async with engine.begin() as conn:
         await conn.run_sync(metadata.create_all)
+        # create_all only builds columns and indexes together with new
+        # tables, so add any introduced since the table was first created.
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
+    if config.MESSAGES_PARTITIONED:
+        await maintain_partitions()
+
+
+def _add_missing_columns(conn):
+    inspector = sqlalchemy.inspect(conn)
+    for table in metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_ddl = sqlalchemy.schema.CreateColumn(column).compile(dialect=conn.dialect)
+                conn.execute(sqlalchemy.text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+
+
+def _create_missing_indexes(conn):
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+# Months known to have a partition, so writes only check for new ones.
+# None until the first maintenance run finds the table partitioned.
+_partition_months: set | None = None
+
+
+# Keys of the Postgres advisory locks that keep shards from running the
+# same maintenance at once.
+_PARTITION_LOCK = 7_310_001
+_ROLLUP_LOCK = 7_310_002
+
+
+@asynccontextmanager
+async def _maintenance_lock(key: int, wait: bool):
+    """
+    Holds a session advisory lock for a maintenance run, on a connection of
+    its own. Yields whether it was taken: always with `wait`, otherwise only
+    if no other shard holds it.
+    """
+    async with engine.connect() as conn:
+        lock = func.pg_advisory_lock(key) if wait else func.pg_try_advisory_lock(key)
+        locked = (await conn.execute(sqlalchemy.select(lock))).scalar() is not False
+        await conn.commit()
+        try:
+            yield locked
+        finally:
+            if locked:
+                await conn.execute(sqlalchemy.select(func.pg_advisory_unlock(key)))
+                await conn.commit()
+
+
+async def _runs_maintenance() -> bool:
+    """
+    Whether this shard runs the periodic maintenance: only the live shard
+    with the lowest ID does, so N shards don't repeat the same DDL.
+    """
+    return min(await live_shards(config.SHARD_TTL) | {config.SHARD_ID}) == config.SHARD_ID
+
+
+async def maintain_partitions(now: datetime | None = None, wait: bool = True):
+    """
+    Creates upcoming partitions, moves aged ones to BRIN indexes and expires
+    those past the retention period (see `partitions.py`). Shards take turns:
+    without `wait`, the run is skipped while another shard's is going on.
+    """
+    async with _maintenance_lock(_PARTITION_LOCK, wait) as locked:
+        if locked:
+            await _maintain_partitions(now)
+
+
+async def _maintain_partitions(now: datetime | None):
+    global _partition_months
+    now = now or datetime.now(timezone.utc)
+    async with engine.begin() as conn:
+        if not await partitions.is_partitioned(conn):
+            logging.warning(
+                "MESSAGES_PARTITIONED is set but the messages table is not partitioned; "
+                "it has to be migrated by hand first."
+            )
+            return
+        existing = await partitions.existing_partitions(conn)
+    plan = partitions.plan_maintenance(existing, now)
+    # One transaction per step, so locks on the parent table are brief and a
+    # failed export leaves the other steps done.
+    for month in plan.create:
+        async with engine.begin() as conn:
+            await partitions.create_partition(conn, month, hot=True)
+    for month in plan.cool:
+        async with engine.begin() as conn:
+            await partitions.cool_partition(conn, month)
+    for month in plan.expire:
+        async with engine.begin() as conn:
+            await partitions.expire_partition(conn, month)
+    _partition_months = (existing | set(plan.create)) - set(plan.expire)
+
+
+async def partition_maintenance_loop():
+    """
+    Runs `maintain_partitions` every PARTITION_MAINTENANCE_INTERVAL seconds,
+    on the shard that runs maintenance.
+    """
+    while True:
+        await asyncio.sleep(config.PARTITION_MAINTENANCE_INTERVAL)
+        try:
+            if await _runs_maintenance():
+                await maintain_partitions(wait=False)
+        except Exception:
+            logging.exception("Partition maintenance failed.")
+
+
+async def _ensure_partitions(rows: list[dict]) -> list[dict]:
+    """
+    Creates partitions for months not seen before, e.g. reached by backfill.
+    Returns the rows to write: those older than the retention period would
+    only be expired again, so they are dropped.
+    """
+    if _partition_months is None:
+        return rows
+    now = datetime.now(timezone.utc)
+    if config.MESSAGES_RETENTION_MONTHS > 0:
+        oldest_kept = partitions.add_months(partitions.month_of(now), 1 - config.MESSAGES_RETENTION_MONTHS)
+        rows = [row for row in rows if partitions.month_of(row["created_at"]) >= oldest_kept]
+    for month in {partitions.month_of(row["created_at"]) for row in rows} - _partition_months:
+        async with engine.begin() as conn:
+            await partitions.create_partition(conn, month, hot=partitions.is_hot(month, now))
+        _partition_months.add(month)
+    return rows
+
+
+def _dedupe_channels(rows: list[dict]) -> list[dict]:
+    """Returns one channel row per channel id, keeping the latest name seen."""
+    names = {}
+    for row in rows:
+        names[row["channel_id"]] = row["channel_name"]
+    return [{"id": channel_id, "name": name} for channel_id, name in names.items()]
+
+
+duplicate_index = DuplicateIndex() if config.DEDUPE_WINDOW_SECONDS > 0 else None
+# Seconds a duplicate index sync looks back before the previous one.
+_DEDUPE_SYNC_SLACK = 60
+
+
+async def sync_duplicate_index(since: datetime | None = None) -> datetime:
+    """
+    Indexes the originals stored within the dedupe window, by any shard,
+    that the duplicate index doesn't know yet; only those ingested after
+    `since` when given. Returns the time to pass as `since` next time.
+    """
+    started = datetime.now(timezone.utc)
+    query = sqlalchemy.select(
+        messages.c.id, messages.c.channel_id, messages.c.body, messages.c.created_at
+    ).where(
+        messages.c.created_at >= started - timedelta(seconds=config.DEDUPE_WINDOW_SECONDS),
+        messages.c.duplicate_of.is_(None),
+        messages.c.deleted_at.is_(None),
+    )
+    if since is not None:
+        # `ingested_at` is its transaction's start, which may precede the commit.
+        query = query.where(messages.c.ingested_at >= since - timedelta(seconds=_DEDUPE_SYNC_SLACK))
+    async with AsyncSession() as session:
+        result = await session.execute(query)
+    rows = [
+        {"message_id": row.id, "channel_id": row.channel_id, "body": row.body, "created_at": row.created_at}
+        for row in result
+        if row.id not in duplicate_index
+    ]
+    if rows:
+        _, fingerprints = await asyncio.to_thread(_analyze_batch, rows)
+        duplicate_index.index([(row, fp) for row, fp in zip(rows, fingerprints) if fp is not None])
+    return started
+
+
+async def duplicate_sync_loop():
+    """
+    Keeps the duplicate index in step with the other shards' writes, from
+    startup on, every DEDUPE_SYNC_INTERVAL seconds.
+    """
+    since = None
+    while True:
+        try:
+            since = await sync_duplicate_index(since)
+        except Exception:
+            logging.exception("Failed to sync the duplicate index.")
+        await asyncio.sleep(config.DEDUPE_SYNC_INTERVAL)
+
+
+def _analyze_batch(rows: list[dict]) -> tuple[list[dict], list]:
+    """Extracts the mentions of queued messages and fingerprints them."""
+    mentions = extract_batch(rows)
+    if duplicate_index is None:
+        return mentions, []
+    return mentions, fingerprint_batch(rows, mentions)
+
+
+async def write_batch(rows: list[dict]) -> list[int]:
+    """
+    Writes a batch of queued rows: new messages (see `write_messages`), then
+    the edits and deletions queued after them (rows with an "op", see
+    `apply_changes`), so a change never overtakes the message it changes.
+
+    Returns:
+        The IDs of the messages that were actually inserted.
+    """
+    changes = [row for row in rows if row.get("op")]
+    inserted_ids = await write_messages([row for row in rows if not row.get("op")])
+    if changes:
+        await apply_changes(changes)
+    return inserted_ids
+
+
+async def write_messages(rows: list[dict]) -> list[int]:
+    """
+    Writes a batch of messages to the database in a single transaction.
+
+    Channels referenced by the batch are upserted once each, messages are
+    inserted with a single multi-row INSERT (duplicates are ignored), the
+    mentions extracted from the new messages are recorded, and the
+    newly inserted messages are published on the 'new_message' channel as
+    pre-serialized JSON (see `payloads.build_notify_payloads`), normally in a
+    single NOTIFY. Messages reposting a recent call from another channel are
+    linked to its first copy (see `dedupe.py`). The metadata of their media
+    goes to `message_media`; files are downloaded on demand. Messages
+    deleted before they got here (see `message_tombstones`) are stored
+    deleted, without mentions, counts or notification.
+
+    Args:
+        rows: Message dicts with the same keys as `save_message` arguments.
+
+    Returns:
+        The IDs of the messages that were actually inserted.
+    """
+    if not rows:
+        return []
+    # The same message can be queued twice (e.g. history overlapping live updates)
+    rows = list({row["message_id"]: row for row in rows}.values())
+    rows = await _ensure_partitions(rows)
+    if not rows:
+        return []
+    # Regex extraction and fingerprinting are CPU-bound; keep them off the event loop.
+    mentions, fingerprints = await asyncio.to_thread(_analyze_batch, rows)
+    originals = duplicate_index.link(rows, fingerprints) if duplicate_index is not None else []
+    for row in rows:
+        row["rendered"] = render_head(row)
+
+    async with AsyncSession() as session:
+        async with session.begin():
+            # Channel titles are refreshed lazily: a renamed channel gets its
+            # new name with its next message.
+            stmt = postgresql.insert(channels).values(_dedupe_channels(rows))
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[channels.c.id],
+                set_={"name": stmt.excluded.name},
+                where=channels.c.name != stmt.excluded.name,
+            )
+            await session.execute(stmt)
+
+            stmt = (
+                sqlalchemy.delete(message_tombstones)
+                .where(
+                    sqlalchemy.tuple_(message_tombstones.c.message_id, message_tombstones.c.channel_id).in_(
+                        [(row["message_id"], row["channel_id"]) for row in rows]
+                    )
+                )
+                .returning(message_tombstones.c.message_id, message_tombstones.c.deleted_at)
+            )
+            deleted_at = dict((await session.execute(stmt)).all())
+
+            stmt = postgresql.insert(messages).values([
+                {
+                    "id": row["message_id"],
+                    "channel_id": row["channel_id"],
+                    "body": row["body"],
+                    "created_at": row["created_at"],
+                    "rendered": row["rendered"],
+                    "duplicate_of": row.get("duplicate_of"),
+                    "deleted_at": deleted_at.get(row["message_id"]),
+                }
+                for row in rows
+            ]).on_conflict_do_nothing().returning(messages.c.id)
+            inserted_ids = (await session.execute(stmt)).scalars().all()
+            inserted = set(inserted_ids)
+            # Inserted and not deleted on Telegram meanwhile.
+            live = inserted - deleted_at.keys()
+
+            new_mentions = [mention for mention in mentions if mention["message_id"] in live]
+            if new_mentions:
+                stmt = postgresql.insert(message_mentions).values(
+                    new_mentions
+                ).on_conflict_do_nothing()
+                await session.execute(stmt)
+
+            new_media = [
+                _media_row(row) for row in rows if row.get("media") and row["message_id"] in inserted
+            ]
+            if new_media:
+                await session.execute(
+                    postgresql.insert(message_media).values(new_media).on_conflict_do_nothing()
+                )
+
+            # Only newly inserted rows are counted, so replays don't double count.
+            await _increment(
+                channel_activity,
+                rollups.count_messages([row for row in rows if row["message_id"] in live]),
+                "messages",
+                session,
+            )
+            await _increment(token_activity, rollups.count_mentions(new_mentions), "mentions", session)
+
+            # Notify the API service with the messages themselves, so it does
+            # not have to query them back.
+            for payload in build_notify_payloads(
+                [row for row in rows if row["message_id"] in live], written_at=time.time()
+            ):
+                await session.execute(
+                    sqlalchemy.select(sqlalchemy.func.pg_notify("new_message", payload))
+                )
+    committed_at = time.time()
+    for row in rows:
+        if row.get("received_at") is not None and row["message_id"] in inserted:
+            metrics.HANDLER_TO_COMMIT_SECONDS.observe(committed_at - row["received_at"])
+    if duplicate_index is not None:
+        # Only now that they are stored can later reposts point at them.
+        duplicate_index.index(originals)
+        metrics.DUPLICATES_DETECTED.inc(
+            sum(1 for row in rows if row.get("duplicate_of") is not None and row["message_id"] in inserted)
+        )
+    return inserted_ids
+
+
+def _media_row(row: dict) -> dict:
+    media = dict(row["media"])
+    if media.get("file_reference") is not None:
+        media["file_reference"] = bytes.fromhex(media["file_reference"])
+    return {"message_id": row["message_id"], "channel_id": row["channel_id"], **media}
+
+
+async def apply_changes(changes: list[dict]):
+    """
+    Applies queued edits and deletions in one transaction, in order, and
+    publishes the ones that changed a message on the 'message_changes'
+    channel as compact deltas (see `payloads.build_change_payloads`).
+
+    An edit replaces the body and its stored head, records `edited_at` and
+    bumps `version`; mentions it adds are recorded and counted. Edits that
+    leave the body as it is (Telegram also sends them for button or media
+    changes) and edits older than the stored version are skipped, so
+    replays are harmless. A deletion sets `deleted_at` and drops the
+    message's mentions, taking it and them off the rollups, so trending
+    tokens and stats leave deleted calls out like the feed does. Deleting a
+    message that isn't stored yet leaves a tombstone for `write_messages`;
+    edits to messages that aren't stored are ignored.
+    """
+    applied = []
+    async with AsyncSession() as session:
+        async with session.begin():
+            for change in changes:
+                if change["op"] == "delete":
+                    stmt = (
+                        sqlalchemy.update(messages)
+                        .where(
+                            messages.c.id == change["message_id"],
+                            messages.c.channel_id == change["channel_id"],
+                            messages.c.deleted_at.is_(None),
+                        )
+                        .values(deleted_at=change["deleted_at"])
+                        .returning(messages.c.channel_id, messages.c.created_at)
+                    )
+                    deleted = (await session.execute(stmt)).mappings().first()
+                    if deleted is None:
+                        await _record_tombstone(change, session)
+                        continue
+                    applied.append(change)
+                    stmt = (
+                        sqlalchemy.delete(message_mentions)
+                        .where(
+                            message_mentions.c.message_id == change["message_id"],
+                            message_mentions.c.channel_id == change["channel_id"],
+                        )
+                        .returning(
+                            message_mentions.c.kind,
+                            message_mentions.c.token,
+                            message_mentions.c.channel_id,
+                            message_mentions.c.created_at,
+                        )
+                    )
+                    removed = [dict(row) for row in (await session.execute(stmt)).mappings().all()]
+                    await _decrement(channel_activity, rollups.count_messages([dict(deleted)]), "messages", session)
+                    await _decrement(token_activity, rollups.count_mentions(removed), "mentions", session)
+                    continue
+
+                stmt = (
+                    sqlalchemy.update(messages)
+                    .where(
+                        messages.c.id == change["message_id"],
+                        messages.c.channel_id == change["channel_id"],
+                        # Equal to the stored value; lets Postgres prune partitions.
+                        messages.c.created_at == change["created_at"],
+                        messages.c.deleted_at.is_(None),
+                        messages.c.body != change["body"],
+                        sqlalchemy.or_(
+                            messages.c.edited_at.is_(None), messages.c.edited_at < change["edited_at"]
+                        ),
+                    )
+                    .values(
+                        body=change["body"],
+                        rendered=render_head(change),
+                        edited_at=change["edited_at"],
+                        version=messages.c.version + 1,
+                    )
+                    .returning(messages.c.version)
+                )
+                version = (await session.execute(stmt)).scalar()
+                if version is None:
+                    continue
+                applied.append({**change, "version": version})
+
+                mentions = extract_batch([change])
+                if mentions:
+                    stmt = postgresql.insert(message_mentions).values(mentions).on_conflict_do_nothing().returning(
+                        message_mentions.c.kind, message_mentions.c.token
+                    )
+                    added = {tuple(row) for row in (await session.execute(stmt)).all()}
+                    new_mentions = [m for m in mentions if (m["kind"], m["token"]) in added]
+                    await _increment(token_activity, rollups.count_mentions(new_mentions), "mentions", session)
+
+            for payload in build_change_payloads(applied):
+                await session.execute(
+                    sqlalchemy.select(sqlalchemy.func.pg_notify("message_changes", payload))
+                )
+    if applied:
+        logging.info(f"Applied {len(applied)} message edits and deletions.")
+
+
+async def _record_tombstone(change: dict, session):
+    """Records the deletion of a message that isn't stored, unless it is stored and already deleted."""
+    stored = await session.execute(
+        sqlalchemy.select(messages.c.id).where(
+            messages.c.id == change["message_id"],
+            messages.c.channel_id == change["channel_id"],
+        )
+    )
+    if stored.first() is not None:
+        return
+    await session.execute(
+        postgresql.insert(message_tombstones).values(
+            message_id=change["message_id"],
+            channel_id=change["channel_id"],
+            deleted_at=change["deleted_at"],
+        ).on_conflict_do_nothing()
+    )
+
+
+async def _increment(table: Table, counts: list[dict], column: str, session):
+    """Adds rollup counts to their buckets, creating the buckets as needed."""
+    if not counts:
+        return
+    stmt = postgresql.insert(table).values(counts)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(table.primary_key.columns),
+        set_={column: table.c[column] + stmt.excluded[column]},
+    )
+    await session.execute(stmt)
+
+
+async def _decrement(table: Table, counts: list[dict], column: str, session):
+    """
+    Takes rollup counts off their buckets, dropping buckets left empty.
+    Buckets already pruned are left alone.
+    """
+    keys = [key.name for key in table.primary_key.columns]
+    for count in counts:
+        bucket = [table.c[key] == count[key] for key in keys]
+        await session.execute(
+            sqlalchemy.update(table).where(*bucket).values({column: table.c[column] - count[column]})
+        )
+        await session.execute(sqlalchemy.delete(table).where(*bucket, table.c[column] <= 0))
+
+
+async def rollup_maintenance_loop():
+    """
+    Prunes expired rollup buckets and message tombstones every
+    ROLLUP_PRUNE_INTERVAL seconds, on the shard that runs maintenance.
+    """
+    while True:
+        try:
+            if await _runs_maintenance():
+                async with _maintenance_lock(_ROLLUP_LOCK, wait=False) as locked:
+                    if locked:
+                        now = datetime.now(timezone.utc)
+                        async with engine.begin() as conn:
+                            await rollups.prune(conn, now)
+                            # Left by deletions of messages that never arrived.
+                            await conn.execute(sqlalchemy.delete(message_tombstones).where(
+                                message_tombstones.c.deleted_at
+                                < now - timedelta(hours=config.TOMBSTONE_RETENTION_HOURS)
+                            ))
+        except Exception:
+            logging.exception("Rollup pruning failed.")
+        await asyncio.sleep(config.ROLLUP_PRUNE_INTERVAL)
+
+
+def _usable_by_shard():
+    """Rows whose access hash was issued to this shard's session."""
+    return sqlalchemy.and_(
+        channels.c.access_hash.is_not(None),
+        func.coalesce(channels.c.access_shard, "0") == config.SHARD_ID,
+    )
+
+
+async def load_channel_entities(limit: int) -> list[dict]:
+    """Returns up to `limit` channels with entity data usable by this shard."""
+    async with AsyncSession() as session:
+        result = await session.execute(
+            sqlalchemy.select(channels).where(_usable_by_shard()).limit(limit)
+        )
+        return [dict(row) for row in result.mappings()]
+
+
+async def find_channel_entity(channel_id: int | None = None, username: str | None = None) -> dict | None:
+    """Looks up a channel's persisted entity data, usable by this shard, by ID or username."""
+    query = sqlalchemy.select(channels).where(_usable_by_shard())
+    if channel_id is not None:
+        query = query.where(channels.c.id == channel_id)
+    else:
+        query = query.where(channels.c.username == username)
+    async with AsyncSession() as session:
+        row = (await session.execute(query.limit(1))).mappings().first()
+        return dict(row) if row else None
+
+
+async def save_channel_entity(channel_id: int, name: str, username: str | None, access_hash: int | None):
+    """Persists a resolved channel's entity data."""
+    values = {
+        "name": name,
+        "username": username,
+        "access_hash": access_hash,
+        "access_shard": config.SHARD_ID,
+    }
+    stmt = postgresql.insert(channels).values(id=channel_id, **values)
+    stmt = stmt.on_conflict_do_update(index_elements=[channels.c.id], set_=values)
+    async with AsyncSession() as session:
+        async with session.begin():
+            await session.execute(stmt)
+
+
+async def save_messages(rows: list[dict]):
+    """
+    Writes many messages directly, in batches of INGEST_BATCH_SIZE, bypassing
+    the ingestion queue. Used for history backfill.
+    """
+    for start in range(0, len(rows), config.INGEST_BATCH_SIZE):
+        await write_batch(rows[start:start + config.INGEST_BATCH_SIZE])
+
+
+async def get_latest_message_id(channel_id: int, ingested_before: datetime | None = None) -> int | None:
+    """
+    Returns the highest stored message ID of a channel, if any, optionally
+    only among messages ingested before a given time.
+    """
+    query = sqlalchemy.select(func.max(messages.c.id)).where(messages.c.channel_id == channel_id)
+    if ingested_before is not None:
+        query = query.where(messages.c.ingested_at < ingested_before)
+    async with AsyncSession() as session:
+        return (await session.execute(query)).scalar()
+
+
+# Queued by `IngestQueue.stop` behind the messages to write before stopping.
+_STOP = object()
+
+
+class IngestQueue:
+    """
+    Write-behind buffer between the Telegram handlers and Postgres.
+
+    Messages are collected in a bounded queue and flushed by a background task
+    once `max_batch_size` messages are waiting or `flush_interval` seconds
+    have passed since the first message of the batch arrived, whichever comes
+    first. A full queue applies backpressure to producers.
+
+    A failed batch is retried `max_retries` times with exponential backoff,
+    then dropped and counted in `collector_ingest_dropped_rows_total`: unlike
+    the spool, the queue has nowhere to keep it.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = config.INGEST_BATCH_SIZE,
+        flush_interval: float = config.INGEST_FLUSH_INTERVAL,
+        max_queue_size: int = config.INGEST_QUEUE_SIZE,
+        writer=write_batch,
+        max_retries: int = config.INGEST_WRITE_RETRIES,
+        retry_delay: float = config.INGEST_RETRY_DELAY,
+    ):
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._writer = writer
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task: asyncio.Task | None = None
+
+    async def put(self, row: dict):
+        await self._queue.put(row)
+        metrics.INGEST_QUEUE_DEPTH.set(self._queue.qsize())
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the flusher and writes out anything still queued. The flusher
+        is not cancelled: it is sent a stop marker behind the queued messages
+        and finishes the batch in hand and everything before the marker.
+        """
+        if self._task is not None:
+            if not self._task.done():
+                await self._queue.put(_STOP)
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while not self._queue.empty():
+            await self._flush([row for row in self._take(self.max_batch_size) if row is not _STOP])
+
+    def _take(self, limit: int) -> list:
+        """Up to `limit` queued items, ending early at a stop marker."""
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+            if batch[-1] is _STOP:
+                break
+        return batch
+
+    async def _next_batch(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.max_batch_size and batch[-1] is not _STOP:
+            batch.extend(self._take(self.max_batch_size - len(batch)))
+            remaining = deadline - loop.time()
+            if len(batch) >= self.max_batch_size or remaining <= 0 or batch[-1] is _STOP:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: list[dict]):
+        if not batch:
+            return
+        metrics.INGEST_QUEUE_DEPTH.set(self._queue.qsize())
+        metrics.INGEST_BATCH_SIZE.observe(len(batch))
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                await self._writer(batch)
+                return
+            except Exception:
+                if attempt == self.max_retries:
+                    logging.exception(f"Failed to write a batch of {len(batch)} messages; dropping it.")
+                    metrics.INGEST_DROPPED_ROWS.inc(len(batch))
+                    return
+                delay = self.retry_delay * 2 ** attempt
+                logging.exception(f"Failed to write a batch of {len(batch)} messages; retrying in {delay}s.")
+            finally:
+                metrics.INGEST_FLUSH_SECONDS.observe(time.perf_counter() - started)
+            await asyncio.sleep(delay)
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            stopping = batch[-1] is _STOP
+            await self._flush(batch[:-1] if stopping else batch)
+            if stopping:
+                return
+
+
+ingest_queue = IngestQueue()
+spool = Spool(writer=write_batch) if config.SPOOL_DIR else None
+
+
+async def start_ingestion():
+    """
+    Starts the background task that writes live messages: the spool's
+    drainer, or the in-memory queue's flusher without a SPOOL_DIR.
+    """
+    if spool is not None:
+        spool.start()
+    else:
+        ingest_queue.start()
+
+
+async def stop_ingestion():
+    """Stops the background task, flushing the in-memory queue if used."""
+    if spool is not None:
+        await spool.stop()
+    else:
+        await ingest_queue.stop()
+
 
 async def save_message(
     channel_id: int,
@@ -44,15 +879,18 @@ async def save_message(
     message_id: int,
     body: str,
     created_at: datetime,
+    received_at: float | None = None,
+    media: dict | None = None,
 ):
     """
-    Saves a single message to the database and notifies listeners.
+    Queues a single message for writing to the database.
 
-    This function performs an "upsert" for the channel to ensure the channel
-    is in the database before adding the message. It then inserts the message,
-    ignoring conflicts if the message ID already exists. Finally, it sends a
-    PostgreSQL NOTIFY signal on the 'new_message' channel with the message ID
-    as the payload.
+    With a SPOOL_DIR the message is appended to the durable spool and this
+    returns once it is on disk; the spool's drainer writes it to the database
+    in bulk. Otherwise it is written by the ingestion queue's background task
+    together with any other messages that arrive within the same flush
+    window (see `write_batch`). This only blocks when the spool or queue is
+    full.
 
     Args:
         channel_id: The Telegram ID of the channel.
@@ -60,23 +898,172 @@ async def save_message(
         message_id: The Telegram ID of the message.
         body: The text content of the message.
         created_at: The timestamp when the message was created in Telegram.
+        received_at: When the handler got the message (epoch seconds), for
+            latency metrics. Defaults to now.
+        media: The message's photo or document, as from `media.describe`.
+    """
+    row = {
+        "channel_id": channel_id,
+        "channel_name": channel_name,
+        "message_id": message_id,
+        "body": body,
+        "created_at": created_at,
+        "received_at": received_at if received_at is not None else time.time(),
+    }
+    if media is not None:
+        row["media"] = media
+    await _enqueue(row)
+
+
+async def save_edit(
+    channel_id: int,
+    message_id: int,
+    body: str,
+    created_at: datetime,
+    edited_at: datetime,
+    channel_name: str,
+    media: dict | None = None,
+):
     """
+    Queues an edit of a stored message, behind any messages queued before
+    it (see `apply_changes`).
+
+    Args:
+        channel_id: The Telegram ID of the channel.
+        message_id: The Telegram ID of the message.
+        body: The message's new text.
+        created_at: When the message was first posted.
+        edited_at: When it was edited.
+        channel_name: The display name of the channel, for the stored head.
+        media: The message's photo or document, as from `media.describe`.
+    """
+    row = {
+        "op": "edit",
+        "channel_id": channel_id,
+        "channel_name": channel_name,
+        "message_id": message_id,
+        "body": body,
+        "created_at": created_at,
+        "edited_at": edited_at,
+    }
+    if media is not None:
+        row["media"] = media
+    await _enqueue(row)
+
+
+async def save_deletions(channel_id: int, message_ids: list[int], deleted_at: datetime | None = None):
+    """Queues the soft deletion of messages deleted on Telegram."""
+    deleted_at = deleted_at or datetime.now(timezone.utc)
+    for message_id in message_ids:
+        await _enqueue(
+            {"op": "delete", "channel_id": channel_id, "message_id": message_id, "deleted_at": deleted_at}
+        )
+
+
+async def _enqueue(row: dict):
+    if spool is not None:
+        await spool.append(row)
+    else:
+        await ingest_queue.put(row)
+
+
+async def heartbeat_shard(shard_id: str, host: str, pid: int, started_at: datetime, channel_count: int):
+    """
+    Records that a shard is alive, registering it on its first heartbeat.
+    Heartbeats use the database's clock, so shard clocks need not agree.
+    """
+    now = func.now()
+    stmt = postgresql.insert(collector_shards).values(
+        shard_id=shard_id, host=host, pid=pid, started_at=started_at, heartbeat_at=now, channels=channel_count
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[collector_shards.c.shard_id],
+        set_={
+            "host": host,
+            "pid": pid,
+            "started_at": started_at,
+            "heartbeat_at": now,
+            "channels": channel_count,
+        },
+    )
     async with AsyncSession() as session:
         async with session.begin():
-            # Upsert channel
-            stmt = sqlalchemy.dialects.postgresql.insert(channels).values(
-                id=channel_id, name=channel_name
-            ).on_conflict_do_nothing()
             await session.execute(stmt)
 
-            # Insert message
-            stmt = sqlalchemy.dialects.postgresql.insert(messages).values(
-                id=message_id,
-                channel_id=channel_id,
-                body=body,
-                created_at=created_at,
-            ).on_conflict_do_nothing()
-            await session.execute(stmt)
 
-            # Notify the API service that a new message has arrived
-            await session.execute(sqlalchemy.text(f"NOTIFY new_message, '{message_id}'")) 
\ No newline at end of file
+async def live_shards(ttl: float) -> set[str]:
+    """IDs of the shards whose last heartbeat is within `ttl` seconds."""
+    cutoff = func.now() - timedelta(seconds=ttl)
+    async with AsyncSession() as session:
+        result = await session.execute(
+            sqlalchemy.select(collector_shards.c.shard_id).where(collector_shards.c.heartbeat_at >= cutoff)
+        )
+        return set(result.scalars().all())
+
+
+async def remove_shard(shard_id: str):
+    """Unregisters a shard that is shutting down, so its channels move at once."""
+    async with AsyncSession() as session:
+        async with session.begin():
+            await session.execute(
+                sqlalchemy.delete(collector_shards).where(collector_shards.c.shard_id == shard_id)
+            )
+
+
+async def get_media(message_id: int) -> dict | None:
+    """A message's media row, if it has media."""
+    async with AsyncSession() as session:
+        row = (await session.execute(
+            sqlalchemy.select(message_media).where(message_media.c.message_id == message_id)
+        )).mappings().first()
+        return dict(row) if row else None
+
+
+async def find_stored_media(file_id: int) -> dict | None:
+    """The digests of a Telegram file some other message already downloaded."""
+    async with AsyncSession() as session:
+        row = (await session.execute(
+            sqlalchemy.select(message_media.c.sha256, message_media.c.thumbnail_sha256)
+            .where(message_media.c.file_id == file_id, message_media.c.sha256.is_not(None))
+            .limit(1)
+        )).mappings().first()
+        return dict(row) if row else None
+
+
+async def set_media_digests(message_id: int, sha256: str, thumbnail_sha256: str | None):
+    """Records that a message's media was downloaded into the media store."""
+    async with AsyncSession() as session:
+        async with session.begin():
+            await session.execute(
+                sqlalchemy.update(message_media)
+                .where(message_media.c.message_id == message_id)
+                .values(sha256=sha256, thumbnail_sha256=thumbnail_sha256)
+            )
+
+
+async def listen_media_requests(callback):
+    """
+    Calls `callback(message_id)` for each media download the API requests on
+    the 'media_requests' channel, reconnecting whenever the connection drops.
+    Requests sent while disconnected are lost; the API repeats them.
+    """
+    def on_request(connection, pid, channel, payload):
+        try:
+            callback(int(payload))
+        except ValueError:
+            logging.warning(f"Ignoring malformed media request: {payload!r}")
+
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(dsn=config.DATABASE_URL)
+            await conn.add_listener("media_requests", on_request)
+            while not conn.is_closed():
+                await conn.fetchval("SELECT 1")
+                await asyncio.sleep(5)
+        except (asyncpg.exceptions.PostgresConnectionError, OSError) as e:
+            logging.warning(f"Media request listener disconnected: {e}. Reconnecting in 5 seconds...")
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(5)
@@ -1,17 +1,30 @@
-import time
+import asyncio
 import logging
+import os
+import socket
+import time
+from datetime import datetime, timezone
+from functools import partial
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 from telethon import TelegramClient, events
 from telethon.errors.rpcerrorlist import FloodWaitError
 from telethon.sessions import StringSession
-from telethon.tl.functions.messages import GetHistoryRequest
 
-from . import config, storage
+from . import config, media, metrics, storage
+from .entity_cache import CachedChannel, entity_cache
+from .fake_telegram import FakeTelegramClient
+from .sharding import HashRing
 
-client = TelegramClient(
-    StringSession(config.SESSION_STRING), config.API_ID, config.API_HASH
-)
+if config.TELEGRAM_FAKE:
+    client = FakeTelegramClient()
+else:
+    client = TelegramClient(
+        StringSession(config.SESSION_STRING), config.API_ID, config.API_HASH
+    )
+
+# Keeps references to fire-and-forget tasks so they aren't garbage collected.
+_background_tasks: set[asyncio.Task] = set()
 
 
 def _wait_for_flood(retry_state):
@@ -42,74 +55,390 @@ def _connect_with_retry():
     client.start()
 
 
+# Tracked channels keyed by their marked peer ID (the `event.chat_id` of
+# their updates). Rebuilt whenever channels.yml changes.
+_tracked_channels: dict[int, CachedChannel] = {}
+
+# The live shards, which channels.yml is spread over. Until the first
+# heartbeat this shard assumes it is alone.
+_ring = HashRing([config.SHARD_ID])
+_started_at = datetime.now(timezone.utc)
+# Serializes refreshes from the config and shard watchers.
+_refresh_lock = asyncio.Lock()
+
+
+async def _resolve_channel(spec, dialogs_by_title) -> CachedChannel | None:
+    """
+    Resolves one channels.yml entry (username, link, numeric ID or, for
+    backwards compatibility, a channel title) to its entity.
+
+    Channels already in the entity cache are resolved without an RPC;
+    anything resolved through Telegram is added to it.
+    """
+    spec = str(spec).strip()
+    cached = await entity_cache.lookup(spec)
+    if cached is not None:
+        return cached
+    try:
+        entity = await client.get_entity(int(spec) if spec.lstrip("-").isdigit() else spec)
+    except ValueError:
+        if dialogs_by_title is None:
+            return None
+        if not dialogs_by_title:
+            async for dialog in client.iter_dialogs():
+                dialogs_by_title[dialog.title] = dialog.entity
+        entity = dialogs_by_title.get(spec)
+        if entity is None:
+            return None
+    return await entity_cache.remember(entity)
+
+
+async def resolve_channels(channels) -> dict[int, CachedChannel]:
+    """Resolves channel config entries to cached entities, keyed by marked peer ID."""
+    resolved = {}
+    dialogs_by_title: dict = {}
+    for spec in channels:
+        try:
+            entity = await _resolve_channel(spec, dialogs_by_title)
+        except FloodWaitError as e:
+            logging.warning(f"Flood wait while resolving {spec}; waiting {e.seconds} seconds.")
+            await asyncio.sleep(e.seconds + 5)
+            entity = await _resolve_channel(spec, None)
+        except Exception as e:
+            logging.error(f"Could not resolve channel {spec}: {e}")
+            continue
+        if entity is None:
+            logging.error(f"Could not resolve channel {spec}.")
+            continue
+        resolved[entity.peer_id] = entity
+    return resolved
+
+
+async def refresh_tracked_channels() -> list:
+    """
+    Re-resolves the configured channels this shard owns and re-registers the
+    message handler with a `chats=` filter, so Telethon drops updates from
+    untracked chats before our code runs.
+
+    Returns:
+        The cached entities of channels that were not tracked before.
+    """
+    async with _refresh_lock:
+        resolved = await resolve_channels(_ring.assign(config.get_channels(), config.SHARD_ID))
+        added = [entity for peer_id, entity in resolved.items() if peer_id not in _tracked_channels]
+        _tracked_channels.clear()
+        _tracked_channels.update(resolved)
+
+        for handler, event in (
+            (handle_new_message, events.NewMessage),
+            (handle_message_edited, events.MessageEdited),
+            (handle_message_deleted, events.MessageDeleted),
+        ):
+            client.remove_event_handler(handler)
+            client.add_event_handler(handler, event(chats=list(resolved)))
+    logging.info(f"Shard {config.SHARD_ID} is tracking {len(resolved)} channels.")
+    return added
+
+
+async def _heartbeat() -> set[str]:
+    """Records this shard's heartbeat and returns the live shards, itself included."""
+    await storage.heartbeat_shard(
+        config.SHARD_ID, socket.gethostname(), os.getpid(), _started_at, len(_tracked_channels)
+    )
+    return await storage.live_shards(config.SHARD_TTL) | {config.SHARD_ID}
+
+
+async def update_shards(shards: set[str]) -> list:
+    """
+    Spreads the channels over a new set of live shards, if it changed.
+
+    Returns:
+        The cached entities of channels this shard took over.
+    """
+    global _ring
+    if shards == _ring.shards:
+        return []
+    logging.info(f"Live shards changed to {sorted(shards)}, rebalancing channels...")
+    _ring = HashRing(shards)
+    return await refresh_tracked_channels()
+
+
+async def watch_shards():
+    """
+    Sends this shard's heartbeat every SHARD_HEARTBEAT_INTERVAL seconds and
+    rebalances the channels when shards join or leave, backfilling the
+    channels taken over from where their previous shard stopped.
+    """
+    while True:
+        await asyncio.sleep(config.SHARD_HEARTBEAT_INTERVAL)
+        try:
+            added = await update_shards(await _heartbeat())
+        except Exception as e:
+            logging.error(f"Failed to update the live shards: {e}")
+            continue
+        if added:
+            await backfill_history(added)
+
+
+async def watch_channel_config():
+    """
+    Checks channels.yml for changes every CHANNEL_CONFIG_POLL seconds and
+    refreshes the tracked channels when it changed, backfilling new ones.
+    """
+    channels = list(config.get_channels())
+    while True:
+        await asyncio.sleep(config.CHANNEL_CONFIG_POLL)
+        if config.get_channels() == channels:
+            continue
+        channels = list(config.get_channels())
+        logging.info("Channel config changed, refreshing tracked channels...")
+        try:
+            added = await refresh_tracked_channels()
+        except Exception as e:
+            logging.error(f"Failed to refresh tracked channels: {e}")
+            continue
+        if added:
+            await backfill_history(added)
+
+
 async def handle_new_message(event):
     """
     This function is called whenever a new message is received.
-    It checks if the message is from a monitored channel and saves it.
+    Updates are pre-filtered to tracked channels by the handler's `chats=`
+    filter; the lookup below also guards against a stale registration.
     """
-    # Hot-reloadable channel list
-    channels = config.get_channels()
-    if not hasattr(event, "chat") or not event.chat or not hasattr(event.chat, "title"):
+    received_at = time.time()
+    channel = _tracked_channels.get(event.chat_id)
+    if channel is None:
         return
+    metrics.TELEGRAM_TO_HANDLER_SECONDS.observe(received_at - event.message.date.timestamp())
 
-    is_target_channel = event.chat.title in channels or str(event.chat.id) in channels
-
-    if not is_target_channel:
-        return
+    # Prefer the title on the update, which reflects renames. Updating the
+    # cached entity keeps backfilled rows in step; the channels table picks
+    # the new title up with this message.
+    chat = getattr(event, "chat", None)
+    channel_name = getattr(chat, "title", None) or channel.title
+    channel.title = channel_name
 
-    logging.info(f"New message from channel {event.chat.title}")
+    logging.info(f"New message from channel {channel_name}")
 
     await storage.save_message(
-        channel_id=event.chat.id,
-        channel_name=event.chat.title,
+        channel_id=channel.id,
+        channel_name=channel_name,
         message_id=event.message.id,
         body=event.message.text,
         created_at=event.message.date,
+        received_at=received_at,
+        media=media.describe(event.message),
     )
 
 
-async def fetch_and_save_history(channel, limit=50):
-    """Fetches the recent message history of a channel and saves it."""
-    print(f"Fetching message history for {channel}...")
-    history = await client(GetHistoryRequest(
-        peer=channel,
-        limit=limit,
-        offset_date=None,
-        offset_id=0,
-        max_id=0,
-        min_id=0,
-        add_offset=0,
-        hash=0
-    ))
-
-    if not history.messages:
-        print(f"No message history found for {channel}.")
+async def handle_message_edited(event):
+    """Queues an edit of a tracked channel's message, e.g. targets added to a call."""
+    channel = _tracked_channels.get(event.chat_id)
+    if channel is None:
         return
+    message = event.message
+    await storage.save_edit(
+        channel_id=channel.id,
+        message_id=message.id,
+        body=message.text or "",
+        created_at=message.date,
+        edited_at=message.edit_date or datetime.now(timezone.utc),
+        channel_name=channel.title,
+        media=media.describe(message),
+    )
 
-    print(f"Found {len(history.messages)} messages in {channel}.")
-    for message in history.messages:
-        # Skip empty messages
-        if not message.text:
-            continue
-        
-        # Use the channel entity from the message if available
-        channel_entity = message.chat if hasattr(message, 'chat') else await client.get_entity(message.peer_id)
 
-        await storage.save_message(
-            channel_id=channel_entity.id,
-            channel_name=channel_entity.title,
-            message_id=message.id,
-            body=message.text,
-            created_at=message.date,
-        )
-    print(f"Finished saving history for {channel}.")
+async def handle_message_deleted(event):
+    """Queues the soft deletion of a tracked channel's deleted messages."""
+    channel = _tracked_channels.get(event.chat_id)
+    if channel is None:
+        return
+    logging.info(f"{len(event.deleted_ids)} messages deleted from channel {channel.title}")
+    await storage.save_deletions(channel.id, list(event.deleted_ids))
+
+
+def _history_row(channel_entity, message) -> dict | None:
+    """The row of a history message, or None for one with neither text nor media."""
+    attached = media.describe(message)
+    if not message.text and attached is None:
+        return None
+    row = {
+        "channel_id": channel_entity.id,
+        "channel_name": channel_entity.title,
+        "message_id": message.id,
+        "body": message.text or "",
+        "created_at": message.date,
+    }
+    if attached is not None:
+        row["media"] = attached
+    return row
+
+
+async def fetch_and_save_history(channel, ingested_before=None, page_size=100):
+    """
+    Catches a channel up with Telegram, starting after its newest stored message.
+
+    History is paged oldest to newest and each page is written in bulk. A
+    channel with no stored messages starts from its BACKFILL_INITIAL_LIMIT
+    most recent ones.
+
+    Args:
+        channel: The channel's cached entity, or its username, link or ID.
+        ingested_before: Only messages stored before this time count as the
+            starting point, so live messages received while the backfill runs
+            don't make it skip the gap.
+        page_size: Number of messages written per bulk insert.
+    """
+    if isinstance(channel, (str, int)):
+        channel_entity = await _resolve_channel(channel, None)
+        if channel_entity is None:
+            raise ValueError(f"Could not resolve channel {channel}.")
+    else:
+        channel_entity = channel
+    # The cached ID and access hash address the channel without resolving it again.
+    input_peer = channel_entity.input_peer()
+    channel = channel_entity.title
+    last_id = await storage.get_latest_message_id(channel_entity.id, ingested_before=ingested_before)
+    while True:
+        try:
+            if last_id is None:
+                print(f"Fetching recent message history for {channel}...")
+                recent = [
+                    message
+                    async for message in client.iter_messages(
+                        input_peer, limit=config.BACKFILL_INITIAL_LIMIT
+                    )
+                ]
+                # Skip empty messages
+                rows = [row for row in map(partial(_history_row, channel_entity), reversed(recent)) if row]
+                await storage.save_messages(rows)
+                saved = len(rows)
+            else:
+                print(f"Catching up {channel} after message {last_id}...")
+                saved, page = 0, []
+                async for message in client.iter_messages(input_peer, min_id=last_id, reverse=True):
+                    row = _history_row(channel_entity, message)
+                    # Skip empty messages
+                    if row is None:
+                        continue
+                    page.append(row)
+                    if len(page) >= page_size:
+                        await storage.save_messages(page)
+                        saved, last_id, page = saved + len(page), page[-1]["message_id"], []
+                await storage.save_messages(page)
+                saved += len(page)
+            print(f"Finished saving history for {channel} ({saved} messages).")
+            return
+        except FloodWaitError as e:
+            # Pages written so far are kept; resume after them once the wait is over.
+            wait_seconds = e.seconds + 5
+            logging.warning(f"Flood wait while backfilling {channel}. Resuming in {wait_seconds} seconds.")
+            await asyncio.sleep(wait_seconds)
+
+
+async def backfill_history(channels, concurrency=config.BACKFILL_CONCURRENCY):
+    """Backfills several channels concurrently, at most `concurrency` at a time."""
+    started_at = datetime.now(timezone.utc)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def backfill(channel):
+        async with semaphore:
+            try:
+                await fetch_and_save_history(channel, ingested_before=started_at)
+            except Exception as e:
+                logging.error(f"Failed to backfill history for {channel}: {e}")
+
+    await asyncio.gather(*(backfill(channel) for channel in channels))
+    logging.info("History backfill complete.")
+
+
+# Media downloads in progress, by message ID, so repeated requests for the
+# same file while it downloads are ignored.
+_media_downloads: dict[int, asyncio.Task] = {}
+
+
+async def download_media(message_id: int):
+    """
+    Downloads a message's media and thumbnail into the media store, if the
+    message is from a channel this shard tracks (other shards serve the
+    rest). Files some other message already downloaded are reused.
+    """
+    attached = await storage.get_media(message_id)
+    if attached is None or attached["sha256"] is not None:
+        return
+    channel = next(
+        (channel for channel in _tracked_channels.values() if channel.id == attached["channel_id"]), None
+    )
+    if channel is None:
+        return
+
+    stored = await storage.find_stored_media(attached["file_id"])
+    if stored is not None:
+        await storage.set_media_digests(message_id, stored["sha256"], stored["thumbnail_sha256"])
+        return
+
+    # File references expire, so the message is fetched again for a fresh one.
+    message = await client.get_messages(channel.input_peer(), ids=message_id)
+    if message is None or media.describe(message) is None:
+        logging.warning(f"Media of message {message_id} is no longer available.")
+        return
+    downloaded = await _download(message)
+    if downloaded is None:
+        logging.warning(f"Media of message {message_id} is no longer available.")
+        return
+    sha256, size = downloaded
+    thumbnail_sha256 = None
+    if attached["thumbnail"] is not None:
+        thumbnail = await _download(message, thumb=attached["thumbnail"])
+        if thumbnail is not None:
+            thumbnail_sha256 = thumbnail[0]
+    await storage.set_media_digests(message_id, sha256, thumbnail_sha256)
+    logging.info(f"Downloaded media of message {message_id} ({size} bytes).")
+
+
+async def _download(message, **kwargs) -> tuple[str, int] | None:
+    """
+    Downloads a message's media, or a thumbnail of it, straight to a file in
+    the media store. Returns its SHA-256 and size, or None when there is
+    nothing to download.
+    """
+    path = media.temp_path()
+    try:
+        with open(path, "wb") as f:
+            downloaded = await client.download_media(message, file=f, **kwargs)
+        size = os.path.getsize(path)
+        if downloaded is None or not size:
+            os.unlink(path)
+            return None
+        return await asyncio.to_thread(media.store, path), size
+    except BaseException:
+        if os.path.exists(path):
+            os.unlink(path)
+        raise
+
+
+def request_media_download(message_id: int):
+    """Starts downloading a message's media, unless it is already downloading."""
+    if message_id in _media_downloads:
+        return
+
+    async def download():
+        try:
+            await download_media(message_id)
+        except FloodWaitError as e:
+            logging.warning(f"Flood wait while downloading media of message {message_id} ({e.seconds} seconds).")
+        except Exception as e:
+            logging.error(f"Failed to download media of message {message_id}: {e}")
+        finally:
+            del _media_downloads[message_id]
+
+    _media_downloads[message_id] = asyncio.create_task(download())
 
 
 async def start_client():
     """Starts the telethon client and adds the new message event handler."""
-    
-    # Register the event handler
-    client.on(events.NewMessage())(handle_new_message)
 
     logging.info("Attempting to start Telethon client with retry logic...")
     try:
@@ -123,7 +452,7 @@ async def start_client():
         return
     
     # Generate and print session string if it's not already set
-    if not config.SESSION_STRING:
+    if not config.SESSION_STRING and not config.TELEGRAM_FAKE:
         session_string = client.session.save()
         logging.warning("\nYour session string is:\n")
         logging.warning(session_string)
@@ -131,16 +460,32 @@ async def start_client():
         # We don't run forever in this case, so the user can copy the string
         return
 
-    # Fetch history before starting the event loop
-    logging.info("Performing initial fetch of message history...")
-    # Use the dynamic getter for channels
-    for channel in config.get_channels():
-        await fetch_and_save_history(channel)
-    logging.info("Initial fetch complete.")
+    # Register the event handler for the resolved channels, resolving
+    # channels seen before from the persisted entity cache.
+    await entity_cache.load()
+    global _ring
+    try:
+        _ring = HashRing(await _heartbeat())
+    except Exception as e:
+        logging.error(f"Failed to register shard {config.SHARD_ID}; assuming it is alone: {e}")
+    await refresh_tracked_channels()
+
+    # Backfill history in the background so live messages are handled
+    # immediately.
+    logging.info("Starting background backfill of message history...")
+    for coroutine in (
+        backfill_history(list(_tracked_channels.values())),
+        watch_channel_config(),
+        watch_shards(),
+        storage.listen_media_requests(request_media_download),
+    ):
+        task = asyncio.create_task(coroutine)
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
 
     # The `run_until_disconnected` is a blocking call that runs its own loop.
     # To integrate with our main async loop, we just need to keep the script alive.
     # The client is already running in the background at this point.
-    logging.info(f"Listening for messages from: {config.get_channels()}")
+    logging.info(f"Listening for messages from: {[channel.title for channel in _tracked_channels.values()]}")
     # We don't need run_until_disconnected as our main() function will keep the loop alive.
     # If we were to use it, it would block here. We just need the client to be connected. 
\ No newline at end of file
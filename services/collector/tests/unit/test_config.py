@@ -0,0 +1,42 @@
+import os
+from unittest.mock import patch
+
+from app import config
+
+
+def test_get_channels_reloads_only_when_file_changes(tmp_path):
+    """
+    Tests that the channel list is re-read when channels.yml's mtime changes.
+    """
+    # Arrange
+    path = tmp_path / "channels.yml"
+    path.write_text('channels:\n  - "first"\n')
+
+    with patch.object(config, "CHANNEL_CONFIG_PATH", str(path)), \
+            patch.dict(config._channels_cache, {"data": None, "mtime": None}):
+        # Act / Assert
+        assert config.get_channels() == ["first"]
+
+        path.write_text('channels:\n  - "second"\n')
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert config.get_channels() == ["second"]
+
+
+def test_get_channels_keeps_last_good_list_on_invalid_yaml(tmp_path):
+    """
+    Tests that a broken edit to channels.yml does not drop the tracked channels.
+    """
+    # Arrange
+    path = tmp_path / "channels.yml"
+    path.write_text('channels:\n  - "first"\n')
+
+    with patch.object(config, "CHANNEL_CONFIG_PATH", str(path)), \
+            patch.dict(config._channels_cache, {"data": None, "mtime": None}):
+        config.get_channels()
+        path.write_text("channels: [unclosed\n")
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        # Act / Assert
+        assert config.get_channels() == ["first"]
@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta, timezone
+
+from app.dedupe import DuplicateIndex, fingerprint, fingerprint_batch
+from app.extract import extract_batch
+
+ADDRESS = "7xKXtg2CW87d97TXJSDpbD5jBkheTqA83TZRuJosgAsU"
+CALL = f"🚀 NEW CALL: $PEPE2 just launched on Solana! CA: {ADDRESS} Entry 0.0001, TP 10x. NFA DYOR"
+REPOST = f"NEW CALL $PEPE2 just launched on Solana!! CA: {ADDRESS} Entry 0.0001, TP 10x 🔥 NFA DYOR"
+POSTED_AT = datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def _row(message_id, channel_id, body, seconds=0):
+    return {
+        "message_id": message_id,
+        "channel_id": channel_id,
+        "channel_name": f"channel {channel_id}",
+        "body": body,
+        "created_at": POSTED_AT + timedelta(seconds=seconds),
+    }
+
+
+def _link(index, rows, now=0.0):
+    """Links a batch and indexes its originals, as a successful write does; returns the duplicates."""
+    index.index(index.link(rows, fingerprint_batch(rows, extract_batch(rows)), now=now), now=now)
+    return sum("duplicate_of" in row for row in rows)
+
+
+def test_repost_in_another_channel_is_linked_to_first_copy():
+    """
+    Tests that a reposted call differing only in emoji and punctuation is linked to the earliest copy.
+    """
+    # Arrange
+    index = DuplicateIndex(window=300, max_distance=3)
+    rows = [_row(1, 100, CALL), _row(2, 200, REPOST, seconds=5), _row(3, 300, CALL, seconds=9)]
+
+    # Act
+    duplicates = _link(index, rows)
+
+    # Assert
+    assert duplicates == 2
+    assert "duplicate_of" not in rows[0]
+    assert (rows[1]["duplicate_of"], rows[1]["original_channel_id"]) == (1, 100)
+    assert (rows[2]["duplicate_of"], rows[2]["original_channel_id"]) == (1, 100)
+    assert len(index) == 1
+
+
+def test_same_text_is_not_a_duplicate_within_a_channel_or_for_another_address():
+    """
+    Tests that repeats in the same channel and calls for a different address are kept as originals.
+    """
+    # Arrange
+    index = DuplicateIndex(window=300, max_distance=3)
+    other_token = CALL.replace(ADDRESS, "So11111111111111111111111111111111111111112")
+    rows = [_row(1, 100, CALL), _row(2, 100, CALL, seconds=5), _row(3, 200, other_token, seconds=5)]
+
+    # Act
+    duplicates = _link(index, rows)
+
+    # Assert
+    assert duplicates == 0
+    assert not any("duplicate_of" in row for row in rows)
+
+
+def test_fingerprints_expire_after_window():
+    """
+    Tests that a repost arriving after the window is kept as a new message.
+    """
+    # Arrange
+    index = DuplicateIndex(window=300, max_distance=3)
+    _link(index, [_row(1, 100, CALL)], now=0.0)
+
+    # Act
+    late = _row(2, 200, REPOST, seconds=400)
+    duplicates = _link(index, [late], now=400.0)
+
+    # Assert
+    assert duplicates == 0
+    assert "duplicate_of" not in late
+    assert len(index) == 1
+
+
+def test_short_messages_without_addresses_are_not_fingerprinted():
+    """
+    Tests that greetings and other short messages are never treated as reposts.
+    """
+    # Act / Assert
+    assert fingerprint("gm 🚀") is None
+    assert fingerprint("LFG!") is None
+    assert fingerprint(ADDRESS, frozenset({ADDRESS})) is not None
+
+
+def test_messages_are_not_indexed_until_their_batch_is_stored():
+    """
+    Tests that reposts are not linked to a batch whose write failed, and that a retried batch is linked afresh.
+    """
+    # Arrange
+    index = DuplicateIndex(window=300, max_distance=3)
+    failed = [_row(1, 100, CALL)]
+    index.link(failed, fingerprint_batch(failed, extract_batch(failed)))
+    retried = [_row(1, 100, CALL), _row(2, 200, REPOST, seconds=5)]
+    retried[0]["duplicate_of"] = 99
+
+    # Act
+    originals = index.link(retried, fingerprint_batch(retried, extract_batch(retried)))
+
+    # Assert
+    assert len(index) == 0
+    assert "duplicate_of" not in retried[0]
+    assert retried[1]["duplicate_of"] == 1
+    assert [row["message_id"] for row, _ in originals] == [1]
@@ -0,0 +1,89 @@
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.entity_cache import CachedChannel, EntityCache
+
+
+def _row(channel_id, name, username=None):
+    return {"id": channel_id, "name": name, "username": username, "access_hash": 1}
+
+
+def test_entity_cache_evicts_least_recently_used():
+    """
+    Tests that the cache stays within capacity, evicting the least recently used channel.
+    """
+    # Arrange
+    cache = EntityCache(capacity=2)
+    cache._put(CachedChannel(id=1, title="one", access_hash=1, username="one"))
+    cache._put(CachedChannel(id=2, title="two", access_hash=1))
+    cache._get(1)
+
+    # Act
+    cache._put(CachedChannel(id=3, title="three", access_hash=1))
+
+    # Assert
+    assert len(cache) == 2
+    assert cache._get(2) is None
+    assert cache._by_username == {"one": 1}
+
+
+@pytest.mark.asyncio
+@patch("app.entity_cache.storage.find_channel_entity", new_callable=AsyncMock)
+@patch("app.entity_cache.storage.load_channel_entities", new_callable=AsyncMock)
+async def test_entity_cache_serves_loaded_channels_from_memory(mock_load, mock_find):
+    """
+    Tests that channels loaded from the database are found by ID, marked ID and username without a query.
+    """
+    # Arrange
+    mock_load.return_value = [_row(12345, "Target", "target")]
+    cache = EntityCache()
+
+    # Act
+    await cache.load()
+    found = [await cache.lookup(spec) for spec in ("12345", "-1000000012345", "@Target", "https://t.me/target")]
+
+    # Assert
+    assert {channel.id for channel in found} == {12345}
+    assert found[0].peer_id == -1000000012345
+    mock_find.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@patch("app.entity_cache.storage.find_channel_entity", new_callable=AsyncMock)
+async def test_entity_cache_falls_back_to_database(mock_find):
+    """
+    Tests that a channel missing from memory is read from the database and then kept in memory.
+    """
+    # Arrange
+    mock_find.return_value = _row(12345, "Target", "target")
+    cache = EntityCache()
+
+    # Act
+    first = await cache.lookup("target")
+    second = await cache.lookup("target")
+
+    # Assert
+    assert first == second == CachedChannel(id=12345, title="Target", access_hash=1, username="target")
+    mock_find.assert_awaited_once_with(username="target")
+
+
+@pytest.mark.asyncio
+@patch("app.entity_cache.storage.save_channel_entity", new_callable=AsyncMock)
+async def test_entity_cache_persists_resolved_entities(mock_save):
+    """
+    Tests that remembering a resolved entity stores its ID, access hash and title.
+    """
+    # Arrange
+    from telethon import types
+    entity = types.Channel(
+        id=12345, title="Target", photo=types.ChatPhotoEmpty(), date=None, access_hash=42, username="Target"
+    )
+    cache = EntityCache()
+
+    # Act
+    channel = await cache.remember(entity)
+
+    # Assert
+    assert channel.input_peer() == types.InputPeerChannel(12345, 42)
+    mock_save.assert_awaited_once_with(12345, "Target", "target", 42)
@@ -0,0 +1,88 @@
+from app.extract import extract_batch, extract_mentions
+
+SOLANA_ADDRESS = "7GCihgDB8fe6KNjn2MYtkzZcRjQy3t9GHdC8uHYmW2hr"
+EVM_ADDRESS = "0xAbCdEf0123456789abcdef0123456789ABCDEF01"
+
+
+def test_extract_mentions_normalizes_tickers():
+    """
+    Tests that tickers are deduplicated case-insensitively and dollar amounts ignored.
+    """
+    # Act
+    mentions = extract_mentions("Aping $pepe, $PEPE and $WIF for $5")
+
+    # Assert
+    assert mentions == [("ticker", "$PEPE"), ("ticker", "$WIF")]
+
+
+def test_extract_mentions_finds_contract_addresses():
+    """
+    Tests that EVM addresses are lowercased and Solana addresses kept as-is.
+    """
+    # Act
+    mentions = extract_mentions(f"CA: {EVM_ADDRESS}\nSOL: {SOLANA_ADDRESS}")
+
+    # Assert
+    assert mentions == [("evm", EVM_ADDRESS.lower()), ("solana", SOLANA_ADDRESS)]
+
+
+def test_extract_mentions_reports_dex_link_and_its_address():
+    """
+    Tests that a DEX link is stored without its query string, plus its address.
+    """
+    # Act
+    mentions = extract_mentions(f"Chart https://www.DexScreener.com/solana/{SOLANA_ADDRESS}?maker=abc")
+
+    # Assert
+    assert mentions == [
+        ("dex_link", f"dexscreener.com/solana/{SOLANA_ADDRESS}"),
+        ("solana", SOLANA_ADDRESS),
+    ]
+
+
+def test_extract_mentions_ignores_long_plain_words():
+    """
+    Tests that long words made of base58 letters are not taken for addresses.
+    """
+    # Act
+    mentions = extract_mentions("abcdefghijkmnopqrstuvwxyzabcdefghijkmn")
+
+    # Assert
+    assert mentions == []
+
+
+def test_extract_batch_builds_mention_rows():
+    """
+    Tests that mention rows carry the message's id, channel and timestamp.
+    """
+    # Arrange
+    row = {"message_id": 1, "channel_id": 7, "body": "$PEPE", "created_at": "2023-01-01T12:00:00+00:00"}
+
+    # Act
+    mentions = extract_batch([row])
+
+    # Assert
+    assert mentions == [{
+        "message_id": 1,
+        "channel_id": 7,
+        "kind": "ticker",
+        "token": "$PEPE",
+        "created_at": "2023-01-01T12:00:00+00:00",
+    }]
+
+
+def test_extract_mentions_matches_link_hosts_but_not_addresses_case_insensitively():
+    """
+    Tests that upper-case link schemes and hosts are found, while strings using letters outside base58 are not addresses.
+    """
+    # Arrange
+    not_base58 = "OIl" + SOLANA_ADDRESS[3:]
+
+    # Act
+    mentions = extract_mentions(f"HTTPS://GMGN.AI/sol/token/{SOLANA_ADDRESS} {not_base58}")
+
+    # Assert
+    assert mentions == [
+        ("dex_link", f"gmgn.ai/sol/token/{SOLANA_ADDRESS}"),
+        ("solana", SOLANA_ADDRESS),
+    ]
@@ -0,0 +1,70 @@
+from unittest.mock import AsyncMock
+
+import pytest
+from telethon import events, types, utils
+
+from app.fake_telegram import FakeTelegramClient
+
+NOW = 1_700_000_000.0
+
+
+@pytest.mark.asyncio
+async def test_fake_channels_and_history_are_the_same_in_every_process():
+    """
+    Tests that two fake clients resolve a channel to the same entity and serve the same message IDs.
+    """
+    # Arrange
+    first, second = FakeTelegramClient(interval=5), FakeTelegramClient(interval=5)
+
+    # Act
+    channel = await first.get_entity("@alpha_calls")
+    same = await second.get_entity("t.me/alpha_calls")
+    peer = types.InputPeerChannel(channel.id, channel.access_hash)
+    history = [message.id async for message in first.iter_messages(peer, limit=3)]
+    again = [message.id async for message in second.iter_messages(peer, limit=3)]
+
+    # Assert
+    assert same == channel
+    assert history == again
+    assert history == sorted(history, reverse=True)
+    assert len(history) == 3
+
+
+@pytest.mark.asyncio
+async def test_fake_history_resumes_after_min_id_oldest_first():
+    """
+    Tests that `min_id` with `reverse` returns only newer messages, oldest first.
+    """
+    # Arrange
+    client = FakeTelegramClient(interval=5)
+    channel = client.channel("alpha_calls")
+    recent = [message async for message in client.iter_messages(channel.id, limit=5)]
+
+    # Act
+    newer = [message.id async for message in client.iter_messages(channel.id, min_id=recent[2].id, reverse=True)]
+
+    # Assert
+    assert newer == [recent[1].id, recent[0].id]
+
+
+@pytest.mark.asyncio
+async def test_post_due_delivers_new_messages_to_subscribed_chats_only():
+    """
+    Tests that live messages reach the handler registered for their chat and no one else.
+    """
+    # Arrange
+    client = FakeTelegramClient(interval=5)
+    tracked, other = client.channel("alpha_calls"), client.channel("beta_calls")
+    handler = AsyncMock()
+    peer_id = utils.get_peer_id(types.PeerChannel(tracked.id))
+    client.add_event_handler(handler, events.NewMessage(chats=[peer_id]))
+    await client.post_due(NOW)
+
+    # Act
+    await client.post_due(NOW + 10)
+
+    # Assert
+    updates = [call.args[0] for call in handler.await_args_list]
+    assert len(updates) == 2
+    assert all(update.chat_id == peer_id and update.chat is tracked for update in updates)
+    assert other.id not in client._posted
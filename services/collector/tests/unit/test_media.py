@@ -0,0 +1,88 @@
+import hashlib
+import os
+
+from telethon import types
+
+from app.media import describe, store, store_path, temp_path
+
+
+def _photo_message():
+    sizes = [
+        types.PhotoStrippedSize(type="i", bytes=b"\x01\x28\x28"),
+        types.PhotoSize(type="s", w=90, h=51, size=1_200),
+        types.PhotoSize(type="m", w=320, h=180, size=9_000),
+        types.PhotoSize(type="x", w=800, h=450, size=40_000),
+        types.PhotoSizeProgressive(type="y", w=1280, h=720, sizes=[10_000, 50_000, 81_234]),
+    ]
+    photo = types.Photo(
+        id=555, access_hash=1, file_reference=b"\x01\x02", date=None, sizes=sizes, dc_id=2
+    )
+    return types.Message(id=1, peer_id=types.PeerChannel(1), date=None, message="", media=types.MessageMediaPhoto(photo=photo))
+
+
+def test_describe_photo_takes_largest_size_and_nearest_thumbnail():
+    """
+    Tests that a photo is described by its full-size image, with the thumbnail closest to 320px.
+    """
+    # Act
+    media = describe(_photo_message())
+
+    # Assert
+    assert media == {
+        "kind": "photo",
+        "mime_type": "image/jpeg",
+        "size": 81_234,
+        "width": 1280,
+        "height": 720,
+        "file_id": 555,
+        "file_reference": "0102",
+        "thumbnail": "m",
+    }
+
+
+def test_describe_video_document_and_plain_text():
+    """
+    Tests that documents take their kind and dimensions from their attributes, and text messages have no media.
+    """
+    # Arrange
+    document = types.Document(
+        id=777, access_hash=1, file_reference=b"", date=None, mime_type="video/mp4", size=2_000_000, dc_id=2,
+        attributes=[types.DocumentAttributeVideo(duration=3.0, w=640, h=360)],
+    )
+    video = types.Message(
+        id=2, peer_id=types.PeerChannel(1), date=None, message="chart",
+        media=types.MessageMediaDocument(document=document),
+    )
+    text = types.Message(id=3, peer_id=types.PeerChannel(1), date=None, message="gm")
+
+    # Act
+    described = describe(video)
+
+    # Assert
+    assert (described["kind"], described["width"], described["height"]) == ("video", 640, 360)
+    assert described["size"] == 2_000_000 and described["thumbnail"] is None
+    assert describe(text) is None
+
+
+def test_store_is_content_addressed(tmp_path):
+    """
+    Tests that files are stored once under their SHA-256, however many times they are added.
+    """
+    # Arrange
+    data = b"\x89PNG chart" * 200_000
+    digest = hashlib.sha256(data).hexdigest()
+    downloads = [temp_path(str(tmp_path)) for _ in range(2)]
+    for path in downloads:
+        with open(path, "wb") as f:
+            f.write(data)
+
+    # Act
+    first = store(downloads[0], root=str(tmp_path))
+    second = store(downloads[1], root=str(tmp_path))
+
+    # Assert
+    assert first == second == digest
+    assert store_path(digest, str(tmp_path)) == os.path.join(str(tmp_path), digest[:2], digest[2:4], digest)
+    with open(store_path(digest, str(tmp_path)), "rb") as f:
+        assert f.read() == data
+    assert sum(len(files) for _, _, files in os.walk(tmp_path)) == 1
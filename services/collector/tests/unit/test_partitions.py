@@ -0,0 +1,53 @@
+from datetime import date, datetime, timedelta, timezone
+
+from app.partitions import add_months, month_of, parse_partition_name, partition_name, plan_maintenance
+
+NOW = datetime(2026, 1, 15, 12, 0, tzinfo=timezone.utc)
+
+
+def test_month_helpers_handle_year_boundaries_and_timezones():
+    """
+    Tests month arithmetic across years and that months are taken in UTC.
+    """
+    # Arrange
+    late_evening_utc_minus_5 = datetime(2025, 12, 31, 22, 0, tzinfo=timezone(timedelta(hours=-5)))
+
+    # Act
+    month = month_of(late_evening_utc_minus_5)
+
+    # Assert
+    assert month == date(2026, 1, 1)
+    assert add_months(month, -1) == date(2025, 12, 1)
+    assert add_months(month, 13) == date(2027, 2, 1)
+    assert partition_name(month) == "messages_y2026m01"
+    assert parse_partition_name("messages_y2026m01") == month
+    assert parse_partition_name("messages_default") is None
+
+
+def test_plan_maintenance_creates_upcoming_partitions():
+    """
+    Tests that the current and the next `ahead` months get partitions if missing.
+    """
+    # Act
+    plan = plan_maintenance({date(2026, 1, 1)}, NOW, ahead=2, hot=2, retention=0)
+
+    # Assert
+    assert plan.create == [date(2026, 2, 1), date(2026, 3, 1)]
+    assert plan.cool == []
+    assert plan.expire == []
+
+
+def test_plan_maintenance_cools_and_expires_old_partitions():
+    """
+    Tests that months past the hot window move to BRIN and months past retention are expired.
+    """
+    # Arrange
+    existing = {add_months(date(2026, 1, 1), -offset) for offset in range(6)}
+
+    # Act
+    plan = plan_maintenance(existing, NOW, ahead=0, hot=2, retention=4)
+
+    # Assert
+    assert plan.create == []
+    assert plan.cool == [date(2025, 10, 1), date(2025, 11, 1)]
+    assert plan.expire == [date(2025, 8, 1), date(2025, 9, 1)]
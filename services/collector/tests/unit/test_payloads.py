@@ -0,0 +1,179 @@
+import json
+from datetime import datetime, timezone
+
+from app.payloads import build_change_payloads, build_notify_payloads, render_head, render_message
+
+
+def _row(message_id, body="Test message body"):
+    return {
+        "channel_id": 12345,
+        "channel_name": "target_channel_name",
+        "message_id": message_id,
+        "body": body,
+        "created_at": datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc),
+    }
+
+
+def test_render_message_matches_api_schema_encoding():
+    """
+    Tests that rendered messages use the same JSON layout as schemas.Message.
+    """
+    # Act
+    result = render_message(_row(999, body="Buy $XYZ 🚀"))
+
+    # Assert
+    assert result == (
+        '{"id":999,"body":"Buy $XYZ 🚀","created_at":"2023-01-01T12:00:00Z",'
+        '"channel":{"id":12345,"name":"target_channel_name"}}'
+    )
+
+
+def test_build_notify_payloads_packs_batch_into_one_payload():
+    """
+    Tests that a small batch is sent as a single JSON array.
+    """
+    # Act
+    payloads = build_notify_payloads([_row(1), _row(2)])
+
+    # Assert
+    assert len(payloads) == 1
+    assert [message["id"] for message in json.loads(payloads[0])] == [1, 2]
+
+
+def test_build_notify_payloads_splits_at_limit():
+    """
+    Tests that payloads never exceed the NOTIFY size limit.
+    """
+    # Arrange
+    rows = [_row(message_id, body="x" * 300) for message_id in range(10)]
+
+    # Act
+    payloads = build_notify_payloads(rows, limit=1000)
+
+    # Assert
+    assert len(payloads) > 1
+    assert all(len(payload.encode("utf-8")) <= 1000 for payload in payloads)
+    ids = [message["id"] for payload in payloads for message in json.loads(payload)]
+    assert ids == list(range(10))
+
+
+def test_build_notify_payloads_falls_back_to_id_for_oversized_message():
+    """
+    Tests that a message too large for any payload is sent as its bare ID.
+    """
+    # Act
+    payloads = build_notify_payloads([_row(1), _row(2, body="x" * 2000)], limit=1000)
+
+    # Assert
+    items = [item for payload in payloads for item in json.loads(payload)]
+    assert items[0]["id"] == 1
+    assert items[1] == 2
+
+
+def test_render_message_adds_stage_timestamps_to_live_messages():
+    """
+    Tests that live messages carry their handler and write timestamps, and backfilled ones don't.
+    """
+    # Arrange
+    live = {**_row(1), "received_at": 1672574400.5}
+
+    # Act
+    stamped = json.loads(render_message(live, written_at=1672574400.75))
+    backfilled = json.loads(render_message(_row(2), written_at=1672574400.75))
+
+    # Assert
+    assert stamped["stages"] == {"received": 1672574400.5, "written": 1672574400.75}
+    assert "stages" not in backfilled
+
+
+def test_render_message_reuses_stored_head_with_current_channel():
+    """
+    Tests that a message rendered from its stored head matches a full render, with the channel appended.
+    """
+    # Arrange
+    row = _row(999, body='Say "hi" \\ 🚀')
+    head = render_head(row)
+
+    # Act
+    result = render_message({**row, "rendered": head})
+
+    # Assert
+    assert head == '{"id":999,"body":"Say \\"hi\\" \\\\ 🚀","created_at":"2023-01-01T12:00:00Z","channel":'
+    assert result == render_message(row)
+
+
+def test_render_message_carries_original_of_reposts():
+    """
+    Tests that a repost of another channel's call names its original for the API.
+    """
+    # Arrange
+    repost = {**_row(2), "duplicate_of": 1, "original_channel_id": 999}
+
+    # Act
+    rendered = json.loads(render_message(repost))
+
+    # Assert
+    assert rendered["duplicate_of"] == {"id": 1, "channel_id": 999}
+    assert "duplicate_of" not in json.loads(render_message(_row(1)))
+
+
+def test_render_message_describes_media_before_the_channel():
+    """
+    Tests that media metadata is rendered in schemas.Message order, without the Telegram file details.
+    """
+    # Arrange
+    row = _row(7, body="")
+    row["media"] = {
+        "kind": "photo", "mime_type": "image/jpeg", "size": 81234, "width": 1280, "height": 720,
+        "file_id": 555, "file_reference": "0102", "thumbnail": "m",
+    }
+
+    # Act
+    result = render_message(row)
+
+    # Assert
+    assert result == (
+        '{"id":7,"body":"","created_at":"2023-01-01T12:00:00Z",'
+        '"media":{"kind":"photo","mime_type":"image/jpeg","size":81234,"width":1280,"height":720,"thumbnail":true},'
+        '"channel":{"id":12345,"name":"target_channel_name"}}'
+    )
+
+
+def test_change_payloads_render_compact_deltas():
+    """
+    Tests that edits render as update deltas with their version and deletions as bare delete deltas.
+    """
+    # Arrange
+    edit = {
+        **_row(5, body="Buy $XYZ, TP2 hit"), "op": "edit", "version": 2,
+        "edited_at": datetime(2023, 1, 1, 12, 5, tzinfo=timezone.utc),
+    }
+    deletion = {"op": "delete", "channel_id": 12345, "message_id": 6}
+
+    # Act
+    payloads = build_change_payloads([edit, deletion])
+
+    # Assert
+    assert payloads == [
+        '[{"type":"update","id":5,"channel_id":12345,"version":2,'
+        '"edited_at":"2023-01-01T12:05:00Z","body":"Buy $XYZ, TP2 hit"},'
+        '{"type":"delete","id":6,"channel_id":12345}]'
+    ]
+    assert '"edited_at":"2023-01-01T12:05:00Z","channel"' in render_message(edit)
+
+
+def test_change_payloads_send_oversized_updates_without_body():
+    """
+    Tests that an update too large for a NOTIFY is sent as a reference for the API to load.
+    """
+    # Arrange
+    edit = {
+        **_row(5, body="x" * 9000), "op": "edit", "version": 3,
+        "edited_at": datetime(2023, 1, 1, 12, 5, tzinfo=timezone.utc),
+    }
+
+    # Act
+    payloads = build_change_payloads([edit])
+
+    # Assert
+    assert payloads == ['[{"type":"update","id":5,"channel_id":12345}]']
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock
+
+import pytest
+
+from app import rollups
+
+NOW = datetime(2024, 3, 10, 15, 30, tzinfo=timezone.utc)
+
+
+def test_bucket_start_truncates_to_utc_buckets():
+    """
+    Tests that timestamps in any timezone fall into the UTC bucket of each granularity.
+    """
+    # Arrange
+    value = datetime(2024, 3, 10, 1, 42, 17, 500, tzinfo=timezone(timedelta(hours=2)))
+
+    # Act
+    buckets = {granularity: rollups.bucket_start(value, granularity) for granularity in rollups.GRANULARITIES}
+
+    # Assert
+    assert buckets == {
+        "1m": datetime(2024, 3, 9, 23, 42, tzinfo=timezone.utc),
+        "1h": datetime(2024, 3, 9, 23, 0, tzinfo=timezone.utc),
+        "1d": datetime(2024, 3, 9, tzinfo=timezone.utc),
+    }
+
+
+def test_count_messages_aggregates_rows_per_channel_and_bucket():
+    """
+    Tests that a batch becomes one increment per channel and bucket at each granularity.
+    """
+    # Arrange
+    rows = [
+        {"channel_id": 1, "created_at": NOW},
+        {"channel_id": 1, "created_at": NOW + timedelta(seconds=20)},
+        {"channel_id": 1, "created_at": NOW + timedelta(minutes=5)},
+        {"channel_id": 2, "created_at": NOW},
+    ]
+
+    # Act
+    counts = rollups.count_messages(rows)
+
+    # Assert
+    by_key = {(c["granularity"], c["bucket"], c["channel_id"]): c["messages"] for c in counts}
+    assert by_key[("1m", NOW, 1)] == 2
+    assert by_key[("1m", NOW + timedelta(minutes=5), 1)] == 1
+    assert by_key[("1h", NOW.replace(minute=0), 1)] == 3
+    assert by_key[("1d", NOW.replace(hour=0, minute=0), 2)] == 1
+    assert len(counts) == 3 + 2 + 2
+
+
+def test_count_mentions_keeps_channels_apart():
+    """
+    Tests that token increments are kept per channel, so distinct channels can be counted.
+    """
+    # Arrange
+    mentions = [
+        {"kind": "ticker", "token": "$PEPE", "channel_id": channel_id, "created_at": NOW}
+        for channel_id in (1, 1, 2)
+    ]
+
+    # Act
+    counts = [c for c in rollups.count_mentions(mentions) if c["granularity"] == "1h"]
+
+    # Assert
+    assert [(c["channel_id"], c["mentions"]) for c in counts] == [(1, 2), (2, 1)]
+
+
+@pytest.mark.asyncio
+async def test_rebuild_skips_buckets_past_retention(monkeypatch):
+    """
+    Tests that a rebuild does not recreate minute buckets that pruning would delete.
+    """
+    # Arrange
+    monkeypatch.setattr(rollups.config, "ROLLUP_MINUTE_RETENTION_HOURS", 48)
+    monkeypatch.setattr(rollups.config, "ROLLUP_HOUR_RETENTION_DAYS", 90)
+    conn = AsyncMock()
+    since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    # Act
+    await rollups.rebuild(conn, since, datetime(2024, 3, 11, tzinfo=timezone.utc), NOW)
+
+    # Assert
+    starts = {}
+    for call in conn.execute.await_args_list:
+        if len(call.args) > 1:
+            starts[call.args[1]["granularity"]] = call.args[1]["since"]
+    assert starts == {
+        "1m": datetime(2024, 3, 8, 15, 30, tzinfo=timezone.utc),
+        "1h": since,
+        "1d": since,
+    }
+
+
+@pytest.mark.asyncio
+async def test_rebuild_leaves_deleted_messages_out():
+    """
+    Tests that recounted channel activity skips deleted messages, as the live counts do.
+    """
+    # Arrange
+    conn = AsyncMock()
+
+    # Act
+    await rollups.rebuild(
+        conn, datetime(2024, 3, 10, tzinfo=timezone.utc), datetime(2024, 3, 11, tzinfo=timezone.utc), NOW
+    )
+
+    # Assert
+    statements = [str(call.args[0]) for call in conn.execute.await_args_list]
+    inserts = [sql for sql in statements if "INSERT INTO channel_activity" in sql]
+    assert inserts and all("deleted_at IS NULL" in sql for sql in inserts)
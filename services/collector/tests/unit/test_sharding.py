@@ -0,0 +1,44 @@
+from app.sharding import HashRing, channel_key
+
+CHANNELS = [f"channel_{i}" for i in range(2000)]
+
+
+def test_ring_assigns_every_channel_to_exactly_one_shard():
+    """
+    Tests that the shards' assignments partition the channels.
+    """
+    # Arrange
+    ring = HashRing(["a", "b", "c"])
+
+    # Act
+    assignments = {shard: ring.assign(CHANNELS, shard) for shard in ring.shards}
+
+    # Assert
+    assert sorted(sum(assignments.values(), [])) == sorted(CHANNELS)
+    assert all(len(channels) > len(CHANNELS) / 6 for channels in assignments.values())
+
+
+def test_adding_a_shard_only_moves_channels_to_it():
+    """
+    Tests that a joining shard takes roughly its share of channels and that no other channel moves.
+    """
+    # Arrange
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+
+    # Act
+    moved = [key for key in CHANNELS if before.owner(key) != after.owner(key)]
+
+    # Assert
+    assert all(after.owner(key) == "d" for key in moved)
+    assert len(CHANNELS) / 8 < len(moved) < len(CHANNELS) * 3 / 8
+
+
+def test_channel_key_normalizes_usernames():
+    """
+    Tests that spellings of the same username share a ring key, and that IDs and titles are kept.
+    """
+    # Assert
+    assert channel_key("@SomeChannel") == channel_key("https://t.me/somechannel") == "somechannel"
+    assert channel_key(-1001234567890) == "-1001234567890"
+    assert HashRing().owner("somechannel") is None
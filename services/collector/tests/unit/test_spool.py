@@ -0,0 +1,176 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock
+
+import pytest
+
+from app.spool import Spool, decode_row, encode_row
+
+
+def _row(message_id):
+    return {
+        "channel_id": 1,
+        "channel_name": "Channel ✓",
+        "message_id": message_id,
+        "body": f"message {message_id}",
+        "created_at": datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc),
+        "received_at": 1672574400.5,
+    }
+
+
+def _spool(tmp_path, writer, **kwargs):
+    kwargs.setdefault("fsync_interval", 0)
+    return Spool(directory=str(tmp_path), writer=writer, **kwargs)
+
+
+async def _wait_for(condition):
+    for _ in range(300):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+@pytest.mark.asyncio
+async def test_spool_drains_appended_messages_in_batches(tmp_path):
+    """
+    Tests that appended messages reach the writer intact and in batches.
+    """
+    # Arrange
+    writer = AsyncMock()
+    spool = _spool(tmp_path, writer, max_batch_size=2)
+    spool.open()
+
+    # Act
+    await asyncio.gather(*(spool.append(_row(message_id)) for message_id in range(3)))
+    spool.start()
+    await _wait_for(lambda: spool._lag_bytes() == 0)
+    await spool.stop()
+
+    # Assert
+    batches = [call.args[0] for call in writer.await_args_list]
+    assert batches == [[_row(0), _row(1)], [_row(2)]]
+
+
+@pytest.mark.asyncio
+async def test_spool_keeps_messages_while_database_is_down(tmp_path):
+    """
+    Tests that a failing write is retried and the batch is not lost.
+    """
+    # Arrange
+    writer = AsyncMock(side_effect=[ConnectionError("db down"), None])
+    spool = _spool(tmp_path, writer)
+    spool.start()
+
+    # Act
+    await spool.append(_row(1))
+    await _wait_for(lambda: writer.await_count == 2 and spool._lag_bytes() == 0)
+    await spool.stop()
+
+    # Assert
+    assert writer.await_args_list[1].args[0] == [_row(1)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("bad_id", [0, 2])
+async def test_spool_dead_letters_a_record_the_database_rejects(tmp_path, bad_id):
+    """
+    Tests that a record the writer always rejects is moved to the dead-letter
+    file after repeated failures, and the records around it are written.
+    """
+    # Arrange
+    written = []
+
+    async def writer(rows):
+        if any(row["message_id"] == bad_id for row in rows):
+            raise ValueError("invalid byte sequence")
+        written.extend(row["message_id"] for row in rows)
+
+    spool = _spool(tmp_path, writer, max_failures=1)
+    spool.open()
+    await asyncio.gather(*(spool.append(_row(message_id)) for message_id in range(5)))
+
+    # Act
+    spool.start()
+    await _wait_for(lambda: spool._lag_bytes() == 0)
+    await spool.stop()
+
+    # Assert
+    assert written == [message_id for message_id in range(5) if message_id != bad_id]
+    with open(os.path.join(tmp_path, "dead-letters.log"), "rb") as f:
+        assert [decode_row(line)[0] for line in f] == [_row(bad_id)]
+
+
+@pytest.mark.asyncio
+async def test_spool_replays_undrained_messages_after_restart(tmp_path):
+    """
+    Tests that messages spooled but not written survive a restart, while drained ones are not replayed.
+    """
+    # Arrange
+    first_writer = AsyncMock()
+    spool = _spool(tmp_path, first_writer)
+    spool.start()
+    await spool.append(_row(1))
+    await _wait_for(lambda: first_writer.await_count == 1 and spool._lag_bytes() == 0)
+    await spool.stop()
+
+    # The drainer is down when the next message arrives.
+    spool = _spool(tmp_path, AsyncMock())
+    spool.open()
+    await spool.append(_row(2))
+    await spool.stop()
+    with open(os.path.join(tmp_path, "spool-000000000000.log"), "ab") as f:
+        f.write(b'{"torn')
+
+    # Act
+    second_writer = AsyncMock()
+    spool = _spool(tmp_path, second_writer)
+    spool.start()
+    await _wait_for(lambda: second_writer.await_count == 1)
+    await spool.stop()
+
+    # Assert
+    second_writer.assert_awaited_once_with([_row(2)])
+
+
+@pytest.mark.asyncio
+async def test_spool_rotates_segments_and_deletes_drained_ones(tmp_path):
+    """
+    Tests that full segments are rotated and removed once drained.
+    """
+    # Arrange
+    writer = AsyncMock()
+    spool = _spool(tmp_path, writer, segment_bytes=1)
+    spool.start()
+
+    # Act
+    for message_id in range(3):
+        await spool.append(_row(message_id))
+    await _wait_for(lambda: spool._lag_bytes() == 0 and len(spool._sizes) == 1)
+    await spool.stop()
+
+    # Assert
+    delivered = [row["message_id"] for call in writer.await_args_list for row in call.args[0]]
+    assert delivered == [0, 1, 2]
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith(".log")) == ["spool-000000000003.log"]
+
+
+def test_edits_and_deletions_round_trip_through_the_spool():
+    """
+    Tests that the timestamps of queued edits and deletions come back as datetimes.
+    """
+    # Arrange
+    edit = {
+        "op": "edit", "channel_id": 1, "message_id": 2, "body": "TP2 hit",
+        "created_at": datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc),
+        "edited_at": datetime(2023, 1, 1, 12, 5, tzinfo=timezone.utc),
+    }
+    deletion = {"op": "delete", "channel_id": 1, "message_id": 2, "deleted_at": datetime(2023, 1, 2, tzinfo=timezone.utc)}
+
+    # Act
+    decoded = [decode_row(encode_row(row))[0] for row in (edit, deletion)]
+
+    # Assert
+    assert {key: decoded[0][key] for key in edit} == edit
+    assert {key: decoded[1][key] for key in deletion} == deletion
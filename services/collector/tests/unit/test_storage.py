@@ -0,0 +1,283 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+
+from app import metrics
+from app.storage import IngestQueue, _dedupe_channels
+
+
+def _row(message_id, channel_id=1, channel_name="Channel"):
+    return {
+        "channel_id": channel_id,
+        "channel_name": channel_name,
+        "message_id": message_id,
+        "body": f"message {message_id}",
+        "created_at": "2023-01-01T12:00:00+00:00",
+    }
+
+
+def test_dedupe_channels_returns_one_row_per_channel():
+    """
+    Tests that a batch touching the same channel several times upserts it once.
+    """
+    # Arrange
+    rows = [_row(1, channel_id=1, channel_name="Old"), _row(2, channel_id=2), _row(3, channel_id=1, channel_name="New")]
+
+    # Act
+    result = _dedupe_channels(rows)
+
+    # Assert
+    assert sorted(result, key=lambda c: c["id"]) == [
+        {"id": 1, "name": "New"},
+        {"id": 2, "name": "Channel"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_ingest_queue_flushes_when_batch_is_full():
+    """
+    Tests that the queue flushes as soon as the size bound is reached.
+    """
+    # Arrange
+    writer = AsyncMock()
+    queue = IngestQueue(max_batch_size=3, flush_interval=60, writer=writer)
+    queue.start()
+
+    # Act
+    for message_id in range(3):
+        await queue.put(_row(message_id))
+    await asyncio.sleep(0.05)
+
+    # Assert
+    writer.assert_awaited_once_with([_row(0), _row(1), _row(2)])
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_ingest_queue_flushes_partial_batch_after_interval():
+    """
+    Tests that a partial batch is written once the time bound expires.
+    """
+    # Arrange
+    writer = AsyncMock()
+    queue = IngestQueue(max_batch_size=100, flush_interval=0.05, writer=writer)
+    queue.start()
+
+    # Act
+    await queue.put(_row(1))
+    await queue.put(_row(2))
+    await asyncio.sleep(0.2)
+
+    # Assert
+    writer.assert_awaited_once_with([_row(1), _row(2)])
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_ingest_queue_stop_drains_pending_messages():
+    """
+    Tests that stopping the queue writes out messages that were never flushed.
+    """
+    # Arrange
+    writer = AsyncMock()
+    queue = IngestQueue(max_batch_size=100, flush_interval=60, writer=writer)
+
+    # Act
+    await queue.put(_row(1))
+    await queue.stop()
+
+    # Assert
+    writer.assert_awaited_once_with([_row(1)])
+
+
+@pytest.mark.asyncio
+async def test_ingest_queue_survives_writer_errors():
+    """
+    Tests that a failed flush does not stop later batches from being written.
+    """
+    # Arrange
+    writer = AsyncMock(side_effect=[RuntimeError("db down"), None, None])
+    queue = IngestQueue(max_batch_size=1, flush_interval=60, writer=writer, retry_delay=0)
+    queue.start()
+
+    # Act
+    await queue.put(_row(1))
+    await queue.put(_row(2))
+    await asyncio.sleep(0.05)
+
+    # Assert
+    assert [call.args[0] for call in writer.await_args_list] == [[_row(1)], [_row(1)], [_row(2)]]
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_ingest_queue_counts_batches_dropped_after_retries():
+    """
+    Tests that a batch failing every retry is dropped and its messages counted.
+    """
+    # Arrange
+    writer = AsyncMock(side_effect=RuntimeError("invalid byte sequence"))
+    queue = IngestQueue(max_batch_size=100, flush_interval=60, writer=writer, max_retries=2, retry_delay=0)
+    dropped = metrics.INGEST_DROPPED_ROWS._value.get()
+
+    # Act
+    await queue.put(_row(1))
+    await queue.put(_row(2))
+    await queue.stop()
+
+    # Assert
+    assert writer.await_count == 3
+    assert metrics.INGEST_DROPPED_ROWS._value.get() == dropped + 2
+
+
+@pytest.mark.asyncio
+async def test_ingest_queue_stop_finishes_the_batch_being_written():
+    """
+    Tests that stopping waits for an in-flight flush and then writes what was queued behind it.
+    """
+    # Arrange
+    written = []
+    release = asyncio.Event()
+
+    async def writer(rows):
+        await release.wait()
+        written.extend(rows)
+
+    queue = IngestQueue(max_batch_size=2, flush_interval=60, writer=writer)
+    queue.start()
+    for message_id in range(5):
+        await queue.put(_row(message_id))
+    await asyncio.sleep(0.01)
+
+    # Act
+    stopping = asyncio.create_task(queue.stop())
+    await asyncio.sleep(0.01)
+    release.set()
+    await stopping
+
+    # Assert
+    assert written == [_row(message_id) for message_id in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_decrement_takes_counts_off_and_drops_empty_buckets():
+    """
+    Tests that a deleted message's counts are subtracted from its buckets, which are dropped once empty.
+    """
+    # Arrange
+    from datetime import datetime, timezone
+    from sqlalchemy.dialects import postgresql
+    from app import rollups
+    from app.storage import _decrement, channel_activity
+
+    session = AsyncMock()
+    counts = rollups.count_messages([{"channel_id": 7, "created_at": datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc)}])
+
+    # Act
+    await _decrement(channel_activity, counts, "messages", session)
+
+    # Assert
+    statements = [
+        str(call.args[0].compile(dialect=postgresql.dialect())) for call in session.execute.await_args_list
+    ]
+    assert len(statements) == 2 * len(rollups.GRANULARITIES)
+    assert statements[0].startswith("UPDATE channel_activity SET messages=(channel_activity.messages - ")
+    assert statements[1].startswith("DELETE FROM channel_activity") and "messages <= " in statements[1]
+
+
+@pytest.mark.asyncio
+async def test_sync_duplicate_index_indexes_originals_stored_by_other_shards(monkeypatch):
+    """
+    Tests that recent originals read back from the database are indexed, so this shard links reposts of them.
+    """
+    # Arrange
+    from datetime import datetime, timezone
+    from types import SimpleNamespace
+    from unittest.mock import MagicMock
+    from app import storage
+    from app.dedupe import DuplicateIndex
+
+    body = "NEW CALL $PEPE2 just launched on Solana, entry 0.0001 and TP 10x"
+    stored = [SimpleNamespace(id=1, channel_id=100, body=body, created_at=datetime.now(timezone.utc))]
+    session = MagicMock()
+    session.__aenter__ = AsyncMock(return_value=session)
+    session.__aexit__ = AsyncMock(return_value=False)
+    session.execute = AsyncMock(return_value=stored)
+    index = DuplicateIndex(window=300, max_distance=3)
+    monkeypatch.setattr(storage, "AsyncSession", MagicMock(return_value=session))
+    monkeypatch.setattr(storage, "duplicate_index", index)
+
+    # Act
+    since = await storage.sync_duplicate_index()
+    await storage.sync_duplicate_index(since)
+
+    # Assert
+    assert 1 in index and len(index) == 1
+    assert "ingested_at" in str(session.execute.await_args.args[0])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("shard_id, runs", [("0", True), ("1", False), ("a", False)])
+async def test_only_the_lowest_live_shard_runs_maintenance(monkeypatch, shard_id, runs):
+    """
+    Tests that partition and rollup maintenance is left to one shard, whichever live shard sorts first.
+    """
+    # Arrange
+    from app import storage
+
+    monkeypatch.setattr(storage.config, "SHARD_ID", shard_id)
+    monkeypatch.setattr(storage, "live_shards", AsyncMock(return_value={"0", "1"}))
+
+    # Act
+    result = await storage._runs_maintenance()
+
+    # Assert
+    assert result is runs
+
+
+@pytest.mark.asyncio
+async def test_deletion_applied_before_the_message_is_written_keeps_it_deleted(monkeypatch):
+    """
+    Tests that deleting a message still in the spool leaves a tombstone, and the message is then stored deleted.
+    """
+    # Arrange
+    from datetime import datetime, timezone
+    from unittest.mock import MagicMock
+    from sqlalchemy.dialects import postgresql
+    from app import storage
+
+    deleted_at = datetime(2024, 1, 1, 12, 5, tzinfo=timezone.utc)
+    row = {**_row(42, channel_id=7), "body": "Buy $PEPE now", "created_at": datetime(2024, 1, 1, 12, tzinfo=timezone.utc)}
+    statements = []
+
+    async def execute(statement):
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        statements.append((sql, statement.compile(dialect=postgresql.dialect()).params))
+        result = MagicMock()
+        result.mappings.return_value.first.return_value = None
+        result.first.return_value = None
+        result.all.return_value = [(42, deleted_at)] if sql.startswith("DELETE FROM message_tombstones") else []
+        result.scalars.return_value.all.return_value = [42]
+        return result
+
+    session = MagicMock()
+    session.__aenter__ = AsyncMock(return_value=session)
+    session.__aexit__ = AsyncMock(return_value=False)
+    session.begin.return_value = session
+    session.execute = AsyncMock(side_effect=execute)
+    monkeypatch.setattr(storage, "AsyncSession", MagicMock(return_value=session))
+    monkeypatch.setattr(storage, "duplicate_index", None)
+
+    # Act
+    await storage.apply_changes([{"op": "delete", "channel_id": 7, "message_id": 42, "deleted_at": deleted_at}])
+    await storage.write_messages([row])
+
+    # Assert
+    tombstone = next(params for sql, params in statements if sql.startswith("INSERT INTO message_tombstones"))
+    assert tombstone == {"message_id": 42, "channel_id": 7, "deleted_at": deleted_at}
+    message = next(params for sql, params in statements if sql.startswith("INSERT INTO messages"))
+    assert message["deleted_at_m0"] == deleted_at
+    written = [sql for sql, _ in statements]
+    assert not any(sql.startswith(("INSERT INTO message_mentions", "INSERT INTO channel_activity")) for sql in written)
+    assert not any("pg_notify" in sql for sql in written)
@@ -1,29 +1,40 @@
 import asyncio
-from unittest.mock import AsyncMock, MagicMock, patch
+from datetime import datetime, timezone
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
 import pytest
 
 # Now we can import the handler function directly
+from app.entity_cache import CachedChannel, EntityCache
 from app.telegram_client import handle_new_message
 
+# Marked peer ID of the channel with ID 12345
+TRACKED_PEER_ID = -1000000012345
+
+
+def _tracked_channel():
+    channel = MagicMock()
+    channel.id = 12345
+    channel.title = "target_channel_name"
+    return channel
+
 @pytest.mark.asyncio
 @patch("app.telegram_client.storage.save_message", new_callable=AsyncMock)
-@patch("app.telegram_client.config.get_channels")
-async def test_handle_new_message_saves_from_target_channel(mock_get_channels, mock_save_message):
+async def test_handle_new_message_saves_from_target_channel(mock_save_message):
     """
     Tests that handle_new_message saves a message from a monitored channel.
     """
     # Arrange
-    mock_get_channels.return_value = ["target_channel_name", "12345"]
     mock_event = MagicMock()
+    mock_event.chat_id = TRACKED_PEER_ID
     mock_event.chat.title = "target_channel_name"
-    mock_event.chat.id = 12345
     mock_event.message.id = 999
     mock_event.message.text = "Test message body"
-    mock_event.message.date = "2023-01-01T12:00:00+00:00"
+    mock_event.message.date = datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc)
 
     # Act
-    await handle_new_message(mock_event)
+    with patch.dict("app.telegram_client._tracked_channels", {TRACKED_PEER_ID: _tracked_channel()}):
+        await handle_new_message(mock_event)
 
     # Assert
     mock_save_message.assert_awaited_once_with(
@@ -31,41 +42,278 @@ async def test_handle_new_message_saves_from_target_channel(mock_get_channels, m
         channel_name="target_channel_name",
         message_id=999,
         body="Test message body",
-        created_at="2023-01-01T12:00:00+00:00",
+        created_at=datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc),
+        received_at=ANY,
+        media=None,
     )
 
 @pytest.mark.asyncio
 @patch("app.telegram_client.storage.save_message", new_callable=AsyncMock)
-@patch("app.telegram_client.config.get_channels")
-async def test_handle_new_message_ignores_other_channel(mock_get_channels, mock_save_message):
+async def test_handle_new_message_ignores_other_channel(mock_save_message):
     """
     Tests that handle_new_message ignores a message from an unmonitored channel.
     """
     # Arrange
-    mock_get_channels.return_value = ["target_channel_name"]
     mock_event = MagicMock()
+    mock_event.chat_id = -1000000054321
     mock_event.chat.title = "some_other_channel"
-    mock_event.chat.id = 54321
 
     # Act
-    await handle_new_message(mock_event)
+    with patch.dict("app.telegram_client._tracked_channels", {TRACKED_PEER_ID: _tracked_channel()}):
+        await handle_new_message(mock_event)
 
     # Assert
     mock_save_message.assert_not_awaited()
 
 @pytest.mark.asyncio
 @patch("app.telegram_client.storage.save_message", new_callable=AsyncMock)
-async def test_handle_new_message_ignores_events_without_chat(mock_save_message):
+async def test_handle_new_message_uses_resolved_title_for_events_without_chat(mock_save_message):
     """
-    Tests that the handler gracefully ignores events that don't have a chat attribute.
+    Tests that the handler falls back to the resolved channel's title when
+    the update carries no chat entity.
     """
     # Arrange
     mock_event = MagicMock()
-    # Remove the 'chat' attribute to simulate an event we can't process
+    mock_event.chat_id = TRACKED_PEER_ID
+    mock_event.message.date = datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc)
+    # Remove the 'chat' attribute to simulate an uncached chat entity
     del mock_event.chat
 
     # Act
-    await handle_new_message(mock_event)
+    with patch.dict("app.telegram_client._tracked_channels", {TRACKED_PEER_ID: _tracked_channel()}):
+        await handle_new_message(mock_event)
+
+    # Assert
+    assert mock_save_message.await_args.kwargs["channel_name"] == "target_channel_name"
+
+@pytest.mark.asyncio
+@patch("app.telegram_client.config.get_channels")
+@patch("app.telegram_client.client")
+async def test_refresh_tracked_channels_registers_handler_with_chats_filter(mock_client, mock_get_channels):
+    """
+    Tests that configured channels are resolved once and used as the handlers' chats filter.
+    """
+    # Arrange
+    from telethon import types
+    from app import telegram_client
+    mock_get_channels.return_value = ["target_channel_name"]
+    entity = types.Channel(id=12345, title="target_channel_name", photo=types.ChatPhotoEmpty(), date=None, access_hash=1)
+    mock_client.get_entity = AsyncMock(return_value=entity)
+    cache = EntityCache()
+
+    # Act
+    with patch.dict("app.telegram_client._tracked_channels", clear=True), \
+            patch("app.telegram_client.entity_cache", cache), \
+            patch("app.entity_cache.storage.find_channel_entity", new_callable=AsyncMock, return_value=None), \
+            patch("app.entity_cache.storage.save_channel_entity", new_callable=AsyncMock):
+        added = await telegram_client.refresh_tracked_channels()
+        tracked = dict(telegram_client._tracked_channels)
+
+    # Assert
+    assert added == [CachedChannel(id=12345, title="target_channel_name", access_hash=1)]
+    assert tracked == {TRACKED_PEER_ID: added[0]}
+    registered = {call.args[0]: call.args[1] for call in mock_client.add_event_handler.call_args_list}
+    assert set(registered) == {
+        telegram_client.handle_new_message,
+        telegram_client.handle_message_edited,
+        telegram_client.handle_message_deleted,
+    }
+    assert all(event_filter.chats == [TRACKED_PEER_ID] for event_filter in registered.values())
+
+
+@pytest.mark.asyncio
+@patch("app.telegram_client.client")
+async def test_resolve_channels_uses_entity_cache_without_rpc(mock_client):
+    """
+    Tests that channels already in the entity cache are resolved without a get_entity call.
+    """
+    # Arrange
+    from app import telegram_client
+    cache = EntityCache()
+    cache._put(CachedChannel(id=12345, title="target_channel_name", access_hash=1, username="target"))
+    mock_client.get_entity = AsyncMock()
+
+    # Act
+    with patch("app.telegram_client.entity_cache", cache):
+        resolved = await telegram_client.resolve_channels(["@target", str(TRACKED_PEER_ID)])
+
+    # Assert
+    mock_client.get_entity.assert_not_awaited()
+    assert list(resolved) == [TRACKED_PEER_ID]
+
+
+def _history_message(message_id, text="Call"):
+    message = MagicMock()
+    message.id = message_id
+    message.text = text
+    message.date = "2023-01-01T12:00:00+00:00"
+    return message
+
+
+def _iter_messages(messages):
+    async def iter_messages(entity, **kwargs):
+        for message in messages:
+            yield message
+    return MagicMock(side_effect=iter_messages)
+
+
+@pytest.mark.asyncio
+@patch("app.telegram_client.storage.save_messages", new_callable=AsyncMock)
+@patch("app.telegram_client.storage.get_latest_message_id", new_callable=AsyncMock)
+@patch("app.telegram_client.client")
+async def test_fetch_and_save_history_resumes_after_latest_stored_message(mock_client, mock_latest_id, mock_save_messages):
+    """
+    Tests that backfill pages forward from the newest stored message and writes in bulk.
+    """
+    # Arrange
+    from app.telegram_client import fetch_and_save_history
+    channel = CachedChannel(id=12345, title="target_channel_name", access_hash=1)
+    mock_client.iter_messages = _iter_messages([_history_message(i) for i in range(101, 106)])
+    mock_latest_id.return_value = 100
+
+    # Act
+    await fetch_and_save_history(channel, page_size=2)
+
+    # Assert
+    mock_client.get_entity.assert_not_called()
+    mock_client.iter_messages.assert_called_once_with(channel.input_peer(), min_id=100, reverse=True)
+    saved = [[row["message_id"] for row in call.args[0]] for call in mock_save_messages.await_args_list]
+    assert saved == [[101, 102], [103, 104], [105]]
+
+
+@pytest.mark.asyncio
+@patch("app.telegram_client.asyncio.sleep", new_callable=AsyncMock)
+@patch("app.telegram_client.storage.save_messages", new_callable=AsyncMock)
+@patch("app.telegram_client.storage.get_latest_message_id", new_callable=AsyncMock)
+@patch("app.telegram_client.client")
+async def test_fetch_and_save_history_waits_out_flood_and_resumes(mock_client, mock_latest_id, mock_save_messages, mock_sleep):
+    """
+    Tests that a FloodWaitError pauses the backfill, which then resumes after the saved pages.
+    """
+    # Arrange
+    from telethon.errors.rpcerrorlist import FloodWaitError
+    from app.telegram_client import fetch_and_save_history
+
+    async def flood_after_two(entity, **kwargs):
+        yield _history_message(101)
+        yield _history_message(102)
+        raise FloodWaitError(request=None, capture=10)
+
+    async def rest(entity, **kwargs):
+        yield _history_message(103)
+
+    channel = CachedChannel(id=12345, title="target_channel_name", access_hash=1)
+    mock_client.iter_messages = MagicMock(side_effect=[flood_after_two(None), rest(None)])
+    mock_latest_id.return_value = 100
+
+    # Act
+    await fetch_and_save_history(channel, page_size=2)
+
+    # Assert
+    mock_sleep.assert_awaited_once_with(15)
+    assert mock_client.iter_messages.call_args_list[1].kwargs["min_id"] == 102
+    saved = [row["message_id"] for call in mock_save_messages.await_args_list for row in call.args[0]]
+    assert saved == [101, 102, 103]
+
+
+@pytest.mark.asyncio
+@patch("app.telegram_client.storage.save_deletions", new_callable=AsyncMock)
+@patch("app.telegram_client.storage.save_edit", new_callable=AsyncMock)
+async def test_edits_and_deletions_of_tracked_channels_are_queued(mock_save_edit, mock_save_deletions):
+    """
+    Tests that edits are queued with their edit time and deletions with the deleted IDs.
+    """
+    # Arrange
+    from app import telegram_client
+    edited = MagicMock()
+    edited.chat_id = TRACKED_PEER_ID
+    edited.message.id = 999
+    edited.message.text = "Test message body. TP2 hit"
+    edited.message.date = datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc)
+    edited.message.edit_date = datetime(2023, 1, 1, 12, 5, tzinfo=timezone.utc)
+    deleted = MagicMock(chat_id=TRACKED_PEER_ID, deleted_ids=[999, 1000])
+    untracked = MagicMock(chat_id=-100999, deleted_ids=[1])
+
+    # Act
+    with patch.dict("app.telegram_client._tracked_channels", {TRACKED_PEER_ID: _tracked_channel()}):
+        await telegram_client.handle_message_edited(edited)
+        await telegram_client.handle_message_deleted(deleted)
+        await telegram_client.handle_message_deleted(untracked)
+
+    # Assert
+    kwargs = mock_save_edit.await_args.kwargs
+    assert (kwargs["channel_id"], kwargs["message_id"], kwargs["body"]) == (12345, 999, "Test message body. TP2 hit")
+    assert kwargs["edited_at"] == datetime(2023, 1, 1, 12, 5, tzinfo=timezone.utc)
+    mock_save_deletions.assert_awaited_once_with(12345, [999, 1000])
+
+
+@pytest.mark.asyncio
+@patch("app.telegram_client.storage.set_media_digests", new_callable=AsyncMock)
+@patch("app.telegram_client.storage.find_stored_media", new_callable=AsyncMock, return_value=None)
+@patch("app.telegram_client.storage.get_media", new_callable=AsyncMock)
+@patch("app.telegram_client.client")
+async def test_download_media_streams_files_into_the_store(
+    mock_client, mock_get_media, mock_find_stored_media, mock_set_media_digests, tmp_path
+):
+    """
+    Tests that media is downloaded to a file and moved into the store, never requested as bytes.
+    """
+    # Arrange
+    import hashlib
+    import os
+    from app import media
+    from app.telegram_client import download_media
+
+    mock_get_media.return_value = {"channel_id": 12345, "file_id": 7, "sha256": None, "thumbnail": "m"}
+
+    async def fake_download(message, file, thumb=None):
+        file.write(b"thumb" if thumb else b"video" * 1000)
+        return file
+
+    mock_client.download_media = AsyncMock(side_effect=fake_download)
+    message = MagicMock()
+
+    # Act
+    with patch.dict("app.telegram_client._tracked_channels", {TRACKED_PEER_ID: _tracked_channel()}), \
+            patch("app.telegram_client.media.describe", return_value={"kind": "video"}), \
+            patch("app.telegram_client.media.config.MEDIA_DIR", str(tmp_path)):
+        mock_client.get_messages = AsyncMock(return_value=message)
+        await download_media(42)
+
+    # Assert
+    video, thumb = hashlib.sha256(b"video" * 1000).hexdigest(), hashlib.sha256(b"thumb").hexdigest()
+    mock_set_media_digests.assert_awaited_once_with(42, video, thumb)
+    assert os.path.exists(media.store_path(video, str(tmp_path)))
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".tmp-")]
+
+
+@pytest.mark.asyncio
+@patch("app.telegram_client.storage.save_message", new_callable=AsyncMock)
+@patch("app.telegram_client.config.get_channels", return_value=["alpha_calls"])
+async def test_fake_client_delivers_new_messages_to_the_registered_handlers(mock_get_channels, mock_save_message):
+    """
+    Tests that with the fake client every due message is stored, and none reaches the edit or deletion handlers.
+    """
+    # Arrange
+    from app import telegram_client
+    from app.fake_telegram import FakeTelegramClient
+
+    fake = FakeTelegramClient(interval=5)
+    now = 1_700_000_000.0
+
+    # Act
+    with patch("app.telegram_client.client", fake), \
+            patch.dict("app.telegram_client._tracked_channels", clear=True), \
+            patch("app.telegram_client.entity_cache", EntityCache()), \
+            patch("app.entity_cache.storage.find_channel_entity", new_callable=AsyncMock, return_value=None), \
+            patch("app.entity_cache.storage.save_channel_entity", new_callable=AsyncMock), \
+            patch("app.telegram_client.storage.save_edit", new_callable=AsyncMock) as mock_save_edit:
+        await telegram_client.refresh_tracked_channels()
+        await fake.post_due(now)
+        await fake.post_due(now + 20)
 
     # Assert
-    mock_save_message.assert_not_awaited() 
\ No newline at end of file
+    assert mock_save_message.await_count == 4
+    mock_save_edit.assert_not_awaited()
+    ids = [call.kwargs["message_id"] for call in mock_save_message.await_args_list]
+    assert ids == sorted(ids) and len(set(ids)) == 4